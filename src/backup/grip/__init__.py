@@ -18,10 +18,50 @@
 # pip install "git+https://github.com/bmeg/grip.git@feature/indexing#subdirectory=gripql/python"
 # pip install orjson
 
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from gripql.util import raise_for_status
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 import gripql
+import logging
+import mmap
+import msgpack
+import multiprocessing
 import orjson
+import os
+import queue
+import struct
+import threading
+import zlib
+
+# Records serialized per batch by the writer thread
+WRITE_BATCH = 10000
+
+# Batches buffered between the GRIP stream and the writer thread
+WRITE_QUEUE = 16
+
+# File buffer of the writer thread
+WRITE_BUFFER = 8 * 1024 * 1024
+
+# Dump formats and their file suffix
+DUMP_FORMATS = {"ndjson": "", "msgpack": ".msgpack"}
+
+# msgpack dumps are a sequence of frames, one per writer batch:
+#
+#   <compressed size: u32 LE> <records: u32 LE> zlib(msgpack({"strings": [...], "records": [...]}))
+#
+# IDs and labels (and the ends of edges) are stored once per frame in the
+# string dictionary and referenced by index:
+#
+#   vertices: [id, label, data]
+#   edges:    [id, label, from, to, data]
+FRAME_HEADER = struct.Struct("<II")
+
+# zlib level of msgpack frames (the dictionary already removes most repetition)
+FRAME_COMPRESSION = 3
 
 
 @dataclass
@@ -31,58 +71,173 @@ class GripConfig:
     host: str
     port: int
 
+    # "http" (JSON, `port`) or "grpc" (protobuf, `grpcPort`) for dumps and loads
+    transport: str = "http"
+    grpcPort: int = 8202
 
-def _getGraphs(grip: GripConfig) -> list[str]:
-    """
-    Utility function to connect to Grip and list all graphs.
-    """
 
-    # Connect to Grip
-    c = _connect(grip)
+@dataclass
+class LoadConfig:
+    """GRIP bulk load options"""
+
+    # A batch is flushed after this many records or bytes, whichever comes first
+    batchCount: int = 10000
+    batchBytes: int = 16 * 1024 * 1024
+
+    # Bulk requests in flight at once
+    inflight: int = 4
+
+    # Processes parsing the dump file (1 parses in the loading process)
+    parsers: int = 1
+
+    # Continue from the restore checkpoint of each dump file
+    resume: bool = False
+
+
+@dataclass
+class Batch:
+    """Records of a dump file sent in a single bulk request"""
+
+    # First line (0-based) and number of lines
+    line: int
+    count: int
+
+    # Byte range in the dump file
+    start: int
+    end: int
+
+    # Bulk request lines
+    payload: list[bytes] = field(default_factory=list, repr=False)
+
+
+@dataclass
+class Checkpoint:
+    """Committed prefix of a dump file, written or loaded in full batches"""
+
+    # Byte offset and number of lines of the prefix
+    offset: int = 0
+    count: int = 0
+
+    # Whether the whole file was committed
+    done: bool = False
 
-    # List Graphs
-    graphs = []
+    # GRIP instance and graph the file was dumped from or loaded into
+    target: str = ""
 
-    for g in c.listGraphs():
-        graphs.append(g)
 
-    return graphs
+@dataclass
+class LoadResult:
+    """Outcome of loading a dump file"""
+
+    path: Path
+    count: int = 0
+    inserted: int = 0
 
+    # Failed batches with their error
+    errors: list[tuple[Batch, str]] = field(default_factory=list)
 
-def _getEdges(grip: GripConfig, graph: str) -> list[str]:
+
+def _iterGraphs(grip: GripConfig) -> Iterator[str]:
     """
-    Utility function to connect to Grip and list all edges.
+    Utility function to connect to Grip and iterate over all graphs.
     """
+    c = _connect(grip)
+    yield from c.listGraphs()
+
 
-    # Connect to Grip
+def _iterEdges(grip: GripConfig, graph: str) -> Iterator[dict]:
+    """
+    Utility function to connect to Grip and stream all edges.
+    """
     c = _connect(grip)
+    G = c.graph(graph)
+
+    # G.V().outE() returns each edge once (from its source vertex)
+    yield from G.V().outE()
 
-    # List Edges
-    edges = []
 
+def _iterVertices(grip: GripConfig, graph: str) -> Iterator[dict]:
+    """
+    Utility function to connect to Grip and stream all vertices.
+    """
+    c = _connect(grip)
     G = c.graph(graph)
 
-    for i in G.V().outE():
-        edges.append(i)
+    yield from G.V()
+
+
+def _getGraphs(grip: GripConfig) -> list[str]:
+    """
+    Utility function to connect to Grip and list all graphs.
+    """
+    return list(_iterGraphs(grip))
 
-    return edges
+
+def _getEdges(grip: GripConfig, graph: str) -> list[dict]:
+    """
+    Utility function to connect to Grip and list all edges.
+    """
+    return list(_iterEdges(grip, graph))
 
 
-def _getVertices(grip: GripConfig, graph: str) -> list[str]:
+def _getVertices(grip: GripConfig, graph: str) -> list[dict]:
     """
     Utility function to connect to Grip and list all vertices.
     """
-    c = _connect(grip)
+    return list(_iterVertices(grip, graph))
 
-    # List Vertices
-    vertices = []
 
-    G = c.graph(graph)
+def _count(query: gripql.Query) -> int:
+    """
+    Counts the results of a query on the server.
+    """
+    for result in query.count():
+        return result.get("count", 0)
+    return 0
+
+
+def _countVertices(grip: GripConfig, graph: str, label: str | None = None) -> int:
+    """
+    Utility function to connect to Grip and count the vertices of a graph
+    (with a given label).
+    """
+    G = _connect(grip).graph(graph)
+    return _count(G.V().hasLabel(label) if label else G.V())
+
+
+def _countEdges(grip: GripConfig, graph: str, label: str | None = None) -> int:
+    """
+    Utility function to connect to Grip and count the edges of a graph (with a
+    given label).
+    """
+    G = _connect(grip).graph(graph)
+    return _count(G.V().outE(label) if label else G.V().outE())
 
-    for i in G.V():
-        vertices.append(i)
 
-    return vertices
+def _getStats(grip: GripConfig, graph: str, jobs: int = 4) -> dict:
+    """
+    Counts the vertices and edges of a graph per label, running `jobs` count
+    queries at a time.
+    """
+    labels = _getLabels(grip, graph)
+    counters = {"vertices": _countVertices, "edges": _countEdges}
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {
+            kind: {label: pool.submit(counters[kind], grip, graph, label) for label in labels[kind]}
+            for kind in counters
+        }
+        counts = {
+            kind: {label: future.result() for label, future in sorted(futures[kind].items())}
+            for kind in counters
+        }
+
+    return {
+        "graph": graph,
+        "vertices": sum(counts["vertices"].values()),
+        "edges": sum(counts["edges"].values()),
+        "labels": counts,
+    }
 
 
 def _connect(grip: GripConfig) -> gripql.Connection:
@@ -100,69 +255,713 @@ def _connect(grip: GripConfig) -> gripql.Connection:
     return client
 
 
-def _dump(grip: GripConfig, graph: str, vertex: bool, edge: bool, out: Path) -> None:
-    # Dump
+def _target(grip: GripConfig, graph: str) -> str:
+    return f"{grip.host}:{grip.port}/{graph}"
+
+
+def _checkpointPath(path: Path, op: str) -> Path:
+    """
+    Checkpoint file of a dump file, for a backup or restore.
+    """
+    return path.with_name(f"{path.name}.{op}.checkpoint")
+
+
+def _readCheckpoint(path: Path, op: str, target: str) -> Checkpoint:
+    """
+    Reads the checkpoint of a dump file, starting over when there is none, when
+    it is for another GRIP instance or graph, or when the file is shorter than
+    the checkpoint (e.g. data lost in a crash).
+    """
+    file = _checkpointPath(path, op)
+    if not file.is_file():
+        return Checkpoint(target=target)
+
+    checkpoint = Checkpoint(**orjson.loads(file.read_bytes()))
+    if checkpoint.target != target or not path.is_file() or path.stat().st_size < checkpoint.offset:
+        logging.warning(f"Ignoring checkpoint '{file}' ({checkpoint.target})")
+        return Checkpoint(target=target)
+
+    return checkpoint
+
+
+def _writeCheckpoint(path: Path, op: str, checkpoint: Checkpoint):
+    """
+    Atomically replaces the checkpoint of a dump file.
+    """
+    file = _checkpointPath(path, op)
+    partial = file.with_name(f".{file.name}.tmp")
+    partial.write_bytes(orjson.dumps(asdict(checkpoint)))
+    os.replace(partial, file)
+
+
+def _encodeLines(records: list[dict]) -> bytes:
+    """
+    Encodes records as NDJSON lines.
+    """
+    return b"".join(orjson.dumps(r, option=orjson.OPT_APPEND_NEWLINE) for r in records)
+
+
+def _frameKeys(kind: str) -> list[str]:
+    return ["_id", "_label", "_from", "_to"] if kind == "edges" else ["_id", "_label"]
+
+
+def _encodeFrame(kind: str, records: list[dict]) -> bytes:
+    """
+    Encodes vertices or edges as a single msgpack frame.
+    """
+    keys = _frameKeys(kind)
+    strings: dict[str, int] = {}
+
+    rows = []
+    for record in records:
+        row: list = [strings.setdefault(record[key], len(strings)) for key in keys]
+        row.append({k: v for k, v in record.items() if k not in keys})
+        rows.append(row)
+
+    body = zlib.compress(msgpack.packb({"strings": list(strings), "records": rows}), FRAME_COMPRESSION)
+    return FRAME_HEADER.pack(len(body), len(records)) + body
+
+
+def _decodeFrame(kind: str, body: bytes) -> list[dict]:
+    """
+    Decodes the (compressed) body of a msgpack frame back into records.
+    """
+    keys = _frameKeys(kind)
+    frame = msgpack.unpackb(zlib.decompress(body))
+    strings = frame["strings"]
+
+    return [
+        {**{key: strings[i] for key, i in zip(keys, row)}, **row[-1]}
+        for row in frame["records"]
+    ]
+
+
+def _write(
+    records: Iterable[dict],
+    path: Path,
+    checkpoint: Checkpoint | None = None,
+    encode: Callable[[list[dict]], bytes] = _encodeLines,
+) -> int:
+    """
+    Writes records to a dump file (NDJSON by default) through a buffered
+    writer thread, so that reading from GRIP overlaps with serializing and
+    writing to disk.
+
+    With a checkpoint, writing continues after its prefix (anything past it is
+    truncated) and the checkpoint is updated after every batch.
+    """
+    batches: queue.Queue[list[dict] | None] = queue.Queue(maxsize=WRITE_QUEUE)
+    errors: list[Exception] = []
+    resumed = checkpoint.count if checkpoint else 0
+
+    def writer():
+        try:
+            offset = checkpoint.offset if checkpoint else 0
+            with open(path, "r+b" if offset else "wb", buffering=WRITE_BUFFER) as f:
+                f.truncate(offset)
+                f.seek(offset)
+                while (batch := batches.get()) is not None:
+                    if batch:
+                        f.write(encode(batch))
+                    if checkpoint and batch:
+                        f.flush()
+                        checkpoint.offset = f.tell()
+                        checkpoint.count += len(batch)
+                        _writeCheckpoint(path, "backup", checkpoint)
+        except Exception as err:
+            errors.append(err)
+
+            # Keep draining after a failure so the reader never blocks
+            while batches.get() is not None:
+                pass
+
+    thread = threading.Thread(target=writer, name=f"writer-{path.name}")
+    thread.start()
+
+    count = 0
+    try:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= WRITE_BATCH:
+                batches.put(batch)
+                count += len(batch)
+                batch = []
+
+                if errors:
+                    break
+
+        batches.put(batch)
+        count += len(batch)
+    finally:
+        batches.put(None)
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    if checkpoint:
+        checkpoint.done = True
+        _writeCheckpoint(path, "backup", checkpoint)
+
+    return resumed + count
+
+
+def _dumpPath(dir: Path, name: str, kind: str, format: str = "ndjson") -> Path:
+    return dir / f"{name}.{kind}{DUMP_FORMATS[format]}"
+
+
+def _findDump(dir: Path, name: str, kind: str) -> Path:
+    """
+    Returns the dump file of a graph or shard in whichever format it was
+    written (the most recent one if there are several).
+    """
+    paths = [_dumpPath(dir, name, kind, format) for format in DUMP_FORMATS]
+    return max(paths, key=lambda p: p.stat().st_mtime if p.is_file() else -1)
+
+
+def _stream(grip: GripConfig, graph: str, query: gripql.Query) -> Iterable[dict]:
+    """
+    Streams the results of a query over the configured transport.
+    """
+    if grip.transport == "grpc":
+        from backup.grip.rpc import _traverse
+
+        return _traverse(grip, graph, query)
+
+    return query
+
+
+def _writeQuery(
+    grip: GripConfig,
+    graph: str,
+    query: gripql.Query,
+    path: Path,
+    kind: str,
+    resume: bool,
+    format: str = "ndjson",
+) -> int:
+    """
+    Writes the results of a query to a dump file, checkpointing as it goes.
+    Resuming skips the records that are already in the file, which relies on
+    GRIP returning them in the same order (i.e. an unchanged graph).
+    """
+    target = _target(grip, graph)
+    checkpoint = _readCheckpoint(path, "backup", target) if resume else Checkpoint(target=target)
+
+    if checkpoint.done:
+        logging.info(f"'{path}' already dumped ({checkpoint.count} records), skipping")
+        return checkpoint.count
+
+    if checkpoint.count:
+        logging.info(f"Resuming dump of '{path}' after {checkpoint.count} records")
+        query = query.skip(checkpoint.count)
+
+    encode = partial(_encodeFrame, kind) if format == "msgpack" else _encodeLines
+    return _write(_stream(grip, graph, query), path, checkpoint, encode)
+
+
+def _dumpQuery(
+    grip: GripConfig, graph: str, kind: str, out: Path, resume: bool = False, format: str = "ndjson"
+) -> int:
+    """
+    Dumps the vertices or edges of a graph on a dedicated connection.
+    """
     conn = _connect(grip)
     G = conn.graph(graph)
 
-    # Run single query to get all vertices
-    # Rather than G.V() and G.V().outE()
-    vertices = G.V()
-
-    # write vertex and edge objects from grip DB to file
-    if vertex:
-        with open(out / f"{graph}.vertices", "wb") as f:
-            for i in vertices:
-                f.write(orjson.dumps(i, option=orjson.OPT_APPEND_NEWLINE))
-
-    if edge:
-        with open(out / f"{graph}.edges", "wb") as f:
-            # Note:
-            #   Using G.V().outE() here to return all edges
-            #   G.V().BothE() would return duplicate edges (outbound and inbound)
-            #   Ref: https://github.com/bmeg/grip/blob/0.8.0/conformance/tests/ot_basic.py#L129-L140
-            for i in vertices.outE():
-                f.write(orjson.dumps(i, option=orjson.OPT_APPEND_NEWLINE))
+    if kind == "vertices":
+        query = G.V()
+    else:
+        # Note:
+        #   Using G.V().outE() here to return all edges
+        #   G.V().BothE() would return duplicate edges (outbound and inbound)
+        #   Ref: https://github.com/bmeg/grip/blob/0.8.0/conformance/tests/ot_basic.py#L129-L140
+        query = G.V().outE()
+
+    path = _dumpPath(out, graph, kind, format)
+    count = _writeQuery(grip, graph, query, path, kind, resume, format)
+
+    logging.debug(f"Dumped {count} {kind} of graph '{graph}' to '{path}'")
+    return count
+
+
+def _dump(
+    grip: GripConfig,
+    graph: str,
+    vertex: bool,
+    edge: bool,
+    out: Path,
+    resume: bool = False,
+    format: str = "ndjson",
+) -> dict[str, int]:
+    """
+    Dumps the vertices and edges of a graph, streaming both concurrently on
+    separate connections. Returns the number of records dumped per kind.
+    """
+    kinds = [kind for kind, enabled in [("vertices", vertex), ("edges", edge)] if enabled]
+
+    with ThreadPoolExecutor(max_workers=max(1, len(kinds))) as pool:
+        futures = {
+            kind: pool.submit(_dumpQuery, grip, graph, kind, out, resume, format) for kind in kinds
+        }
+        counts = {kind: future.result() for kind, future in futures.items()}
 
     # TODO: At this point you will need to reconnect to the new grip instance to load the data that was dumped
+    return counts
+
+
+def _bulkRecord(graph: str, kind: str, line: bytes) -> bytes:
+    """
+    Converts a dumped vertex or edge into a bulk request line.
+    """
+    return _bulkElement(graph, kind, orjson.loads(line))
+
+
+def _bulkElement(graph: str, kind: str, data: dict) -> bytes:
+    """
+    Converts a vertex or edge record into a bulk request line.
+    """
+    _id = data.pop("_id")
+    _label = data.pop("_label")
+
+    if kind == "vertices":
+        element = {"vertex": {"id": _id, "label": _label, "data": data}}
+    else:
+        _from = data.pop("_from")
+        _to = data.pop("_to")
+        element = {"edge": {"id": _id, "label": _label, "from": _from, "to": _to, "data": data}}
+
+    return orjson.dumps({"graph": graph, **element})
+
+
+def _splitRanges(path: Path, size: int, offset: int = 0) -> list[tuple[int, int]]:
+    """
+    Splits a file (from a byte offset) into ranges of about `size` bytes that
+    end on newline boundaries.
+    """
+    total = path.stat().st_size
+    if offset >= total:
+        return []
+
+    ranges = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        start = offset
+        while start < total:
+            newline = m.find(b"\n", min(start + max(1, size), total) - 1)
+            end = total if newline == -1 else newline + 1
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def _parseRange(path: Path, start: int, end: int, graph: str, kind: str) -> list[tuple[int, bytes]]:
+    """
+    Parses a byte range of a dump file into bulk request lines, returned with
+    the size of the dump line each one came from.
+
+    Runs in the parser processes: the file is memory-mapped rather than read.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        lines = m[start:end].splitlines(keepends=True)
+
+    return [(len(line), _bulkRecord(graph, kind, line) if line.strip() else b"") for line in lines]
+
+
+def _parseBatches(
+    path: Path, graph: str, kind: str, loadConfig: LoadConfig, offset: int = 0, line: int = 0
+) -> Iterator[Batch]:
+    """
+    Reads a dump file (from a byte offset) in batches of bulk request lines,
+    parsing newline-aligned ranges of the file in `loadConfig.parsers`
+    processes. Ranges are parsed ahead of the loader, but only a few per
+    process, to keep memory bounded.
+    """
+    ranges = iter(_splitRanges(path, loadConfig.batchBytes, offset))
+
+    batch = Batch(line=line, count=0, start=offset, end=offset)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=loadConfig.parsers, mp_context=context) as pool:
+        pending: deque[Future] = deque()
+        for start, end in ranges:
+            pending.append(pool.submit(_parseRange, path, start, end, graph, kind))
+            if len(pending) >= 2 * loadConfig.parsers:
+                break
+
+        while pending:
+            records = pending.popleft().result()
+            for start, end in ranges:
+                pending.append(pool.submit(_parseRange, path, start, end, graph, kind))
+                break
+
+            for size, record in records:
+                batch.end += size
+                batch.count += 1
+                if record:
+                    batch.payload.append(record)
+
+                if batch.count >= loadConfig.batchCount:
+                    yield batch
+                    batch = Batch(line=batch.line + batch.count, count=0, start=batch.end, end=batch.end)
+
+            # Batches also end with the ranges, which are `batchBytes` long
+            if batch.count:
+                yield batch
+                batch = Batch(line=batch.line + batch.count, count=0, start=batch.end, end=batch.end)
+
+
+def _readBatches(
+    path: Path, graph: str, kind: str, loadConfig: LoadConfig, offset: int = 0, line: int = 0
+) -> Iterator[Batch]:
+    """
+    Reads a dump file (from a byte offset) in batches of bulk request lines.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+
+        batch = Batch(line=line, count=0, start=offset, end=offset)
+        size = 0
+        for record in f:
+            if record.strip():
+                batch.payload.append(_bulkRecord(graph, kind, record))
+            batch.count += 1
+            batch.end += len(record)
+            size += len(record)
+
+            if batch.count >= loadConfig.batchCount or size >= loadConfig.batchBytes:
+                yield batch
+                batch = Batch(line=batch.line + batch.count, count=0, start=batch.end, end=batch.end)
+                size = 0
+
+        if batch.count:
+            yield batch
+
+
+def _readFrames(
+    path: Path, graph: str, kind: str, loadConfig: LoadConfig, offset: int = 0, line: int = 0
+) -> Iterator[Batch]:
+    """
+    Reads a msgpack dump file (from a frame offset) in batches of bulk request
+    lines. Frames are never split, so a batch holds one or more whole frames.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+
+        batch = Batch(line=line, count=0, start=offset, end=offset)
+        while header := f.read(FRAME_HEADER.size):
+            if len(header) < FRAME_HEADER.size:
+                raise EOFError(f"Truncated frame at byte {batch.end} of '{path}'")
+
+            size, count = FRAME_HEADER.unpack(header)
+            body = f.read(size)
+            if len(body) < size:
+                raise EOFError(f"Truncated frame at byte {batch.end} of '{path}'")
+
+            batch.payload += [_bulkElement(graph, kind, r) for r in _decodeFrame(kind, body)]
+            batch.count += count
+            batch.end += FRAME_HEADER.size + size
+
+            if batch.count >= loadConfig.batchCount or batch.end - batch.start >= loadConfig.batchBytes:
+                yield batch
+                batch = Batch(line=batch.line + batch.count, count=0, start=batch.end, end=batch.end)
+
+        if batch.count:
+            yield batch
+
+
+def _bulkSender(
+    grip: GripConfig, graph: str
+) -> tuple[Callable[[list[bytes]], dict], Callable[[], None]]:
+    """
+    Returns a (thread-safe) function sending bulk request lines to a graph
+    over the configured transport, and one closing its connections once the
+    load is over.
+    """
+    if grip.transport == "grpc":
+        from backup.grip.rpc import _bulkSender as _rpcBulkSender
+
+        return _rpcBulkSender(grip)
+
+    conn = _connect(grip)
+    G = conn.graph(graph)
+
+    # One bulk session per sender thread
+    local = threading.local()
+    sessions = []
+    lock = threading.Lock()
+
+    def post(payload: list[bytes]) -> dict:
+        if not hasattr(local, "bulk"):
+            local.bulk = G.bulkAdd()
+            with lock:
+                sessions.append(local.bulk.session)
+
+        response = local.bulk.session.post(local.bulk.url, data=b"\n".join(payload))
+        raise_for_status(response)
+        return response.json()
+
+    def close():
+        for session in sessions:
+            session.close()
+
+    return post, close
 
 
-def _restore(grip: GripConfig, graph: str, dir: Path):
+def _bulkLoad(
+    grip: GripConfig,
+    graph: str,
+    batches: Iterable[Batch],
+    loadConfig: LoadConfig,
+    path: Path,
+    checkpoint: Checkpoint | None = None,
+) -> LoadResult:
+    """
+    Sends batches as bulk requests, keeping up to `loadConfig.inflight`
+    requests in flight. Reading stops while that many are pending
+    (backpressure), so memory is bounded by the batch size and not the graph.
+
+    The checkpoint advances over batches as they are confirmed, in order, and
+    stops at the first failed batch.
+    """
+    post, close = _bulkSender(grip, graph)
+
+    def send(batch: Batch) -> dict:
+        try:
+            return post(batch.payload)
+        finally:
+            batch.payload = []
+
+    result = LoadResult(path=path, count=checkpoint.count if checkpoint else 0)
+    sent = 0
+
+    def collect(batch: Batch, future: Future):
+        nonlocal sent
+        try:
+            response = future.result()
+            result.inserted += response.get("insertCount", 0)
+            if response.get("errorCount", 0):
+                result.errors.append((batch, f"{response['errorCount']} records failed to insert"))
+            elif checkpoint and checkpoint.offset == batch.start:
+                checkpoint.offset = batch.end
+                checkpoint.count = batch.line + batch.count
+                _writeCheckpoint(path, "restore", checkpoint)
+        except Exception as err:
+            result.errors.append((batch, str(err)))
+
+        result.count += batch.count
+        sent += 1
+        if sent % 10 == 0:
+            logging.info(f"Loaded {result.count} records of '{path}' into graph '{graph}'")
+
+    pending: deque[tuple[Batch, Future]] = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, loadConfig.inflight)) as pool:
+            for batch in batches:
+                # Backpressure: wait for the oldest request before reading more
+                while len(pending) >= max(1, loadConfig.inflight):
+                    collect(*pending.popleft())
+
+                pending.append((batch, pool.submit(send, batch)))
+
+            while pending:
+                collect(*pending.popleft())
+    finally:
+        close()
+
+    if checkpoint and not result.errors:
+        checkpoint.done = True
+        _writeCheckpoint(path, "restore", checkpoint)
+
+    logging.info(
+        f"Loaded '{path}' into graph '{graph}': {result.inserted} inserted, {len(result.errors)} failed batches"
+    )
+    return result
+
+
+def _load(
+    grip: GripConfig, graph: str, path: Path, kind: str, loadConfig: LoadConfig | None = None
+) -> LoadResult:
+    """
+    Loads a vertices or edges dump file into a graph in pipelined batches,
+    continuing from its restore checkpoint with `loadConfig.resume`.
+    """
+    loadConfig = loadConfig or LoadConfig()
+
+    target = _target(grip, graph)
+    if loadConfig.resume:
+        checkpoint = _readCheckpoint(path, "restore", target)
+    else:
+        checkpoint = Checkpoint(target=target)
+
+    if checkpoint.done:
+        logging.info(f"'{path}' already loaded into graph '{graph}', skipping")
+        return LoadResult(path=path, count=checkpoint.count)
+
+    if checkpoint.count:
+        logging.info(f"Resuming load of '{path}' from line {checkpoint.count + 1}")
+
+    if path.suffix == DUMP_FORMATS["msgpack"]:
+        reader = _readFrames
+    elif loadConfig.parsers > 1:
+        reader = _parseBatches
+    else:
+        reader = _readBatches
+    batches = reader(path, graph, kind, loadConfig, checkpoint.offset, checkpoint.count)
+
+    return _bulkLoad(grip, graph, batches, loadConfig, path, checkpoint)
+
+
+def _restore(
+    grip: GripConfig, graph: str, dir: Path, loadConfig: LoadConfig | None = None
+) -> list[LoadResult]:
+    """
+    Restores the vertices and then the edges of a graph.
+    """
     ## Clean/Delete existing graph
     ## GRIP initdb job (templates/post-install)
 
     ## Load
+    return [
+        _load(grip, graph, _findDump(dir, graph, kind), kind, loadConfig)
+        for kind in ["vertices", "edges"]
+    ]
+
+
+def _getLabels(grip: GripConfig, graph: str) -> dict[str, list[str]]:
+    """
+    Utility function to connect to Grip and list the vertex and edge labels of
+    a graph.
+    """
     conn = _connect(grip)
     G = conn.graph(graph)
 
-    bulkV = G.bulkAdd()
-    with open(dir / f"{graph}.vertices", "rb") as f:
-        count = 0
-        for i in f:
-            data = orjson.loads(i)
-            _id = data["_id"]
-            _label = data["_label"]
-            del data["_id"], data["_label"]
-            bulkV.addVertex(_id, _label, data)
-            count += 1
-            if count % 10000 == 0:
-                print("loaded %d vertices" % count)
-    err = bulkV.execute()
-    print("Vertices load res: ", str(err))
-
-    bulkE = G.bulkAdd()
-    with open(dir / f"{graph}.edges", "rb") as f:
-        count = 0
-        for i in f:
-            data = orjson.loads(i)
-            _id = data["_id"]
-            _label = data["_label"]
-            _to = data["_to"]
-            _from = data["_from"]
-            del data["_id"], data["_label"], data["_to"], data["_from"]
-            bulkE.addEdge(_to, _from, _label, data=data, id=_id)
-            count += 1
-            if count % 10000 == 0:
-                print("loaded %d edges" % count)
-    err = bulkE.execute()
-    print("Edges load res: ", str(err))
+    labels = G.listLabels()
+
+    return {
+        "vertices": labels.get("vertex_labels", []),
+        "edges": labels.get("edge_labels", []),
+    }
+
+
+def _shardsDir(dir: Path, graph: str) -> Path:
+    """
+    Returns the directory of a graph's per-label shards.
+    """
+    return dir / f"{graph}.shards"
+
+
+def _dumpShard(
+    grip: GripConfig,
+    graph: str,
+    kind: str,
+    label: str,
+    out: Path,
+    resume: bool = False,
+    format: str = "ndjson",
+) -> dict:
+    """
+    Dumps the vertices or edges of a single label on a dedicated connection.
+    """
+    conn = _connect(grip)
+    G = conn.graph(graph)
+
+    if kind == "vertices":
+        query = G.V().hasLabel(label)
+    else:
+        query = G.V().outE(label)
+
+    path = _dumpPath(_shardsDir(out, graph), label.replace("/", "_"), kind, format)
+    count = _writeQuery(grip, graph, query, path, kind, resume, format)
+
+    logging.debug(f"Dumped {count} {kind} with label '{label}' of graph '{graph}'")
+    return {"kind": kind, "label": label, "file": path.name, "count": count}
+
+
+def _dumpSharded(
+    grip: GripConfig,
+    graph: str,
+    vertex: bool,
+    edge: bool,
+    out: Path,
+    jobs: int = 1,
+    resume: bool = False,
+    format: str = "ndjson",
+) -> dict:
+    """
+    Dumps a graph as one NDJSON file per label and kind (DIR/GRAPH.shards),
+    exporting `jobs` labels at a time. A manifest records the count per shard.
+    """
+    labels = _getLabels(grip, graph)
+    kinds = [kind for kind, enabled in [("vertices", vertex), ("edges", edge)] if enabled]
+
+    shards = _shardsDir(out, graph)
+    shards.mkdir(parents=True, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [
+            pool.submit(_dumpShard, grip, graph, kind, label, out, resume, format)
+            for kind in kinds
+            for label in labels[kind]
+        ]
+        manifest = {"graph": graph, "shards": [future.result() for future in futures]}
+
+    (shards / "manifest.json").write_bytes(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+    return manifest
+
+
+def _restoreSharded(
+    grip: GripConfig, graph: str, dir: Path, jobs: int = 1, loadConfig: LoadConfig | None = None
+) -> list[LoadResult]:
+    """
+    Loads the shards of a graph dumped by `_dumpSharded`, `jobs` shards at a
+    time. All vertex shards are loaded before the edge shards.
+    """
+    shards = _shardsDir(dir, graph)
+    manifest = orjson.loads((shards / "manifest.json").read_bytes())
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for kind in ["vertices", "edges"]:
+            futures = [
+                pool.submit(_load, grip, graph, shards / shard["file"], kind, loadConfig)
+                for shard in manifest["shards"]
+                if shard["kind"] == kind
+            ]
+            results += [future.result() for future in futures]
+
+    return results
+
+
+def _findGraphs(dir: Path) -> list[str]:
+    """
+    Lists the graphs dumped in a directory, whether whole, sharded or
+    incremental.
+    """
+    graphs = set()
+    for path in dir.iterdir():
+        name = path.name
+        if path.is_dir() and name.endswith(".shards") and (path / "manifest.json").is_file():
+            graphs.add(name.removesuffix(".shards"))
+        elif name.endswith(".incremental.json"):
+            graphs.add(name.removesuffix(".incremental.json"))
+        elif path.is_file():
+            for kind in ["vertices", "edges"]:
+                for suffix in DUMP_FORMATS.values():
+                    if name.endswith(f".{kind}{suffix}"):
+                        graphs.add(name.removesuffix(f".{kind}{suffix}"))
+
+    # GRAPH.delta.* files belong to an incremental dump of GRAPH
+    return sorted(g for g in graphs if not (g.endswith(".delta") and g.removesuffix(".delta") in graphs))
+
+
+def _ensureGraph(grip: GripConfig, graph: str):
+    """
+    Creates a graph if it doesn't exist yet.
+    """
+    conn = _connect(grip)
+
+    if graph not in conn.listGraphs():
+        logging.info(f"Creating graph '{graph}'")
+        conn.addGraph(graph)
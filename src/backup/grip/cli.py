@@ -1,14 +1,28 @@
 from backup.grip import (
+    DUMP_FORMATS,
     GripConfig,
-    _getGraphs,
-    _getEdges,
-    _getVertices,
+    LoadConfig,
+    LoadResult,
+    _getStats,
+    _iterGraphs,
     _dump as _gripDump,
+    _dumpSharded as _gripDumpSharded,
+    _ensureGraph,
+    _findGraphs,
+    _getGraphs,
     _restore as _gripRestore,
+    _restoreSharded as _gripRestoreSharded,
+    _shardsDir,
+)
+from backup.grip.incremental import (
+    _dumpIncremental as _gripDumpIncremental,
+    _manifestPath as _incrementalManifest,
+    _restoreIncremental as _gripRestoreIncremental,
 )
 from backup.options import (
     dir_flags,
 )
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import click
 import logging
@@ -40,6 +54,30 @@ def grip_host_flags(fn):
     return fn
 
 
+# GRIP transport flags
+def grip_transport_flags(fn):
+    options = [
+        click.option(
+            "--transport",
+            envvar="GRIP_TRANSPORT",
+            default="http",
+            show_default=True,
+            type=click.Choice(["http", "grpc"]),
+            help="Stream dumps and loads over HTTP/JSON or gRPC ($GRIP_TRANSPORT)",
+        ),
+        click.option(
+            "--grpc-port",
+            envvar="GRIP_GRPC_PORT",
+            default=8202,
+            show_default=True,
+            help="GRIP gRPC port ($GRIP_GRPC_PORT)",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
 # GRIP Graph Flags
 def grip_flags(fn):
     options = [
@@ -66,6 +104,159 @@ def grip_flags(fn):
     return fn
 
 
+# Sharded export flags
+def grip_shard_flags(fn):
+    options = [
+        click.option(
+            "--sharded",
+            is_flag=True,
+            default=False,
+            help="Export one file per label (DIR/GRAPH.shards)",
+        ),
+        click.option(
+            "--jobs",
+            "-j",
+            default=1,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Labels exported or loaded at a time with --sharded",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+# Bulk load flags
+def grip_load_flags(fn):
+    options = [
+        click.option(
+            "--batch-count",
+            default=10000,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Records per bulk request",
+        ),
+        click.option(
+            "--batch-size",
+            default=16,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Maximum MiB of dump data per bulk request",
+        ),
+        click.option(
+            "--inflight",
+            default=4,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Bulk requests in flight at once",
+        ),
+        click.option(
+            "--parsers",
+            default=1,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Processes parsing each dump file",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+# Multi-graph flags
+def grip_graphs_flags(fn):
+    options = [
+        click.option(
+            "--all-graphs",
+            is_flag=True,
+            default=False,
+            help="Every graph on the server (backup) or in --dir (restore), schema graphs included",
+        ),
+        click.option(
+            "--graph-jobs",
+            default=2,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Graphs backed up or restored at a time",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+# Dump format flags
+def grip_format_flags(fn):
+    options = [
+        click.option(
+            "--format",
+            "-F",
+            default="ndjson",
+            show_default=True,
+            type=click.Choice(list(DUMP_FORMATS)),
+            help="Dump format (msgpack: compressed frames with a string dictionary)",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+# Resume flags
+def grip_resume_flags(fn):
+    options = [
+        click.option(
+            "--resume",
+            is_flag=True,
+            default=False,
+            help="Continue from the checkpoints of a previous, interrupted run",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+def _schemaGraph(graph: str) -> str:
+    # TODO: Better way to handle GRIP graph schemas?
+    return f"{graph}__schema__"
+
+
+def _restoreGraph(
+    conf: GripConfig, graph: str, dir: Path, sharded: bool, jobs: int, loadConf: LoadConfig
+) -> list[LoadResult]:
+    """
+    Restores a single graph, detecting sharded and incremental dumps from their
+    manifest and creating the graph first if needed.
+    """
+    _ensureGraph(conf, graph)
+
+    if sharded or (_shardsDir(dir, graph) / "manifest.json").is_file():
+        return _gripRestoreSharded(conf, graph, dir, jobs, loadConf)
+    elif _incrementalManifest(dir, graph).is_file():
+        return _gripRestoreIncremental(conf, graph, dir, loadConf)
+    else:
+        return _gripRestore(conf, graph, dir, loadConf)
+
+
+def _report(results: list[LoadResult]):
+    """
+    Reports failed batches with the lines involved, failing the command if any.
+    """
+    failed = 0
+    for result in results:
+        for batch, error in result.errors:
+            failed += 1
+            logging.error(
+                f"Failed to load lines {batch.line + 1}-{batch.line + batch.count} "
+                f"(bytes {batch.start}-{batch.end}) of '{result.path}': {error}"
+            )
+
+    if failed:
+        raise click.ClickException(f"{failed} batches failed to load")
+
+
 @click.group()
 def grip():
     """Commands for GRIP backups."""
@@ -74,40 +265,180 @@ def grip():
 
 @grip.command()
 @grip_host_flags
-def ls(host: str, port: int):
-    """list GRIP vertices and/or edges"""
+@click.option(
+    "--stats",
+    is_flag=True,
+    default=False,
+    help="Count the vertices and edges of each graph per label",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Count queries run at a time with --stats",
+)
+def ls(host: str, port: int, stats: bool, jobs: int):
+    """list GRIP graphs"""
     conf = GripConfig(host=host, port=port)
 
-    for v in _getGraphs(conf):
-        click.echo(json.dumps(v, indent=2))
+    for v in _iterGraphs(conf):
+        if stats:
+            click.echo(json.dumps(_getStats(conf, v, jobs), indent=2))
+        else:
+            click.echo(json.dumps(v, indent=2))
 
 
 @grip.command()
 @grip_host_flags
+@grip_transport_flags
 @grip_flags
 @dir_flags
-def backup(host: str, port: int, graph: str, vertex: bool, edge: bool, dir: Path):
+@grip_shard_flags
+@grip_graphs_flags
+@grip_format_flags
+@grip_resume_flags
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only write the records added, changed or deleted since the previous backup",
+)
+@click.option(
+    "--base",
+    type=click.Path(path_type=Path, file_okay=False),
+    default=None,
+    help="Previous backup directory for --incremental (default: latest sibling of --dir)",
+)
+def backup(
+    host: str,
+    port: int,
+    transport: str,
+    grpc_port: int,
+    graph: str,
+    vertex: bool,
+    edge: bool,
+    dir: Path,
+    sharded: bool,
+    jobs: int,
+    all_graphs: bool,
+    graph_jobs: int,
+    format: str,
+    resume: bool,
+    incremental: bool,
+    base: Path | None,
+):
     """grip ➜ local"""
-    conf = GripConfig(host=host, port=port)
+    conf = GripConfig(host=host, port=port, transport=transport, grpcPort=grpc_port)
+
+    if incremental and (sharded or resume):
+        raise click.UsageError("--incremental can't be combined with --sharded or --resume")
 
     # Set timestamp
     dir.mkdir(parents=True, exist_ok=True)
 
-    logging.debug(f"Backing up GRIP graph '{graph}' to directory '{dir}'")
-    _gripDump(conf, graph, vertex, edge, dir)
+    graphs = _getGraphs(conf) if all_graphs else [graph, _schemaGraph(graph)]
 
-    # TODO: Better way to handle GRIP graph schemas?
-    schema = f"{graph}__schema__"
-    logging.debug(f"Backing up GRIP graph '{schema}' to directory '{dir}'")
-    _gripDump(conf, schema, vertex, edge, dir)
+    # Dump graphs (and their schema) concurrently
+    with ThreadPoolExecutor(max_workers=graph_jobs) as pool:
+        futures = []
+        for g in graphs:
+            logging.debug(f"Backing up GRIP graph '{g}' to directory '{dir}'")
+
+            # The (small) schema graphs are always dumped as a whole
+            isSchema = g.endswith("__schema__")
+            if sharded and not isSchema:
+                dump = pool.submit(_gripDumpSharded, conf, g, vertex, edge, dir, jobs, resume, format)
+            elif incremental and not isSchema:
+                dump = pool.submit(_gripDumpIncremental, conf, g, vertex, edge, dir, base, format)
+            else:
+                dump = pool.submit(_gripDump, conf, g, vertex, edge, dir, resume, format)
+            futures.append(dump)
+
+        for future in futures:
+            future.result()
 
 
 @grip.command()
 @grip_host_flags
+@grip_transport_flags
 @grip_flags
 @dir_flags
-def restore(host: str, port: int, graph: str, dir: Path):
+@grip_shard_flags
+@grip_graphs_flags
+@grip_load_flags
+@grip_resume_flags
+def restore(
+    host: str,
+    port: int,
+    transport: str,
+    grpc_port: int,
+    graph: str,
+    vertex: bool,
+    edge: bool,
+    dir: Path,
+    sharded: bool,
+    jobs: int,
+    all_graphs: bool,
+    graph_jobs: int,
+    batch_count: int,
+    batch_size: int,
+    inflight: int,
+    parsers: int,
+    resume: bool,
+):
     """local ➜ grip"""
-    conf = GripConfig(host=host, port=port)
+    conf = GripConfig(host=host, port=port, transport=transport, grpcPort=grpc_port)
+    loadConf = LoadConfig(
+        batchCount=batch_count,
+        batchBytes=batch_size * 1024**2,
+        inflight=inflight,
+        parsers=parsers,
+        resume=resume,
+    )
+
+    # The graph along with its schema, if it was dumped
+    found = _findGraphs(dir)
+    if all_graphs:
+        graphs = found
+    else:
+        graphs = [g for g in [graph, _schemaGraph(graph)] if g == graph or g in found]
+
+    with ThreadPoolExecutor(max_workers=graph_jobs) as pool:
+        futures = []
+        for g in graphs:
+            logging.debug(f"Restoring GRIP graph '{g}' from directory '{dir}'")
+            futures.append(
+                pool.submit(_restoreGraph, conf, g, dir, sharded and g == graph, jobs, loadConf)
+            )
+
+        results = [result for future in futures for result in future.result()]
+
+    _report(results)
+
+
+@grip.command()
+@click.option(
+    "--proto",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="GRIP's gripql.proto (gripql/gripql.proto in the GRIP repository)",
+)
+@click.option(
+    "--out",
+    "-o",
+    required=True,
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Directory of the generated modules, to add to the PYTHONPATH",
+)
+def stubs(proto: Path, out: Path):
+    """gripql.proto ➜ gRPC modules for --transport grpc"""
+    from backup.grip.rpc import _generate
+
+    try:
+        _generate(proto, out)
+    except RuntimeError as err:
+        raise click.ClickException(str(err))
 
-    _ = _gripRestore(conf, graph, dir)
+    click.echo(f"Generated gripql_pb2 and gripql_pb2_grpc in '{out}'")
@@ -0,0 +1,291 @@
+### Delta exports of GRIP graphs:
+#
+# DIR (timestamped, see entrypoint.sh)
+# ├─ GRAPH.incremental.json          <-- manifest: base run, format and counts
+# ├─ GRAPH.vertices.index            <-- sqlite index of `_id -> blake2b(record)`
+# ├─ GRAPH.edges.index
+# ├─ GRAPH.vertices / GRAPH.edges    <-- full dump (first run of a chain)
+# ├─ GRAPH.delta.vertices            <-- added or changed records (later runs)
+# ├─ GRAPH.delta.edges
+# ├─ GRAPH.delta.vertices.deleted    <-- `{"_id": ...}` of deleted records
+# └─ GRAPH.delta.edges.deleted
+#
+# Every run streams the whole graph (GRIP has no change tracking) but only
+# writes the records whose hash differs from the previous run's index, so disk
+# and S3 volume follow the churn rate. Restoring loads the full dump at the
+# start of the chain, then applies each delta in order.
+
+from backup.grip import (
+    WRITE_BATCH,
+    GripConfig,
+    LoadConfig,
+    LoadResult,
+    _connect,
+    _dumpPath,
+    _encodeFrame,
+    _encodeLines,
+    _findDump,
+    _load,
+    _stream,
+    _write,
+)
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashlib import blake2b
+from pathlib import Path
+from typing import Iterator
+import logging
+import orjson
+import os
+import sqlite3
+
+
+def _manifestPath(dir: Path, graph: str) -> Path:
+    return dir / f"{graph}.incremental.json"
+
+
+def _indexPath(dir: Path, graph: str, kind: str) -> Path:
+    return dir / f"{graph}.{kind}.index"
+
+
+def _deletedPath(dir: Path, graph: str, kind: str) -> Path:
+    return dir / f"{graph}.delta.{kind}.deleted"
+
+
+def _hash(record: dict) -> bytes:
+    """
+    Content hash of a vertex or edge (independent of key order).
+    """
+    return blake2b(orjson.dumps(record, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+
+
+def _readManifest(dir: Path, graph: str) -> dict | None:
+    """
+    Reads the manifest of an incremental dump, if there is one.
+    """
+    manifest = _manifestPath(dir, graph)
+    if not manifest.is_file():
+        return None
+
+    return orjson.loads(manifest.read_bytes())
+
+
+def _findBase(dir: Path, graph: str) -> Path | None:
+    """
+    Returns the most recent sibling dump directory with an incremental dump of
+    the graph, relying on the timestamped directory names sorting in order.
+    """
+    if not dir.parent.is_dir():
+        return None
+
+    previous = [
+        d
+        for d in dir.parent.iterdir()
+        if d.is_dir() and d.name < dir.name and _manifestPath(d, graph).is_file()
+    ]
+
+    return max(previous, default=None)
+
+
+def _chain(dir: Path, graph: str) -> list[Path]:
+    """
+    Returns the dump directories to restore, from the full dump to `dir`.
+    """
+    chain = []
+    current: Path | None = dir
+    while current is not None:
+        manifest = _readManifest(current, graph)
+        if manifest is None:
+            raise FileNotFoundError(f"No incremental dump of '{graph}' found in {current}")
+
+        chain.append(current)
+        current = current / manifest["base"] if manifest["base"] else None
+
+    return chain[::-1]
+
+
+def _openIndex(path: Path, base: Path | None) -> sqlite3.Connection:
+    """
+    Creates an empty index, attaching the previous run's index (read-only) as
+    `base` when there is one.
+    """
+    path.unlink(missing_ok=True)
+
+    db = sqlite3.connect(path.resolve().as_uri(), uri=True)
+    db.executescript(
+        """
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE records (id TEXT PRIMARY KEY, hash BLOB NOT NULL) WITHOUT ROWID;
+        """
+    )
+
+    if base:
+        db.execute("ATTACH DATABASE ? AS base", (f"{base.resolve().as_uri()}?mode=ro",))
+
+    return db
+
+
+def _dumpDelta(
+    grip: GripConfig, graph: str, kind: str, out: Path, base: Path | None, format: str = "ndjson"
+) -> dict:
+    """
+    Dumps the vertices or edges of a graph that changed since the base run (or
+    all of them without a base), building the index for the next run.
+    """
+    conn = _connect(grip)
+    G = conn.graph(graph)
+    query = G.V() if kind == "vertices" else G.V().outE()
+
+    index = _indexPath(out, graph, kind)
+    building = index.with_name(f".{index.name}.tmp")
+    baseIndex = _indexPath(base, graph, kind) if base else None
+    db = _openIndex(building, baseIndex)
+
+    counts = {"records": 0, "upserted": 0, "deleted": 0}
+
+    def changed() -> Iterator[dict]:
+        rows = []
+        for record in _stream(grip, graph, query):
+            digest = _hash(record)
+            rows.append((record["_id"], digest))
+            counts["records"] += 1
+
+            previous = None
+            if baseIndex:
+                previous = db.execute(
+                    "SELECT hash FROM base.records WHERE id = ?", (record["_id"],)
+                ).fetchone()
+
+            if previous is None or previous[0] != digest:
+                counts["upserted"] += 1
+                yield record
+
+            if len(rows) >= WRITE_BATCH:
+                db.executemany("INSERT OR REPLACE INTO records VALUES (?, ?)", rows)
+                rows = []
+
+        db.executemany("INSERT OR REPLACE INTO records VALUES (?, ?)", rows)
+
+    try:
+        name = f"{graph}.delta" if baseIndex else graph
+        encode = partial(_encodeFrame, kind) if format == "msgpack" else _encodeLines
+        _ = _write(changed(), _dumpPath(out, name, kind, format), None, encode)
+
+        if baseIndex:
+            deleted = db.execute(
+                "SELECT id FROM base.records WHERE id NOT IN (SELECT id FROM main.records)"
+            )
+            counts["deleted"] = _write(({"_id": id} for id, in deleted), _deletedPath(out, graph, kind))
+
+        db.commit()
+    finally:
+        db.close()
+
+    os.replace(building, index)
+
+    logging.debug(f"Dumped {kind} of graph '{graph}' against {base}: {counts}")
+    return counts
+
+
+def _dumpIncremental(
+    grip: GripConfig,
+    graph: str,
+    vertex: bool,
+    edge: bool,
+    out: Path,
+    base: Path | None = None,
+    format: str = "ndjson",
+) -> dict:
+    """
+    Dumps the vertices and edges of a graph as a delta against the base run
+    (by default the latest sibling of `out`), or in full when there is none.
+    """
+    kinds = [kind for kind, enabled in [("vertices", vertex), ("edges", edge)] if enabled]
+
+    base = base or _findBase(out, graph)
+    if base and base.resolve() == out.resolve():
+        base = None
+
+    # A chain only continues with the same kinds, as every run depends on all
+    # the previous ones
+    previous = _readManifest(base, graph) if base else None
+    if previous is None or sorted(previous["kinds"]) != sorted(kinds):
+        if base:
+            logging.warning(f"Cannot continue the incremental dump in {base}, dumping '{graph}' in full")
+        base = None
+
+    with ThreadPoolExecutor(max_workers=max(1, len(kinds))) as pool:
+        futures = {kind: pool.submit(_dumpDelta, grip, graph, kind, out, base, format) for kind in kinds}
+        counts = {kind: future.result() for kind, future in futures.items()}
+
+    # The manifest is written last: runs without one are never used as a base
+    manifest = {
+        "graph": graph,
+        "base": os.path.relpath(base, out) if base else None,
+        "format": format,
+        "kinds": counts,
+    }
+    _manifestPath(out, graph).write_bytes(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+    return manifest
+
+
+def _deleteRecords(grip: GripConfig, graph: str, kind: str, path: Path, batchCount: int) -> int:
+    """
+    Deletes the vertices or edges listed in a delta's `.deleted` file.
+    """
+    conn = _connect(grip)
+    G = conn.graph(graph)
+
+    def delete(ids: list[str]):
+        if kind == "vertices":
+            G.delete(vertices=ids)
+        else:
+            G.delete(edges=ids)
+
+    count = 0
+    with open(path, "rb") as f:
+        ids = []
+        for line in f:
+            ids.append(orjson.loads(line)["_id"])
+            if len(ids) >= batchCount:
+                delete(ids)
+                count += len(ids)
+                ids = []
+
+        if ids:
+            delete(ids)
+            count += len(ids)
+
+    logging.debug(f"Deleted {count} {kind} of graph '{graph}' listed in '{path}'")
+    return count
+
+
+def _restoreIncremental(
+    grip: GripConfig, graph: str, dir: Path, loadConfig: LoadConfig | None = None
+) -> list[LoadResult]:
+    """
+    Restores an incremental dump: the full dump at the start of its chain,
+    then the changes of every delta in order. Within a delta, vertices and
+    edges are upserted before edges and vertices are deleted.
+    """
+    loadConfig = loadConfig or LoadConfig()
+    chain = _chain(dir, graph)
+
+    results = []
+    for i, run in enumerate(chain):
+        kinds = list(_readManifest(run, graph)["kinds"])
+        name = f"{graph}.delta" if i else graph
+        logging.info(f"Restoring {'delta' if i else 'full dump'} '{run}' of graph '{graph}'")
+
+        for kind in kinds:
+            results.append(_load(grip, graph, _findDump(run, name, kind), kind, loadConfig))
+
+        # Edges are deleted before the vertices they connect
+        for kind in reversed(kinds):
+            deleted = _deletedPath(run, graph, kind)
+            if i and deleted.is_file():
+                _ = _deleteRecords(grip, graph, kind, deleted, loadConfig.batchCount)
+
+    return results
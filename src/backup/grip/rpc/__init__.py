@@ -0,0 +1,148 @@
+### gRPC transport for GRIP dumps and loads:
+#
+# GRIP serves its Query and Edit services over gRPC (8202) as well as HTTP/JSON
+# (8201, a gateway in front of the same services). Traversal results and bulk
+# elements are then framed as protobuf instead of one JSON document per element.
+#
+# The gripql Python client doesn't ship the generated protobuf modules, so they
+# have to be generated from GRIP's gripql.proto and made importable (e.g. with
+# PYTHONPATH) as `gripql_pb2` and `gripql_pb2_grpc`:
+#
+# pip install -e '.[grpc]'
+# bak grip stubs --proto grip/gripql/gripql.proto --out /app/gripql
+# PYTHONPATH=/app/gripql bak grip backup --transport grpc ...
+#
+# Ref: https://github.com/bmeg/grip/blob/0.8.0/gripql/gripql.proto
+
+from backup.grip import WRITE_BATCH, GripConfig
+from pathlib import Path
+from typing import Callable, Iterator
+import gripql
+import itertools
+import orjson
+
+# Maximum gRPC message size (a single large vertex must fit)
+GRPC_MESSAGE = 64 * 1024 * 1024
+
+
+def _stubs():
+    """
+    Imports grpc, protobuf and the generated gripql modules, failing with a
+    hint on how to get them.
+    """
+    try:
+        from google.protobuf import json_format
+        import grpc
+        import gripql_pb2
+        import gripql_pb2_grpc
+    except ImportError as err:
+        raise RuntimeError(
+            f"--transport grpc requires grpcio and the gripql_pb2/gripql_pb2_grpc modules generated "
+            f"from GRIP's gripql.proto (see backup/grip/rpc): {err}"
+        ) from err
+
+    return grpc, json_format, gripql_pb2, gripql_pb2_grpc
+
+
+def _generate(proto: Path, out: Path):
+    """
+    Generates the `gripql_pb2` and `gripql_pb2_grpc` modules from GRIP's
+    gripql.proto into `out`, with the well-known and Google API protos of
+    grpcio-tools and googleapis-common-protos on the include path.
+    """
+    try:
+        from google.api import annotations_pb2
+        from grpc_tools import protoc
+        import grpc_tools
+    except ImportError as err:
+        raise RuntimeError(
+            f"Generating the gripql modules requires the grpc extra (pip install '.[grpc]'): {err}"
+        ) from err
+
+    includes = [
+        proto.parent,
+        Path(grpc_tools.__file__).parent / "_proto",
+        Path(annotations_pb2.__file__).parents[2],
+    ]
+
+    out.mkdir(parents=True, exist_ok=True)
+    code = protoc.main(
+        [
+            "grpc_tools.protoc",
+            *[f"-I{include}" for include in includes],
+            f"--python_out={out}",
+            f"--grpc_python_out={out}",
+            proto.as_posix(),
+        ]
+    )
+    if code != 0:
+        raise RuntimeError(f"protoc failed to compile '{proto}' (exit code {code})")
+
+
+def _channel(grip: GripConfig):
+    grpc, *_ = _stubs()
+
+    return grpc.insecure_channel(
+        f"{grip.host}:{grip.grpcPort}",
+        options=[
+            ("grpc.max_receive_message_length", GRPC_MESSAGE),
+            ("grpc.max_send_message_length", GRPC_MESSAGE),
+        ],
+    )
+
+
+def _record(result: dict) -> dict:
+    """
+    Converts a traversal result into a dump record ({"_id", "_label", ...}),
+    as returned by the HTTP API.
+    """
+    element = result.get("vertex") or result.get("edge") or result
+
+    # Already flattened
+    if "data" not in element and "_id" in element:
+        return element
+
+    record = {"_id": element.get("id", element.get("gid")), "_label": element.get("label")}
+    if "edge" in result:
+        record["_from"] = element.get("from")
+        record["_to"] = element.get("to")
+
+    return {**record, **(element.get("data") or {})}
+
+
+def _traverse(grip: GripConfig, graph: str, query: gripql.Query) -> Iterator[dict]:
+    """
+    Streams the results of a traversal over gRPC, converting the protobuf
+    messages to records in batches.
+    """
+    _, json_format, gripql_pb2, gripql_pb2_grpc = _stubs()
+
+    with _channel(grip) as channel:
+        stub = gripql_pb2_grpc.QueryStub(channel)
+        request = json_format.ParseDict({"graph": graph, **query.to_dict()}, gripql_pb2.GraphQuery())
+
+        results = stub.Traversal(request)
+        while batch := list(itertools.islice(results, WRITE_BATCH)):
+            yield from [
+                _record(json_format.MessageToDict(r, preserving_proto_field_name=True)) for r in batch
+            ]
+
+
+def _bulkSender(grip: GripConfig) -> tuple[Callable[[list[bytes]], dict], Callable[[], None]]:
+    """
+    Returns a function streaming bulk request lines to the Edit service, with
+    a response shaped like the HTTP API's, and one closing its channel.
+
+    gRPC channels are thread-safe, so all senders share one.
+    """
+    _, json_format, gripql_pb2, gripql_pb2_grpc = _stubs()
+
+    channel = _channel(grip)
+    stub = gripql_pb2_grpc.EditStub(channel)
+
+    def post(payload: list[bytes]) -> dict:
+        elements = (json_format.ParseDict(orjson.loads(line), gripql_pb2.GraphElement()) for line in payload)
+        response = stub.BulkAdd(elements)
+        return {"insertCount": response.insert_count, "errorCount": response.error_count}
+
+    return post, channel.close
@@ -12,3 +12,15 @@ dir_flags = click.option(
     show_default=True,
     help="Dump directory",
 )
+
+
+def _humanSize(size: float) -> str:
+    """
+    Formats a byte count for display (e.g. 1.5 GiB).
+    """
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if abs(size) < 1024 or unit == "TiB":
+            break
+        size /= 1024
+
+    return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
@@ -1,9 +1,14 @@
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from pathlib import Path
+from psycopg2 import sql
 from psycopg2.extensions import connection
+from typing import Callable
+import heapq
 import logging
 import os
 import psycopg2
+import re
 import shutil
 import subprocess
 
@@ -17,9 +22,40 @@ class PGConfig:
     user: str
 
 
-def _connect(pgConfig: PGConfig) -> connection:
+@dataclass
+class DumpConfig:
+    """Postgres dump options"""
+
+    # Dump format (see DUMP_FORMATS)
+    format: str = "custom"
+
+    # Workers per database (pg_dump --jobs or COPY connections)
+    jobs: int = 1
+
+    # Target size in bytes of each COPY chunk file
+    chunkSize: int = 1024**3
+
+    # Table patterns (pg_dump --table, --exclude-table, --exclude-table-data)
+    includeTables: list[str] = field(default_factory=list)
+    excludeTables: list[str] = field(default_factory=list)
+    excludeTableData: list[str] = field(default_factory=list)
+
+
+@dataclass
+class RestoreConfig:
+    """Postgres restore options"""
+
+    # Workers per database (pg_restore --jobs or COPY connections)
+    jobs: int = 1
+
+    # Throughput-oriented session settings (see `_restoreSettings`)
+    fast: bool = False
+    maintenanceWorkMem: str = "1GB"
+
+
+def _connect(pgConfig: PGConfig, db: str | None = None) -> connection:
     """
-    Connects to a given Postgres instance.
+    Connects to a given Postgres instance (and optionally a specific database).
     """
     assert pgConfig.host, "Host must not be empty"
     assert pgConfig.port, "Port must not be empty"
@@ -30,6 +66,7 @@ def _connect(pgConfig: PGConfig) -> connection:
             user=pgConfig.user,
             host=pgConfig.host,
             port=pgConfig.port,
+            dbname=db,
             password=os.getenv("PGPASSWORD"),
         )
     except Exception as err:
@@ -56,77 +93,406 @@ def _getDbs(pgConfig: PGConfig) -> list[str]:
     return dbs
 
 
-def _dump(pgConfig: PGConfig, db: str, dir: Path) -> Path:
+def _getDbSizes(pgConfig: PGConfig) -> dict[str, int]:
     """
-    Creates a single database dump.
+    Utility function to connect to Postgres and list all databases with their
+    on-disk size in bytes (pg_database_size).
+    """
+
+    # Connect to Postgres
+    c = _connect(pgConfig)
+
+    # List databases and sizes
+    sizes = {}
+    with c.cursor() as cur:
+        cur.execute(
+            "SELECT datname, pg_database_size(datname) FROM pg_database WHERE datistemplate = false;"
+        )
+        sizes = {row[0]: row[1] for row in cur.fetchall()}
+
+    return sizes
+
+
+def _getTableSizes(pgConfig: PGConfig, db: str) -> list[tuple[str, int]]:
+    """
+    Utility function to list the tables of a database with their total size in
+    bytes (pg_total_relation_size, including indexes and TOAST), largest first.
+    """
+    c = _connect(pgConfig, db)
+
+    tables = []
+    with c.cursor() as cur:
+        cur.execute(
+            """
+            SELECT format('%s.%s', n.nspname, c.relname), pg_total_relation_size(c.oid)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'm')
+                AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                AND n.nspname NOT LIKE 'pg_toast%'
+            ORDER BY 2 DESC;
+            """
+        )
+        tables = [(row[0], row[1]) for row in cur.fetchall()]
+
+    c.close()
+    return tables
+
+
+def _schedule(sizes: dict[str, int], jobs: int = 1) -> tuple[list[str], int]:
+    """
+    Orders databases largest first (longest-processing-time scheduling) and
+    returns the order along with the predicted makespan, i.e. the number of
+    bytes handled by the busiest of the `jobs` workers.
+    """
+    order = sorted(sizes, key=lambda db: sizes[db], reverse=True)
+
+    # Each database goes to the least loaded worker, as the pool does at runtime
+    workers = [0] * max(1, jobs)
+    for db in order:
+        heapq.heapreplace(workers, workers[0] + sizes[db])
+
+    return order, max(workers)
+
+
+# Dump formats supported by `_dump`, mapped to their artifact suffix
+DUMP_FORMATS = {
+    # Single file (pg_dump --format=c)
+    "custom": ".sql",
+    # One file per table, dumped in parallel (pg_dump --format=d --jobs)
+    "directory": ".dir",
+    # Schema plus ctid-ranged COPY chunks from one shared snapshot (backup.postgres.copy)
+    "copy": ".copy",
+}
+
+
+def _dumpPath(dir: Path, db: str) -> Path:
+    """
+    Returns the dump artifact of a database in the given directory, preferring
+    a directory-format dump over a custom-format one.
+    """
+    for suffix in reversed(DUMP_FORMATS.values()):
+        dump = dir / f"{db}{suffix}"
+        if dump.exists():
+            return dump
+
+    return dir / f"{db}{DUMP_FORMATS['custom']}"
+
+
+def _command(tool: str, pgConfig: PGConfig, db: str | None = None) -> list[str]:
+    """
+    Returns the base command line of a Postgres client tool (pg_dump,
+    pg_restore, ...) connecting to the given server and database.
     """
-    pg_dump = shutil.which("pg_dump")
+    path = shutil.which(tool)
 
-    if not pg_dump:
-        raise FileNotFoundError("pg_dump not found in PATH")
+    if not path:
+        raise FileNotFoundError(f"{tool} not found in PATH")
 
     command = [
-        pg_dump,
+        path,
         "-U",
         pgConfig.user,
         "-h",
         pgConfig.host,
         "-p",
         str(pgConfig.port),
-        "-d",
-        db,
-        "--format=c",
         "--no-password",
     ]
 
-    # Dump File
-    dump = Path(f"{dir}/{db}.sql")
+    if db:
+        command += ["-d", db]
+
+    return command
+
+
+def _patternParts(pattern: str) -> list[str]:
+    """
+    Converts a pg_dump/psql name pattern into a regex per dot-separated part,
+    as pg_dump does (patternToSQLRegex in PostgreSQL's fe_utils): unquoted
+    letters are folded to lower case, `*` and `?` are wildcards, `$` and
+    double-quoted text are literal and other regex syntax is kept.
+
+    Ref: https://www.postgresql.org/docs/current/app-psql.html#APP-PSQL-PATTERNS
+    """
+    parts, current = [], ""
+    quoted = False
+
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '"':
+            # "" within quotes is a literal quote
+            if quoted and pattern[i + 1 : i + 2] == '"':
+                current += '"'
+                i += 1
+            else:
+                quoted = not quoted
+        elif not quoted and ch.isascii() and ch.isupper():
+            current += ch.lower()
+        elif not quoted and ch == "*":
+            current += ".*"
+        elif not quoted and ch == "?":
+            current += "."
+        elif not quoted and ch == ".":
+            parts.append(current)
+            current = ""
+        elif ch == "$" or (quoted and ch in "|*+?()[]{}.^$\\"):
+            current += f"\\{ch}"
+        elif ch == "[" and pattern[i + 1 : i + 2] == "]":
+            current += "\\["
+        else:
+            current += ch
+        i += 1
+
+    parts.append(current)
+
+    if len(parts) > 3:
+        raise ValueError(f"Improper qualified name (too many dotted names): {pattern}")
+
+    return parts
+
+
+def _matchTable(pattern: str, schema: str, table: str, visible: bool = True) -> bool:
+    """
+    Matches a table against a pg_dump pattern (`table`, `schema.table` or
+    `db.schema.table`). Like pg_dump, unqualified patterns only match tables
+    visible in the search_path (pg_table_is_visible).
+    """
+    parts = _patternParts(pattern)
+
+    if len(parts) == 1:
+        return visible and re.fullmatch(f"(?:{parts[0]})", table) is not None
+
+    schemaPattern, tablePattern = parts[-2:]
+    return (
+        re.fullmatch(f"(?:{schemaPattern})", schema) is not None
+        and re.fullmatch(f"(?:{tablePattern})", table) is not None
+    )
+
+
+def _dumpTable(
+    dumpConfig: DumpConfig, schema: str, table: str, visible: bool = True
+) -> tuple[bool, bool]:
+    """
+    Returns whether a table's schema and its data are part of the dump, for dump
+    engines that don't go through pg_dump's own filters.
+    """
+    included = not dumpConfig.includeTables or any(
+        _matchTable(p, schema, table, visible) for p in dumpConfig.includeTables
+    )
+    included = included and not any(
+        _matchTable(p, schema, table, visible) for p in dumpConfig.excludeTables
+    )
+    data = included and not any(
+        _matchTable(p, schema, table, visible) for p in dumpConfig.excludeTableData
+    )
+
+    return included, data
+
+
+def _filterArgs(dumpConfig: DumpConfig) -> list[str]:
+    """
+    Returns the pg_dump arguments of the table filters.
+    """
+    args = []
+    args += [f"--table={pattern}" for pattern in dumpConfig.includeTables]
+    args += [f"--exclude-table={pattern}" for pattern in dumpConfig.excludeTables]
+    args += [f"--exclude-table-data={pattern}" for pattern in dumpConfig.excludeTableData]
+
+    return args
+
+
+def _run(command: list[str], env: dict[str, str] | None = None):
+    """
+    Runs a Postgres client tool, raising with its output on failure.
+    """
+    logging.debug(f"Command: {' '.join(command)}")
+    try:
+        _ = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            env=env or os.environ.copy(),
+        )
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode(errors="replace") if e.stderr else ""
+        logging.error(f"Error running {' '.join(command)}: {stderr}")
+        raise RuntimeError(
+            f"{Path(command[0]).name} failed: returncode={e.returncode}; stderr={stderr}"
+        ) from e
+
+
+def _dump(
+    pgConfig: PGConfig, db: str, dir: Path, dumpConfig: DumpConfig | None = None
+) -> Path:
+    """
+    Creates a single database dump.
+
+    The directory format dumps tables with parallel pg_dump workers, which is
+    the fastest option for a single large database. The copy format goes
+    further and splits large tables across workers as well.
+    """
+    dumpConfig = dumpConfig or DumpConfig()
+    format = dumpConfig.format
+
+    if format not in DUMP_FORMATS:
+        raise ValueError(f"Unknown dump format '{format}'")
+
+    if format == "copy":
+        from backup.postgres.copy import _export
+
+        return _export(pgConfig, db, dir, dumpConfig)
+
+    # Dump File (or directory)
+    dump = dir / f"{db}{DUMP_FORMATS[format]}"
+
+    # Single files are written under a temporary name and renamed once
+    # complete: an existing dump may be hard linked to a previous run's (see
+    # backup.postgres.incremental), which writing in place would overwrite
+    output = dump if format == "directory" else dump.with_name(f".{dump.name}.part")
+
+    command = _command("pg_dump", pgConfig, db) + [
+        f"--format={format[0]}",
+        "--file",
+        output.as_posix(),
+        *_filterArgs(dumpConfig),
+    ]
+
+    if format == "directory":
+        command += ["--jobs", str(dumpConfig.jobs)]
+
+        # pg_dump refuses to write into an existing directory (removing it
+        # only unlinks its files)
+        if dump.exists():
+            shutil.rmtree(dump)
 
-    # We open the output file and direct the command's stdout to it.
     logging.debug(f"Dumping database '{db}' to '{dump}'")
     logging.debug(f"Command: {' '.join(command)}")
-    with open(dump, "wb") as out:
-        try:
-            _ = subprocess.run(
-                command,
-                stdout=out,
-                stderr=subprocess.PIPE,
-                check=True,
-                env=os.environ.copy(),
-            )
-        except subprocess.CalledProcessError as e:
-            logging.error(
-                f"Error dumping database '{db}': {e}, stderr: {e.stderr.decode() if e.stderr else ''}"
-            )
-            raise
+    try:
+        _ = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            env=os.environ.copy(),
+        )
+    except subprocess.CalledProcessError as e:
+        logging.error(
+            f"Error dumping database '{db}': {e}, stderr: {e.stderr.decode() if e.stderr else ''}"
+        )
+        if output != dump:
+            output.unlink(missing_ok=True)
+        raise
+
+    if output != dump:
+        os.replace(output, dump)
 
     return dump
 
 
-def _restore(pgConfig: PGConfig, db: str, dir: Path) -> Path:
+def _restoreSettings(restoreConfig: RestoreConfig) -> dict[str, str]:
+    """
+    Returns the session settings of the fast-restore profile.
+
+    Commits don't wait for the WAL flush and index builds get more memory.
+    Index and constraint builds are already deferred until all data is
+    loaded, as pg_restore (and the copy loader) run the post-data section last.
+    """
+    if not restoreConfig.fast:
+        return {}
+
+    return {
+        "synchronous_commit": "off",
+        "maintenance_work_mem": restoreConfig.maintenanceWorkMem,
+    }
+
+
+def _restoreEnv(restoreConfig: RestoreConfig) -> dict[str, str]:
+    """
+    Returns the environment for restore tools, passing the restore profile to
+    every session they open through PGOPTIONS.
+    """
+    env = os.environ.copy()
+
+    settings = _restoreSettings(restoreConfig)
+    if settings:
+        options = " ".join(f"-c {key}={value}" for key, value in settings.items())
+        env["PGOPTIONS"] = f"{env.get('PGOPTIONS', '')} {options}".strip()
+
+    return env
+
+
+def _getDumps(dir: Path) -> dict[str, Path]:
+    """
+    Lists the databases with a dump artifact in the given directory.
+    """
+    dumps = {}
+
+    for suffix in DUMP_FORMATS.values():
+        for dump in dir.glob(f"*{suffix}"):
+            # Custom format dumps are files, the other formats directories
+            if dump.is_dir() == (suffix == DUMP_FORMATS["custom"]):
+                continue
+
+            dumps[dump.name.removesuffix(suffix)] = dump
+
+    return {db: _dumpPath(dir, db) for db in sorted(dumps)}
+
+
+def _dumpSize(dump: Path) -> int:
+    """
+    Returns the size in bytes of a dump file or directory.
+    """
+    if dump.is_file():
+        return dump.stat().st_size
+
+    return sum(f.stat().st_size for f in dump.rglob("*") if f.is_file())
+
+
+def _createDb(pgConfig: PGConfig, db: str) -> bool:
+    """
+    Creates a database if it doesn't exist yet, returning whether it was created.
+    """
+    c = _connect(pgConfig)
+    c.autocommit = True
+
+    try:
+        with c.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (db,))
+            if cur.fetchone():
+                return False
+
+            logging.debug(f"Creating database '{db}'")
+            cur.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(db)))
+            return True
+    finally:
+        c.close()
+
+
+def _restore(
+    pgConfig: PGConfig, db: str, dir: Path, restoreConfig: RestoreConfig | None = None
+) -> Path:
     """
-    Restores a single database from a dump file.
+    Restores a single database from a dump file (or directory) using
+    parallel pg_restore workers.
     """
-    dump = dir / Path(f"{db}.sql")
+    restoreConfig = restoreConfig or RestoreConfig()
+    dump = _dumpPath(dir, db)
 
     if not dump.exists():
         logging.error(f"Dump file {dump} does not exist")
         raise FileNotFoundError(f"Dump file {dump} does not exist")
 
-    if not shutil.which("pg_restore"):
-        logging.error("pg_restore not found in PATH")
+    if dump.suffix == DUMP_FORMATS["copy"]:
+        from backup.postgres.copy import _load
 
-    command = [
-        "psql",
-        "-U",
-        pgConfig.user,
-        "-h",
-        pgConfig.host,
-        "-p",
-        str(pgConfig.port),
-        "-d",
-        db,
-        "-f",
+        return _load(pgConfig, db, dump, restoreConfig)
+
+    command = _command("pg_restore", pgConfig, db) + [
+        "--jobs",
+        str(restoreConfig.jobs),
         dump.as_posix(),
     ]
 
@@ -138,6 +504,7 @@ def _restore(pgConfig: PGConfig, db: str, dir: Path) -> Path:
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             check=True,
+            env=_restoreEnv(restoreConfig),
         )
         return dump
 
@@ -150,3 +517,66 @@ def _restore(pgConfig: PGConfig, db: str, dir: Path) -> Path:
         raise RuntimeError(
             f"pg_restore failed for '{db}': returncode={e.returncode}; stdout={stdout}; stderr={stderr}"
         ) from e
+
+
+def _runAll(
+    fn: Callable[[str], Path], dbs: list[str], jobs: int
+) -> tuple[dict[str, Path], dict[str, Exception]]:
+    """
+    Runs `fn(db)` for several databases in a pool of `jobs` workers.
+
+    Failures are collected per database instead of aborting the whole run.
+    """
+    results: dict[str, Path] = {}
+    errors: dict[str, Exception] = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        # Submission order is the start order (see `_schedule`)
+        futures = {pool.submit(fn, db): db for db in dbs}
+
+        for future in as_completed(futures):
+            db = futures[future]
+            try:
+                results[db] = future.result()
+            except Exception as err:
+                errors[db] = err
+
+    return results, errors
+
+
+def _dumpAll(
+    pgConfig: PGConfig,
+    dbs: list[str],
+    dir: Path,
+    jobs: int = 1,
+    dumpConfig: DumpConfig | None = None,
+) -> tuple[dict[str, Path], dict[str, Exception]]:
+    """
+    Dumps several databases concurrently, running at most `jobs` database
+    dumps against the host at once.
+    """
+    return _runAll(
+        lambda db: _dump(pgConfig, db, dir, dumpConfig),
+        dbs,
+        jobs,
+    )
+
+
+def _restoreAll(
+    pgConfig: PGConfig,
+    dbs: list[str],
+    dir: Path,
+    jobs: int = 1,
+    restoreConfig: RestoreConfig | None = None,
+) -> tuple[dict[str, Path], dict[str, Exception]]:
+    """
+    Restores several databases concurrently, creating the ones missing on the
+    server first.
+    """
+
+    def restore(db: str) -> Path:
+        if _createDb(pgConfig, db):
+            logging.info(f"Created missing database '{db}'")
+        return _restore(pgConfig, db, dir, restoreConfig)
+
+    return _runAll(restore, dbs, jobs)
@@ -1,14 +1,37 @@
 from backup.postgres import (
+    DUMP_FORMATS,
+    DumpConfig,
     PGConfig,
+    RestoreConfig,
+    _dumpSize,
+    _filterArgs,
     _getDbs,
-    _dump as _pgDump,
-    _restore as _pgRestore,
+    _getDbSizes,
+    _getDumps,
+    _getTableSizes,
+    _schedule,
+    _dumpAll as _pgDumpAll,
+    _restoreAll as _pgRestoreAll,
+)
+from backup.postgres.incremental import (
+    _findBase,
+    _getDbStats,
+    _reuse,
+    _writeManifest,
+)
+from backup.postgres.wal import (
+    _archiveWal,
+    _basebackup,
+    _receiveWal,
+    _recover,
 )
 from backup.options import (
+    _humanSize,
     dir_flags,
 )
 import click
 import logging
+from datetime import datetime
 from pathlib import Path
 
 
@@ -45,6 +68,16 @@ def pg_flags(fn):
     return fn
 
 
+# Per-database parallelism flags (pg_dump/pg_restore --jobs)
+db_jobs_flags = click.option(
+    "--db-jobs",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="pg_dump/COPY (directory and copy formats) and pg_restore workers per database",
+)
+
+
 @click.group()
 def pg():
     """Postgres-related commands (moved from main.py)."""
@@ -53,56 +86,308 @@ def pg():
 
 @pg.command()
 @pg_flags
-def ls(host: str, port: int, user: str):
+@click.option(
+    "--sizes",
+    is_flag=True,
+    default=False,
+    help="List the tables of each database with their total size",
+)
+@click.option(
+    "--db",
+    "dbNames",
+    multiple=True,
+    help="Only list the given database(s)",
+)
+def ls(host: str, port: int, user: str, sizes: bool, dbNames: tuple[str, ...]):
     """list databases"""
     conf = PGConfig(host=host, port=port, user=user)
 
     dbs = _getDbs(conf)
+    if dbNames:
+        dbs = [db for db in dbs if db in dbNames]
+
     if not dbs:
         logging.warning(f"No databases found at {conf.host}:{conf.port}.")
         return
 
     # List databases
     for database in dbs:
-        click.echo(database)
+        if not sizes:
+            click.echo(database)
+            continue
+
+        # List tables with their sizes, largest first
+        for table, size in _getTableSizes(conf, database):
+            click.echo(f"{database}\t{table}\t{_humanSize(size)}")
 
 
 @pg.command()
 @pg_flags
 @dir_flags
-def dump(host: str, port: int, user: str, dir: Path):
+@click.option(
+    "--jobs",
+    "-j",
+    envvar="PGJOBS",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum concurrent pg_dump processes against the host ($PGJOBS)",
+)
+@click.option(
+    "--format",
+    "-F",
+    type=click.Choice(list(DUMP_FORMATS)),
+    default="custom",
+    show_default=True,
+    help="Dump format, 'directory' and 'copy' allow parallel dumps of a single database",
+)
+@db_jobs_flags
+@click.option(
+    "--chunk-size",
+    default=1024,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Size in MiB of each table chunk exported by the 'copy' format",
+)
+@click.option(
+    "--db",
+    "dbNames",
+    multiple=True,
+    help="Only dump the given database(s)",
+)
+@click.option(
+    "--include-table",
+    multiple=True,
+    help="Only dump tables matching the pattern (pg_dump --table)",
+)
+@click.option(
+    "--exclude-table",
+    multiple=True,
+    help="Skip tables matching the pattern (pg_dump --exclude-table)",
+)
+@click.option(
+    "--exclude-table-data",
+    multiple=True,
+    help="Dump only the definition of tables matching the pattern (pg_dump --exclude-table-data)",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Reuse the previous dump of databases that haven't changed",
+)
+@click.option(
+    "--base",
+    type=click.Path(path_type=Path, file_okay=False),
+    default=None,
+    help="Previous dump directory for --incremental (default: latest sibling of --dir)",
+)
+def dump(
+    host: str,
+    port: int,
+    user: str,
+    dir: Path,
+    jobs: int,
+    format: str,
+    db_jobs: int,
+    chunk_size: int,
+    dbNames: tuple[str, ...],
+    include_table: tuple[str, ...],
+    exclude_table: tuple[str, ...],
+    exclude_table_data: tuple[str, ...],
+    incremental: bool,
+    base: Path | None,
+):
     """postgres ➜ local"""
     conf = PGConfig(host=host, port=port, user=user)
+    dumpConf = DumpConfig(
+        format=format,
+        jobs=db_jobs,
+        chunkSize=chunk_size * 1024**2,
+        includeTables=list(include_table),
+        excludeTables=list(exclude_table),
+        excludeTableData=list(exclude_table_data),
+    )
 
     # Dump directory
     dir.mkdir(parents=True, exist_ok=True)
 
-    dbs = _getDbs(conf)
-    if not dbs:
+    sizes = _getDbSizes(conf)
+    if dbNames:
+        sizes = {db: size for db, size in sizes.items() if db in dbNames}
+
+    if not sizes:
         logging.warning(f"No databases found to dump at {conf.host}:{conf.port}.")
         return
 
-    # Dump databases
-    for database in dbs:
-        dump = _pgDump(conf, database, dir)
-        logging.debug(f"Dumped {database} to {dump}")
+    # Reuse the previous dump of unchanged databases
+    reused = {}
+    if incremental:
+        # Counters are read before dumping so that concurrent writes are
+        # picked up by the next run
+        stats = _getDbStats(conf)
+        base = base or _findBase(dir)
+        logging.debug(f"Incremental dump against {base}")
+
+        reused = _reuse(stats, base, list(sizes), dir, format, _filterArgs(dumpConf))
+        if reused:
+            click.echo(f"Reusing {len(reused)} unchanged databases: {', '.join(sorted(reused))}")
+        sizes = {db: size for db, size in sizes.items() if db not in reused}
+
+    dumps, errors = {}, {}
+    if sizes:
+        # Start the largest databases first so they don't become the long tail
+        dbs, makespan = _schedule(sizes, jobs)
+        click.echo(
+            f"Dumping {len(dbs)} databases ({_humanSize(sum(sizes.values()))}) with {jobs} jobs, "
+            f"predicted makespan: {_humanSize(makespan)} (largest: {dbs[0]}, {_humanSize(sizes[dbs[0]])})"
+        )
+
+        # Dump databases
+        dumps, errors = _pgDumpAll(conf, dbs, dir, jobs, dumpConf)
+
+    if incremental:
+        _writeManifest(dir, stats, dumps, reused, _filterArgs(dumpConf))
+
+    if errors:
+        for database, err in errors.items():
+            logging.error(f"Failed to dump {database}: {err}")
+        raise click.ClickException(
+            f"Failed to dump {len(errors)} of {len(sizes)} databases: {', '.join(sorted(errors))}"
+        )
 
 
 @pg.command()
 @pg_flags
 @dir_flags
-def restore(host: str, port: int, user: str, dir: Path):
+@click.option(
+    "--jobs",
+    "-j",
+    envvar="PGJOBS",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum databases restored at once ($PGJOBS)",
+)
+@db_jobs_flags
+@click.option(
+    "--fast/--no-fast",
+    default=False,
+    show_default=True,
+    help="Throughput-oriented sessions (synchronous_commit=off, larger maintenance_work_mem)",
+)
+@click.option(
+    "--maintenance-work-mem",
+    default="1GB",
+    show_default=True,
+    help="maintenance_work_mem used by --fast for index builds",
+)
+@click.option(
+    "--db",
+    "dbNames",
+    multiple=True,
+    help="Only restore the given database(s)",
+)
+@click.option(
+    "--exclude",
+    multiple=True,
+    help="Skip restoring the given database(s)",
+)
+def restore(
+    host: str,
+    port: int,
+    user: str,
+    dir: Path,
+    jobs: int,
+    db_jobs: int,
+    fast: bool,
+    maintenance_work_mem: str,
+    dbNames: tuple[str, ...],
+    exclude: tuple[str, ...],
+):
     """local ➜ postgres"""
     conf = PGConfig(host=host, port=port, user=user)
+    restoreConf = RestoreConfig(
+        jobs=db_jobs, fast=fast, maintenanceWorkMem=maintenance_work_mem
+    )
 
-    dbs = _getDbs(conf)
-    if not dbs:
-        logging.warning(f"No databases found to restore at {conf.host}:{conf.port}.")
+    # Databases are discovered from the dump directory so that a fresh
+    # instance (disaster recovery) gets every database back
+    dumps = _getDumps(dir)
+    if dbNames:
+        dumps = {db: dump for db, dump in dumps.items() if db in dbNames}
+    for database in exclude:
+        dumps.pop(database, None)
+
+    if not dumps:
+        logging.warning(f"No database dumps found to restore in {dir}.")
         return
 
+    # Restore the largest dumps first
+    sizes = {db: _dumpSize(dump) for db, dump in dumps.items()}
+    dbs, _ = _schedule(sizes, jobs)
+    logging.debug(f"Restoring {dbs} from {dir} to {conf.host}:{conf.port}")
+
     # Restore databases
-    for database in dbs:
-        if database == "gecko_cbds" or database == "metadata_cbds":
-            logging.debug("Skipping restore of gecko and metadata databases...")
-            continue
-        _ = _pgRestore(conf, database, dir)
+    _, errors = _pgRestoreAll(conf, dbs, dir, jobs, restoreConf)
+    if errors:
+        for database, err in errors.items():
+            logging.error(f"Failed to restore {database}: {err}")
+        raise click.ClickException(
+            f"Failed to restore {len(errors)} of {len(dbs)} databases: {', '.join(sorted(errors))}"
+        )
+
+
+@pg.command()
+@pg_flags
+@dir_flags
+def basebackup(host: str, port: int, user: str, dir: Path):
+    """postgres ➜ local (physical base backup)"""
+    conf = PGConfig(host=host, port=port, user=user)
+
+    base = _basebackup(conf, dir)
+    click.echo(f"Base backup written to {base}")
+
+
+@pg.command(name="wal-archive")
+@pg_flags
+@dir_flags
+@click.option(
+    "--slot",
+    default=None,
+    help="Replication slot to stream from (created if missing)",
+)
+def walArchive(host: str, port: int, user: str, dir: Path, slot: str | None):
+    """postgres ➜ local (continuous WAL streaming)"""
+    conf = PGConfig(host=host, port=port, user=user)
+
+    _receiveWal(conf, dir, slot)
+
+
+@pg.command(name="wal-push")
+@click.argument("segment", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@dir_flags
+def walPush(segment: Path, dir: Path):
+    """archive_command shim (archive_command = 'bak pg wal-push %p --dir DIR')"""
+    _ = _archiveWal(segment, dir)
+
+
+@pg.command()
+@dir_flags
+@click.option(
+    "--pgdata",
+    "-D",
+    required=True,
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Empty data directory to recover into",
+)
+@click.option(
+    "--target-time",
+    type=click.DateTime(formats=["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"]),
+    default=None,
+    help="Recovery target (UTC), defaults to the end of the WAL archive",
+)
+def recover(dir: Path, pgdata: Path, target_time: datetime | None):
+    """local ➜ data directory (point-in-time recovery)"""
+    _ = _recover(dir, pgdata, target_time)
+    click.echo(f"Start Postgres on {pgdata} to replay WAL and promote the server")
@@ -0,0 +1,382 @@
+### Native, snapshot-consistent export of a single database:
+#
+# 1. A coordinator connection opens a REPEATABLE READ transaction and exports
+#    its snapshot (pg_export_snapshot), which stays valid until it commits.
+# 2. `pg_dump --schema-only --snapshot` writes the schema from that snapshot.
+# 3. Tables are split into ctid (page) ranges and several worker connections,
+#    all importing the same snapshot (SET TRANSACTION SNAPSHOT), stream each
+#    range with `COPY (SELECT ...) TO STDOUT (FORMAT binary)` into its own file.
+#
+# Large objects aren't in any table chunk (pg_largeobject is a catalog) nor in
+# the schema, so they are exported from the same snapshot as (oid, bytea) rows
+# with lo_get, unless the dump is restricted to some tables (as with pg_dump).
+#
+# The loader mirrors this: pre-data schema, parallel `COPY FROM STDIN` of every
+# chunk, large objects (lo_from_bytea), sequence values, then post-data
+# (indexes and constraints) last.
+#
+# Ref: https://www.postgresql.org/docs/current/functions-admin.html#FUNCTIONS-SNAPSHOT-SYNCHRONIZATION
+
+from backup.postgres import (
+    DumpConfig,
+    PGConfig,
+    RestoreConfig,
+    _command,
+    _connect,
+    _dumpTable,
+    _filterArgs,
+    _restoreEnv,
+    _restoreSettings,
+    _run,
+)
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ, connection
+import logging
+import orjson
+import queue
+import shutil
+
+# Buffer size of each COPY read/write
+COPY_BUFFER = 1024 * 1024
+
+# User tables with their size in pages, their (non-generated) columns and
+# whether they are visible in the search_path (for unqualified table patterns,
+# resolved by pg_dump with the session's default search_path as well)
+TABLES_QUERY = """
+SELECT n.nspname,
+       c.relname,
+       pg_relation_size(c.oid) / current_setting('block_size')::int,
+       array_agg(a.attname::text ORDER BY a.attnum),
+       pg_table_is_visible(c.oid)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid
+    AND a.attnum > 0
+    AND NOT a.attisdropped
+    AND a.attgenerated = ''
+WHERE c.relkind = 'r'
+    AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+    AND n.nspname NOT LIKE 'pg_toast%'
+    AND n.nspname NOT LIKE 'pg_temp%'
+    AND NOT EXISTS (
+        SELECT 1 FROM pg_depend d WHERE d.objid = c.oid AND d.deptype = 'e'
+    )
+GROUP BY n.nspname, c.relname, c.oid
+ORDER BY pg_relation_size(c.oid) DESC;
+"""
+
+# Sequence values are part of pg_dump's data section, so they are saved here
+SEQUENCES_QUERY = """
+SELECT schemaname, sequencename, last_value
+FROM pg_sequences
+WHERE last_value IS NOT NULL;
+"""
+
+
+# Large objects, with their content (their owner and privileges aren't kept)
+LARGE_OBJECTS_QUERY = """
+COPY (
+    SELECT oid, lo_get(oid) FROM pg_largeobject_metadata ORDER BY oid
+) TO STDOUT (FORMAT binary);
+"""
+
+# File of the large objects, relative to the dump directory
+LARGE_OBJECTS = "data/large_objects.bin"
+
+
+@dataclass
+class Chunk:
+    """A page (ctid) range of a table, exported to its own file"""
+
+    schema: str
+    table: str
+    columns: list[str]
+
+    # First page and last page (exclusive), None for the end of the table
+    start: int
+    end: int | None
+
+    # Data file relative to the dump directory
+    file: str
+
+    # Rows copied
+    rows: int = 0
+
+
+def _ranges(pages: int, chunkPages: int) -> list[tuple[int, int | None]]:
+    """
+    Splits a table of `pages` pages into ranges of `chunkPages` pages.
+
+    The last range is left open so rows in pages added after the size was
+    read (but visible in the snapshot) are still exported.
+    """
+    chunkPages = max(1, chunkPages)
+
+    starts = list(range(0, max(pages, 1), chunkPages))
+    ends: list[int | None] = [*starts[1:], None]
+
+    return list(zip(starts, ends))
+
+
+def _snapshotConnection(pgConfig: PGConfig, db: str, snapshot: str) -> connection:
+    """
+    Opens a read-only connection whose transaction uses an exported snapshot.
+    """
+    c = _connect(pgConfig, db)
+    c.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+
+    with c.cursor() as cur:
+        cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+
+    return c
+
+
+def _exportChunk(c: connection, chunk: Chunk, out: Path) -> Chunk:
+    """
+    Streams a single chunk with COPY ... TO STDOUT (FORMAT binary).
+    """
+    where = sql.SQL("")
+    if chunk.start > 0 or chunk.end is not None:
+        where = sql.SQL(" WHERE ctid >= {start}::tid").format(
+            start=sql.Literal(f"({chunk.start},0)")
+        )
+    if chunk.end is not None:
+        where += sql.SQL(" AND ctid < {end}::tid").format(
+            end=sql.Literal(f"({chunk.end},0)")
+        )
+
+    # ONLY: the rows of inheritance children are exported with their own table
+    query = sql.SQL("COPY (SELECT {columns} FROM ONLY {table}{where}) TO STDOUT (FORMAT binary)").format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, chunk.columns)),
+        table=sql.Identifier(chunk.schema, chunk.table),
+        where=where,
+    )
+
+    with open(out / chunk.file, "wb") as f, c.cursor() as cur:
+        cur.copy_expert(query.as_string(c), f, size=COPY_BUFFER)
+        chunk.rows = cur.rowcount
+
+    logging.debug(f"Exported {chunk.rows} rows of {chunk.schema}.{chunk.table} to {chunk.file}")
+    return chunk
+
+
+def _exportLargeObjects(c: connection, out: Path) -> int:
+    """
+    Streams the large objects of the database, returning how many there are.
+    """
+    with open(out / LARGE_OBJECTS, "wb") as f, c.cursor() as cur:
+        cur.copy_expert(LARGE_OBJECTS_QUERY, f, size=COPY_BUFFER)
+        count = cur.rowcount
+
+    logging.debug(f"Exported {count} large objects to {LARGE_OBJECTS}")
+    return count
+
+
+def _export(pgConfig: PGConfig, db: str, dir: Path, dumpConfig: DumpConfig) -> Path:
+    """
+    Exports a single database with `dumpConfig.jobs` connections sharing one
+    snapshot, splitting tables into chunks of about `dumpConfig.chunkSize` bytes.
+    """
+    out = dir / f"{db}.copy"
+    if out.exists():
+        shutil.rmtree(out)
+    (out / "data").mkdir(parents=True)
+
+    # The coordinator's transaction keeps the exported snapshot alive until all
+    # workers are done, so it's only closed at the very end.
+    coordinator = _connect(pgConfig, db)
+    coordinator.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+
+    conns: queue.Queue[connection] = queue.Queue()
+    try:
+        with coordinator.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot(), current_setting('block_size')::int")
+            snapshot, blockSize = cur.fetchone()
+
+            cur.execute(TABLES_QUERY)
+            tables = cur.fetchall()
+
+            cur.execute(SEQUENCES_QUERY)
+            sequences = cur.fetchall()
+
+            cur.execute("SELECT EXISTS (SELECT 1 FROM pg_largeobject_metadata)")
+            (hasLargeObjects,) = cur.fetchone()
+
+        logging.debug(f"Exporting '{db}' ({len(tables)} tables) from snapshot {snapshot}")
+
+        chunks = []
+        for schema, table, pages, columns, visible in tables:
+            # Excluded tables and tables without data only go through the schema
+            _, data = _dumpTable(dumpConfig, schema, table, visible)
+            if not data:
+                continue
+
+            for start, end in _ranges(pages, dumpConfig.chunkSize // blockSize):
+                file = f"data/{len(chunks):06d}.bin"
+                chunks.append(Chunk(schema, table, columns, start, end, file))
+
+        for _ in range(max(1, dumpConfig.jobs)):
+            conns.put(_snapshotConnection(pgConfig, db, snapshot))
+
+        def export(chunk: Chunk) -> Chunk:
+            c = conns.get()
+            try:
+                return _exportChunk(c, chunk, out)
+            finally:
+                conns.put(c)
+
+        with ThreadPoolExecutor(max_workers=max(1, dumpConfig.jobs) + 2) as pool:
+            # Schema from the same snapshot, alongside the data
+            schemaJob = pool.submit(
+                _run,
+                _command("pg_dump", pgConfig, db)
+                + [
+                    "--schema-only",
+                    "--format=c",
+                    f"--snapshot={snapshot}",
+                    "--file",
+                    (out / "schema.dump").as_posix(),
+                    *_filterArgs(dumpConfig),
+                ],
+            )
+
+            # Large objects go along with the data of the whole database only,
+            # on the coordinator's connection
+            largeObjectsJob = None
+            if hasLargeObjects and not dumpConfig.includeTables:
+                largeObjectsJob = pool.submit(_exportLargeObjects, coordinator, out)
+
+            # Chunks are ordered largest table first
+            chunks = list(pool.map(export, chunks))
+            schemaJob.result()
+
+            largeObjects = None
+            if largeObjectsJob:
+                largeObjects = {"file": LARGE_OBJECTS, "count": largeObjectsJob.result()}
+
+    finally:
+        while not conns.empty():
+            conns.get().close()
+        coordinator.close()
+
+    manifest = {
+        "db": db,
+        "snapshot": snapshot,
+        "schema": "schema.dump",
+        "sequences": sequences,
+        "chunks": [asdict(chunk) for chunk in chunks],
+        "largeObjects": largeObjects,
+    }
+    (out / "manifest.json").write_bytes(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+    logging.debug(f"Exported '{db}' to '{out}' in {len(chunks)} chunks")
+    return out
+
+
+def _loadChunk(c: connection, chunk: Chunk, dump: Path) -> Chunk:
+    """
+    Loads a single chunk with COPY ... FROM STDIN (FORMAT binary).
+    """
+    query = sql.SQL("COPY {table} ({columns}) FROM STDIN (FORMAT binary)").format(
+        table=sql.Identifier(chunk.schema, chunk.table),
+        columns=sql.SQL(", ").join(map(sql.Identifier, chunk.columns)),
+    )
+
+    # A failed COPY aborts the transaction, which has to be rolled back before
+    # the connection loads other chunks
+    try:
+        with open(dump / chunk.file, "rb") as f, c.cursor() as cur:
+            cur.copy_expert(query.as_string(c), f, size=COPY_BUFFER)
+        c.commit()
+    except Exception:
+        c.rollback()
+        raise
+
+    logging.debug(f"Loaded {chunk.rows} rows of {chunk.schema}.{chunk.table} from {chunk.file}")
+    return chunk
+
+
+def _loadLargeObjects(c: connection, dump: Path, file: str):
+    """
+    Recreates the large objects exported by `_exportLargeObjects`.
+    """
+    with open(dump / file, "rb") as f, c.cursor() as cur:
+        cur.execute("CREATE TEMPORARY TABLE bak_large_objects (loid oid, data bytea) ON COMMIT DROP;")
+        cur.copy_expert("COPY bak_large_objects FROM STDIN (FORMAT binary);", f, size=COPY_BUFFER)
+        cur.execute("SELECT count(lo_from_bytea(loid, data)) FROM bak_large_objects;")
+        (count,) = cur.fetchone()
+    c.commit()
+
+    logging.debug(f"Loaded {count} large objects from {file}")
+
+
+def _load(pgConfig: PGConfig, db: str, dump: Path, restoreConfig: RestoreConfig) -> Path:
+    """
+    Restores a database exported by `_export` into an existing database with
+    `restoreConfig.jobs` parallel COPY connections. Indexes and constraints
+    (post-data) are only built once all data is loaded.
+    """
+    manifest = orjson.loads((dump / "manifest.json").read_bytes())
+    chunks = [Chunk(**chunk) for chunk in manifest["chunks"]]
+    schemaDump = (dump / manifest["schema"]).as_posix()
+    jobs = max(1, restoreConfig.jobs)
+    env = _restoreEnv(restoreConfig)
+
+    # Tables, types, functions, ...
+    _run(
+        _command("pg_restore", pgConfig, db) + ["--section=pre-data", schemaDump],
+        env,
+    )
+
+    conns: queue.Queue[connection] = queue.Queue()
+    try:
+        for _ in range(jobs):
+            c = _connect(pgConfig, db)
+            with c.cursor() as cur:
+                for key, value in _restoreSettings(restoreConfig).items():
+                    cur.execute("SELECT set_config(%s, %s, false);", (key, value))
+            c.commit()
+            conns.put(c)
+
+        def load(chunk: Chunk) -> Chunk:
+            c = conns.get()
+            try:
+                return _loadChunk(c, chunk, dump)
+            finally:
+                conns.put(c)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            _ = list(pool.map(load, chunks))
+
+        c = conns.get()
+
+        # Dumps written before large objects were exported have no entry
+        if manifest.get("largeObjects"):
+            _loadLargeObjects(c, dump, manifest["largeObjects"]["file"])
+
+        with c.cursor() as cur:
+            # Sequences of tables left out of the dump may not exist
+            for nsp, sequence, value in manifest["sequences"]:
+                cur.execute(
+                    "SELECT setval(s.oid, %s, true) FROM (SELECT to_regclass(%s) AS oid) s WHERE s.oid IS NOT NULL;",
+                    (value, sql.Identifier(nsp, sequence).as_string(c)),
+                )
+        c.commit()
+        conns.put(c)
+
+    finally:
+        while not conns.empty():
+            conns.get().close()
+
+    # Indexes, constraints, triggers, ...
+    _run(
+        _command("pg_restore", pgConfig, db)
+        + ["--section=post-data", "--jobs", str(jobs), schemaDump],
+        env,
+    )
+
+    logging.debug(f"Loaded '{db}' from '{dump}' ({len(chunks)} chunks)")
+    return dump
@@ -0,0 +1,211 @@
+### Change detection for Postgres dumps:
+#
+# Every incremental run records per-database activity counters from
+# pg_stat_database and the server's current WAL position in a manifest next to
+# the dumps. The next run compares them with the previous run's manifest and
+# reuses (hard links) the previous artifact of every database that hasn't
+# changed, instead of dumping it again.
+#
+# Notes:
+#   - xact_commit is recorded but not compared, as read-only transactions
+#     (including our own pg_dump sessions) increment it too.
+#   - Counters are read before dumping, so writes racing with a dump are always
+#     picked up by the next run.
+#   - Statistics are reset on crash recovery and by pg_stat_reset(), so the
+#     postmaster start time and stats_reset are part of the comparison.
+
+from backup.postgres import (
+    DUMP_FORMATS,
+    PGConfig,
+    _connect,
+    _dumpPath,
+)
+from pathlib import Path
+import logging
+import orjson
+import os
+import shutil
+
+# Manifest file written next to the dumps
+MANIFEST = "postgres.manifest.json"
+
+# pg_stat_database counters that change when a database is written to
+COUNTERS = ["tup_inserted", "tup_updated", "tup_deleted"]
+
+
+def _getDbStats(pgConfig: PGConfig) -> dict:
+    """
+    Utility function to connect to Postgres and read the server's WAL position
+    along with the activity counters of every database.
+    """
+    c = _connect(pgConfig)
+
+    with c.cursor() as cur:
+        cur.execute(
+            """
+            SELECT CASE WHEN pg_is_in_recovery()
+                        THEN pg_last_wal_replay_lsn()
+                        ELSE pg_current_wal_lsn() END::text,
+                   pg_postmaster_start_time()::text;
+            """
+        )
+        lsn, started = cur.fetchone()
+
+        cur.execute(
+            """
+            SELECT datname, xact_commit, tup_inserted, tup_updated, tup_deleted,
+                   stats_reset::text
+            FROM pg_stat_database
+            WHERE datname IS NOT NULL;
+            """
+        )
+        columns = [column.name for column in cur.description]
+        dbs = {row[0]: dict(zip(columns[1:], row[1:])) for row in cur.fetchall()}
+
+        stats = {"lsn": lsn, "started": started, "dbs": dbs}
+
+    c.close()
+    return stats
+
+
+def _readManifest(dir: Path) -> dict | None:
+    """
+    Reads the manifest of a previous dump, if there is one.
+    """
+    manifest = dir / MANIFEST
+    if not manifest.is_file():
+        return None
+
+    return orjson.loads(manifest.read_bytes())
+
+
+def _writeManifest(
+    dir: Path,
+    stats: dict,
+    dumps: dict[str, Path],
+    reused: dict[str, Path],
+    filters: list[str] | None = None,
+):
+    """
+    Writes the manifest of a dump, recording the counters of every database
+    that has an artifact in `dir`, which ones were reused and the table
+    filters (pg_dump arguments) of the run.
+    """
+    manifest = {
+        "lsn": stats["lsn"],
+        "started": stats["started"],
+        "filters": filters or [],
+        "dbs": {
+            db: {
+                **stats["dbs"].get(db, {}),
+                "dump": dump.name,
+                "reused": reused[db].as_posix() if db in reused else None,
+            }
+            for db, dump in sorted({**dumps, **reused}.items())
+        },
+    }
+
+    (dir / MANIFEST).write_bytes(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+
+def _findBase(dir: Path) -> Path | None:
+    """
+    Returns the most recent sibling dump directory with a manifest, relying on
+    the timestamped directory names written by entrypoint.sh sorting in order.
+    """
+    if not dir.parent.is_dir():
+        return None
+
+    previous = [
+        d
+        for d in dir.parent.iterdir()
+        if d.is_dir() and d.name < dir.name and (d / MANIFEST).is_file()
+    ]
+
+    return max(previous, default=None)
+
+
+def _unchanged(stats: dict, previous: dict | None, db: str) -> bool:
+    """
+    Returns whether a database has not been written to since the previous dump.
+    """
+    if not previous or db not in previous["dbs"] or db not in stats["dbs"]:
+        return False
+
+    # Nothing at all has been written on the server
+    if stats["lsn"] == previous["lsn"]:
+        return True
+
+    # Counters were reset since the previous dump
+    if stats["started"] != previous["started"]:
+        return False
+
+    before, now = previous["dbs"][db], stats["dbs"][db]
+    if before.get("stats_reset") != now.get("stats_reset"):
+        return False
+
+    return all(before.get(counter) == now.get(counter) for counter in COUNTERS)
+
+
+def _link(src: Path, dst: Path):
+    """
+    Hard links a dump file or directory, copying it when linking isn't possible
+    (e.g. across file systems).
+    """
+
+    def link(s, d):
+        try:
+            os.link(s, d)
+        except OSError:
+            shutil.copy2(s, d)
+
+    if dst.is_dir():
+        shutil.rmtree(dst)
+    elif dst.exists():
+        dst.unlink()
+
+    if src.is_dir():
+        shutil.copytree(src, dst, copy_function=link)
+    else:
+        link(src, dst)
+
+
+def _reuse(
+    stats: dict,
+    base: Path | None,
+    dbs: list[str],
+    dir: Path,
+    format: str,
+    filters: list[str] | None = None,
+) -> dict[str, Path]:
+    """
+    Reuses the previous dump of every unchanged database, returning the
+    previous artifacts that were linked into `dir`. Nothing is reused from a
+    run with different table filters, as its dumps hold other tables.
+    """
+    if not base or base.resolve() == dir.resolve():
+        return {}
+
+    previous = _readManifest(base)
+    if previous and previous.get("filters", []) != (filters or []):
+        logging.info(f"Table filters changed since {base}, not reusing its dumps")
+        return {}
+
+    reused = {}
+    for db in dbs:
+        if not _unchanged(stats, previous, db):
+            continue
+
+        # The previous artifact must exist and be in the requested format
+        src = _dumpPath(base, db)
+        if not src.exists() or src.suffix != DUMP_FORMATS[format]:
+            continue
+
+        _link(src, dir / src.name)
+
+        # Follow the chain back to the run that actually dumped the database
+        reused[db] = Path(previous["dbs"][db].get("reused") or src)
+
+        logging.debug(f"Database '{db}' unchanged since {base}, reusing {src}")
+
+    return reused
@@ -0,0 +1,190 @@
+### Physical backups with continuous WAL archiving and point-in-time recovery:
+#
+# DIR
+# ├─ base
+# │  └─ TIMESTAMP       <-- pg_basebackup (tar format, base.tar.gz + pg_wal.tar.gz)
+# └─ wal
+#    ├─ 000000010000000000000001
+#    └─ ...             <-- pg_receivewal or the archive_command shim (`bak pg wal-push`)
+#
+# The server side needs `wal_level = replica` (the default) and either a
+# replication connection for pg_receivewal, or:
+#
+#   archive_mode = on
+#   archive_command = 'bak pg wal-push %p --dir DIR'
+#
+# Recovery extracts a base backup into an empty data directory and configures
+# `restore_command` to replay WAL from DIR/wal up to the requested target,
+# including the `.partial` segment pg_receivewal was writing when it stopped.
+#
+# Ref: https://www.postgresql.org/docs/current/continuous-archiving.html
+
+from backup.postgres import PGConfig, _command, _run
+from datetime import datetime, timezone
+from pathlib import Path
+import filecmp
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+
+# Timestamp format of base backup directories (matches entrypoint.sh)
+TIMESTAMP = "%Y-%m-%dT%H:%M:%S"
+
+
+def _basebackup(pgConfig: PGConfig, dir: Path) -> Path:
+    """
+    Takes a compressed, self-contained base backup of the whole cluster.
+    """
+    base = dir / "base" / datetime.now(timezone.utc).strftime(TIMESTAMP)
+    base.parent.mkdir(parents=True, exist_ok=True)
+
+    command = _command("pg_basebackup", pgConfig) + [
+        "--pgdata",
+        base.as_posix(),
+        "--format=tar",
+        "--gzip",
+        "--wal-method=stream",
+        "--checkpoint=fast",
+        "--label=bak",
+    ]
+
+    logging.debug(f"Taking base backup of {pgConfig.host}:{pgConfig.port} to '{base}'")
+    _run(command)
+
+    return base
+
+
+def _receiveWal(pgConfig: PGConfig, dir: Path, slot: str | None = None):
+    """
+    Streams WAL segments into DIR/wal with pg_receivewal until interrupted.
+
+    A replication slot keeps the server from recycling segments that haven't
+    been received yet (e.g. while this process is restarting).
+    """
+    wal = dir / "wal"
+    wal.mkdir(parents=True, exist_ok=True)
+
+    command = _command("pg_receivewal", pgConfig) + ["--directory", wal.as_posix()]
+
+    if slot:
+        # Create the slot on first use, then stream from it
+        _run(command + ["--slot", slot, "--create-slot", "--if-not-exists"])
+        command += ["--slot", slot]
+
+    logging.debug(f"Archiving WAL of {pgConfig.host}:{pgConfig.port} to '{wal}'")
+    logging.debug(f"Command: {' '.join(command)}")
+    _ = subprocess.run(command, check=True, env=os.environ.copy())
+
+
+def _archiveWal(segment: Path, dir: Path) -> Path:
+    """
+    archive_command shim: copies a WAL segment into DIR/wal.
+
+    The copy is written to a temporary file, synced and renamed so a crash never
+    leaves a truncated segment behind. Archiving a segment that is already
+    archived with the same content succeeds, as Postgres may retry it.
+    """
+    wal = dir / "wal"
+    wal.mkdir(parents=True, exist_ok=True)
+
+    archived = wal / segment.name
+    if archived.exists():
+        if filecmp.cmp(segment, archived, shallow=False):
+            logging.debug(f"WAL segment '{segment.name}' already archived")
+            return archived
+        raise FileExistsError(f"WAL segment {archived} exists with different content")
+
+    partial = wal / f".{segment.name}.tmp"
+    shutil.copyfile(segment, partial)
+    with open(partial, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(partial, archived)
+
+    logging.debug(f"Archived WAL segment '{segment.name}' to '{archived}'")
+    return archived
+
+
+def _getBasebackups(dir: Path) -> list[Path]:
+    """
+    Lists the base backups in DIR/base, oldest first.
+    """
+    base = dir / "base"
+    if not base.is_dir():
+        return []
+
+    return sorted(b for b in base.iterdir() if (b / "base.tar.gz").is_file())
+
+
+def _pickBasebackup(dir: Path, target: datetime | None = None) -> Path:
+    """
+    Returns the latest base backup taken before the recovery target.
+    """
+    backups = _getBasebackups(dir)
+
+    if target:
+        target = target if target.tzinfo else target.replace(tzinfo=timezone.utc)
+        backups = [
+            b
+            for b in backups
+            if datetime.strptime(b.name, TIMESTAMP).replace(tzinfo=timezone.utc) <= target
+        ]
+
+    if not backups:
+        raise FileNotFoundError(f"No base backup found in {dir / 'base'} before {target}")
+
+    return backups[-1]
+
+
+def _recover(
+    dir: Path,
+    pgdata: Path,
+    target: datetime | None = None,
+    base: Path | None = None,
+) -> Path:
+    """
+    Prepares an (empty) data directory for point-in-time recovery.
+
+    Starting Postgres on `pgdata` afterwards replays the archived WAL up to
+    `target` (or the end of the archive) and promotes the server.
+    """
+    base = base or _pickBasebackup(dir, target)
+
+    if pgdata.exists() and any(pgdata.iterdir()):
+        raise FileExistsError(f"Data directory {pgdata} is not empty")
+    pgdata.mkdir(parents=True, exist_ok=True, mode=0o700)
+
+    logging.debug(f"Restoring base backup '{base}' to '{pgdata}'")
+    with tarfile.open(base / "base.tar.gz") as tar:
+        tar.extractall(pgdata, filter="tar")
+
+    # WAL streamed during the base backup makes it consistent on its own
+    if (base / "pg_wal.tar.gz").is_file():
+        with tarfile.open(base / "pg_wal.tar.gz") as tar:
+            tar.extractall(pgdata / "pg_wal", filter="tar")
+
+    # pg_receivewal keeps the segment it is still writing as `%f.partial`, so
+    # the latest WAL is only replayed if it is used when `%f` is missing
+    wal = (dir / "wal").resolve()
+    settings = {
+        "restore_command": (
+            f"if [ -f \"{wal}/%f\" ]; then cp \"{wal}/%f\" \"%p\"; "
+            f"else cp \"{wal}/%f.partial\" \"%p\"; fi"
+        ),
+        "recovery_target_action": "promote",
+    }
+    if target:
+        # Naive targets are UTC, like the base backup timestamps
+        target = target if target.tzinfo else target.replace(tzinfo=timezone.utc)
+        settings["recovery_target_time"] = target.isoformat(sep=" ")
+
+    with open(pgdata / "postgresql.auto.conf", "a") as conf:
+        conf.write("\n# Point-in-time recovery (bak pg recover)\n")
+        for key, value in settings.items():
+            escaped = value.replace("'", "''")
+            conf.write(f"{key} = '{escaped}'\n")
+
+    (pgdata / "recovery.signal").touch()
+
+    return pgdata
@@ -1,8 +1,53 @@
-from dataclasses import dataclass
+from backup.s3.throttle import Throttle, _consume, _scheduled, _throttle
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
 import logging
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 from minio import Minio
 from minio.credentials.providers import EnvAWSProvider
+from minio.datatypes import Object, Part
+from minio.error import S3Error
+from types import SimpleNamespace
+from typing import Iterable, Iterator, cast
+from urllib3.util import Retry, Timeout
+import certifi
+import io
+import itertools
+import orjson
+import os
+import time
+import urllib3
+
+# Connect and read timeout of S3 requests (seconds)
+S3_TIMEOUT = 300
+
+# Read size of ranged GET responses
+DOWNLOAD_BUFFER = 1024 * 1024
+
+# Local state of `bak s3 sync`, kept in the synced directory (never uploaded)
+SYNC_MANIFEST = ".bak-sync.json"
+
+# Local state of dumps, only meaningful next to them (never uploaded): GRIP
+# backup/restore checkpoints and incremental indexes
+LOCAL_SUFFIXES = (".checkpoint", ".checkpoint.tmp", ".index", ".index.tmp")
+
+# Index of a deduplicated backup (see backup.s3.dedup)
+DEDUP_INDEX = ".bak-dedup.json"
+
+# Summary of the backups of a bucket, maintained by uploads (see `bak s3 ls`)
+CATALOG = ".bak-catalog.json"
+
+# Name of the timestamped backup prefixes (see entrypoint.sh)
+TIMESTAMP = "%Y-%m-%dT%H:%M:%S"
+
+# Artifact suffixes of each component, as written (side by side) into the
+# timestamped backup directory by entrypoint.sh
+COMPONENTS = {
+    "postgres": (".sql", ".dir", ".copy", "postgres.manifest.json"),
+    "grip": (".vertices", ".edges", ".msgpack", ".shards", ".deleted", ".incremental.json"),
+}
 
 
 @dataclass
@@ -13,78 +58,645 @@ class S3Config:
     bucket: str
 
 
-def _getS3Client(s3: S3Config):
+@dataclass
+class TransferConfig:
+    """S3 transfer options"""
+
+    # Files transferred at once
+    jobs: int = 4
+
+    # Multipart part (upload) or byte range (download) size, and parts of a
+    # file transferred at once
+    partSize: int = 64 * 1024 * 1024
+    parts: int = 4
+
+    # Bandwidth limit in bytes per second (0 for none)
+    maxBandwidth: int = 0
+
+    # Adjust the concurrent requests to the link (see backup.s3.throttle)
+    adaptive: bool = True
+
+
+@dataclass
+class SelectConfig:
+    """Objects to download"""
+
+    # Key prefix, e.g. DIR/TIMESTAMP/
+    prefix: str | None = None
+
+    # Globs matched against the keys relative to the prefix
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+
+    # Only the most recent timestamped backup under the prefix
+    latest: bool = False
+
+
+def _getS3Client(s3: S3Config, connections: int = 10, throttled: bool = False):
     """
     Returns a MinIO client configured with the provided S3 configuration.
+
+    The client (and its connection pool of `connections` connections) is
+    thread-safe and meant to be shared by all transfers. With `throttled`,
+    throttled requests (503 SlowDown) aren't retried by the client but left to
+    the transfer's `Throttle`, which backs off: such a client is only meant
+    for the data requests going through `_scheduled`. Listings, the catalog
+    and indexes use a default client, which retries them.
     """
     
     # Remove 'https://' prefix if it exists
     s3.endpoint = s3.endpoint.removeprefix("https://")
 
+    # Same as MinIO's default pool, sized for concurrent transfers
+    http = urllib3.PoolManager(
+        timeout=Timeout(connect=S3_TIMEOUT, read=S3_TIMEOUT),
+        maxsize=max(10, connections),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=Retry(
+            total=5,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 504] if throttled else [500, 502, 503, 504],
+        ),
+    )
+
     return Minio(
         f"{s3.endpoint}",
         credentials=EnvAWSProvider(),
         secure=True,
+        http_client=http,
     )
 
 
+def _mib(size: float) -> str:
+    return f"{size / 1024**2:,.1f} MiB"
+
+
+def _files(dir: Path) -> list[Path]:
+    """
+    Lists the files to upload from a dump directory.
+    """
+    # TODO: Review if this selection/filter of files is acceptable
+    # Skip directories, non-files and local sync or dump state
+    return [
+        dump
+        for dump in dir.rglob("*")
+        if dump.is_file() and dump.name != SYNC_MANIFEST and not dump.name.endswith(LOCAL_SUFFIXES)
+    ]
+
+
+def _putFile(client: Minio, s3: S3Config, dump: Path, throttle: Throttle | None = None) -> str:
+    """
+    Uploads a file in a single PUT. Returns the ETag of the object.
+    """
+    # The file is read (and throttled) as the request goes
+    progress = SimpleNamespace(set_meta=lambda **_: None, update=lambda length: _consume(throttle, length))
+
+    result = client.fput_object(s3.bucket, dump.as_posix(), dump.as_posix(), progress=progress)
+    return (result.etag or "").strip('"') if result else ""
+
+
+def _uploadPart(
+    client: Minio,
+    s3: S3Config,
+    dump: Path,
+    uploadId: str,
+    number: int,
+    offset: int,
+    length: int,
+    throttle: Throttle | None = None,
+) -> Part:
+    """
+    Uploads one part of a multipart upload, read from the file at `offset`.
+    """
+    with open(dump, "rb") as f:
+        _ = f.seek(offset)
+        data = f.read(length)
+
+    _consume(throttle, len(data))
+    etag = client._upload_part(s3.bucket, dump.as_posix(), data, None, uploadId, number)
+    return Part(number, etag)
+
+
+def _uploadFile(
+    client: Minio,
+    s3: S3Config,
+    dump: Path,
+    transferConfig: TransferConfig,
+    parts: ThreadPoolExecutor,
+    throttle: Throttle | None = None,
+) -> str:
+    """
+    Uploads a single file, as concurrent multipart parts (on the `parts`
+    pool) when it's larger than a part. Every request goes through the
+    throttle on its own, so a throttled part is retried rather than the whole
+    file. Returns the ETag of the object.
+    """
+    logging.debug(
+        f"Uploading {dump} to {s3.endpoint}/{s3.bucket}/{dump.as_posix()}"
+    )
+
+    size = dump.stat().st_size
+    if size <= transferConfig.partSize:
+        return _scheduled(throttle, size, _putFile, client, s3, dump, throttle)
+
+    name = dump.as_posix()
+    uploadId = _scheduled(throttle, 0, client._create_multipart_upload, s3.bucket, name, {})
+
+    futures = [
+        parts.submit(
+            _scheduled,
+            throttle,
+            length,
+            _uploadPart,
+            client,
+            s3,
+            dump,
+            uploadId,
+            number,
+            offset,
+            length,
+            throttle,
+        )
+        for number, (offset, length) in enumerate(_ranges(size, transferConfig.partSize), start=1)
+    ]
+    try:
+        uploaded = [future.result() for future in futures]
+        result = _scheduled(throttle, 0, client._complete_multipart_upload, s3.bucket, name, uploadId, uploaded)
+    except Exception:
+        for future in futures:
+            future.cancel()
+        try:
+            client._abort_multipart_upload(s3.bucket, name, uploadId)
+        except Exception as err:
+            logging.warning(f"Failed to abort the upload of {dump}: {err}")
+        raise
+
+    return (result.etag or "").strip('"')
+
+
+def _uploadFiles(
+    client: Minio, s3: S3Config, dumps: list[Path], transferConfig: TransferConfig
+) -> tuple[dict[Path, str], list[Exception]]:
+    """
+    Uploads files `transferConfig.jobs` at a time, largest first, each split
+    into parts uploaded `transferConfig.parts` at a time, reporting progress
+    and throughput. Returns the ETag of every uploaded file and the errors of
+    the others.
+    """
+    sizes = {dump: dump.stat().st_size for dump in dumps}
+    total = sum(sizes.values())
+
+    jobs = max(1, transferConfig.jobs)
+    requests = jobs * max(1, transferConfig.parts)
+    throttle = _throttle(transferConfig.maxBandwidth, jobs, requests, transferConfig.adaptive)
+
+    etags, errors = {}, []
+    sent = 0
+    start = time.monotonic()
+
+    # Files and their parts run on separate pools, so that files waiting on
+    # their parts never hold up the parts themselves
+    with (
+        ThreadPoolExecutor(max_workers=jobs) as pool,
+        ThreadPoolExecutor(max_workers=requests) as parts,
+    ):
+        futures = {
+            pool.submit(_uploadFile, client, s3, dump, transferConfig, parts, throttle): dump
+            for dump in sorted(dumps, key=sizes.__getitem__, reverse=True)
+        }
+
+        for future in as_completed(futures):
+            dump = futures[future]
+            try:
+                etags[dump] = future.result()
+            except Exception as err:
+                logging.error(f"Failed to Upload {dump}: {err}")
+                errors.append(err)
+                continue
+
+            sent += sizes[dump]
+            elapsed = max(time.monotonic() - start, 1e-6)
+            logging.info(
+                f"Uploaded {len(etags)}/{len(dumps)} files, {_mib(sent)} of {_mib(total)} "
+                f"({_mib(sent / elapsed)}/s)"
+            )
+
+    return etags, errors
+
+
 def _upload(
     s3: S3Config,
     dir: Path,
+    transferConfig: TransferConfig | None = None,
 ):
     """
     Uploads a file to S3 (MinIO/Ceph compatible).
+
+    Files are uploaded `transferConfig.jobs` at a time, largest first, over
+    one shared client. Returns the first error, after attempting every file.
     """
+    transferConfig = transferConfig or TransferConfig()
 
-    client = _getS3Client(s3)
+    client = _getS3Client(s3, transferConfig.jobs * transferConfig.parts, throttled=True)
+    metadata = _getS3Client(s3)
 
     try:
         logging.debug(f"dir: {dir}, type: {type(dir)}")
 
-        # TODO: Review if this selection/filter of files is acceptable
-        for dump in dir.rglob("*"):
+        etags, errors = _uploadFiles(client, s3, _files(dir), transferConfig)
+        _updateCatalog(metadata, s3, [dump.as_posix() for dump in etags])
+        if errors:
+            return errors[0]
+
+    except Exception as err:
+        logging.error(f"Failed to Upload: {err}")
+        return err
+
+
+def _ranges(size: int, partSize: int) -> list[tuple[int, int]]:
+    """
+    Splits an object of `size` bytes into (offset, length) ranges.
+    """
+    partSize = max(1, partSize)
+    return [(offset, min(partSize, size - offset)) for offset in range(0, size, partSize)]
+
+
+def _downloadRange(
+    client: Minio,
+    s3: S3Config,
+    name: str,
+    path: Path,
+    offset: int,
+    length: int,
+    position: int | None = None,
+    throttle: Throttle | None = None,
+):
+    """
+    Fetches a byte range of an object with a ranged GET, writing it in place
+    (positional writes) into a preallocated file, at `position` (by default
+    the same offset as in the object).
+    """
+    response = client.get_object(s3.bucket, name, offset=offset, length=length)
+
+    start = offset if position is None else position
+    position = start
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        for data in response.stream(DOWNLOAD_BUFFER):
+            _consume(throttle, len(data))
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, position)
+                view = view[written:]
+                position += written
+    finally:
+        os.close(fd)
+        response.close()
+        response.release_conn()
+
+    if position != start + length:
+        raise IOError(f"Short read of {name} at bytes {offset}-{offset + length}: got {position - start}")
+
+
+def _downloadFile(
+    client: Minio,
+    s3: S3Config,
+    name: str,
+    size: int,
+    path: Path,
+    transferConfig: TransferConfig,
+    ranges: ThreadPoolExecutor,
+    throttle: Throttle | None = None,
+) -> int:
+    """
+    Downloads a single object as concurrent ranged GETs (on the `ranges`
+    pool) into a temporary file, renamed once complete.
+    """
+    logging.debug(f"Downloading {name} from bucket {s3.bucket} to {path}")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f".{path.name}.part")
+
+    with open(partial, "wb") as f:
+        f.truncate(size)
+
+    futures = [
+        ranges.submit(
+            _scheduled, throttle, length, _downloadRange, client, s3, name, partial, offset, length, None, throttle,
+        )
+        for offset, length in _ranges(size, transferConfig.partSize)
+    ]
+    try:
+        for future in futures:
+            future.result()
+    except Exception:
+        for future in futures:
+            future.cancel()
+        partial.unlink(missing_ok=True)
+        raise
+
+    os.replace(partial, path)
+    return size
 
-            # Skip directories and non-files
-            if not dump.is_file():
+
+def _downloadObjects(
+    client: Minio,
+    s3: S3Config,
+    objects: Iterable[tuple[Object, Path]],
+    transferConfig: TransferConfig,
+) -> tuple[list[Path], list[Exception]]:
+    """
+    Downloads objects to their local path `transferConfig.jobs` at a time,
+    each split into byte ranges fetched `transferConfig.parts` at a time.
+    Objects are submitted as they are listed. Returns the downloaded paths and
+    the errors of the others (and of the listing, which stops submitting).
+    """
+    jobs = max(1, transferConfig.jobs)
+    requests = jobs * max(1, transferConfig.parts)
+    throttle = _throttle(transferConfig.maxBandwidth, jobs, requests, transferConfig.adaptive)
+
+    done, errors = [], []
+    received = 0
+    start = time.monotonic()
+
+    # Files and their ranges run on separate pools, so that files waiting on
+    # their ranges never hold up the ranges themselves
+    with (
+        ThreadPoolExecutor(max_workers=jobs) as files,
+        ThreadPoolExecutor(max_workers=requests) as ranges,
+    ):
+        futures = {}
+        try:
+            for obj, path in objects:
+                name = cast(str, obj.object_name)
+                size = obj.size or 0
+                future = files.submit(
+                    _downloadFile, client, s3, name, size, path, transferConfig, ranges, throttle
+                )
+                futures[future] = (name, path)
+        except Exception as err:
+            logging.error(f"Failed to list the objects to Download: {err}")
+            errors.append(err)
+
+        for future in as_completed(futures):
+            name, path = futures[future]
+            try:
+                received += future.result()
+                done.append(path)
+            except Exception as err:
+                logging.error(f"Failed to Download {name}: {err}")
+                errors.append(err)
                 continue
 
-            logging.debug(
-                f"Uploading {dump} to {s3.endpoint}/{s3.bucket}/{dump.as_posix()}"
+            elapsed = max(time.monotonic() - start, 1e-6)
+            logging.info(
+                f"Downloaded {len(done)}/{len(futures)} files, {_mib(received)} ({_mib(received / elapsed)}/s)"
             )
 
-            client.fput_object(
-                bucket_name=s3.bucket,
-                object_name=dump.as_posix(),
-                file_path=dump.as_posix(),
-            )
+    return done, errors
 
-    except Exception as err:
-        logging.error(f"Failed to Upload: {err}")
-        return err
+
+def _listObjects(client: Minio, s3: S3Config, prefix: str | None = None) -> Iterator[Object]:
+    """
+    Lists the objects (not directories, nor the catalog) of the bucket, as
+    they are paged in.
+    """
+    for obj in client.list_objects(s3.bucket, prefix=prefix, recursive=True):
+        logging.debug(f"obj: {obj}")
+
+        if obj.object_name is None or obj.is_dir or obj.object_name == CATALOG:
+            continue
+
+        yield obj
+
+
+def _isTimestamp(name: str) -> bool:
+    try:
+        _ = datetime.strptime(name, TIMESTAMP)
+        return True
+    except ValueError:
+        return False
+
+
+def _latestPrefix(client: Minio, s3: S3Config, prefix: str | None = None) -> str:
+    """
+    Returns the most recent timestamped backup prefix directly under `prefix`,
+    listing only one level of "directories" (delimiter listing) rather than
+    every key of every backup.
+    """
+    if prefix and not prefix.endswith("/"):
+        prefix = f"{prefix}/"
+
+    timestamps = [
+        cast(str, obj.object_name)
+        for obj in client.list_objects(s3.bucket, prefix=prefix, recursive=False)
+        if obj.is_dir and _isTimestamp(cast(str, obj.object_name).removeprefix(prefix or "").rstrip("/"))
+    ]
+    if not timestamps:
+        raise FileNotFoundError(f"No timestamped backup found under '{prefix or ''}' in bucket {s3.bucket}")
+
+    # Timestamps sort chronologically
+    return max(timestamps)
+
+
+def _selectPrefix(client: Minio, s3: S3Config, selectConfig: SelectConfig) -> str | None:
+    if selectConfig.latest:
+        prefix = _latestPrefix(client, s3, selectConfig.prefix)
+        logging.info(f"Selected latest backup {prefix}")
+        return prefix
+
+    return selectConfig.prefix
+
+
+def _selected(key: str, prefix: str | None, selectConfig: SelectConfig) -> bool:
+    """
+    Returns whether a key (under `prefix`) matches the include and exclude
+    globs of the selection.
+    """
+    name = key.removeprefix(prefix or "").lstrip("/")
+
+    if selectConfig.include and not any(fnmatchcase(name, glob) for glob in selectConfig.include):
+        return False
+
+    return not any(fnmatchcase(name, glob) for glob in selectConfig.exclude)
 
 
 def _download(
     s3: S3Config,
     dir: Path,
+    transferConfig: TransferConfig | None = None,
+    selectConfig: SelectConfig | None = None,
 ):
     """
     Downloads a file from S3 (MinIO/Ceph compatible).
+
+    Only the objects under the selected prefix matching its globs are
+    downloaded, starting as soon as they are listed. Objects are downloaded
+    `transferConfig.jobs` at a time, each split into byte ranges fetched
+    `transferConfig.parts` at a time. Returns the first error, after
+    attempting every object.
     """
+    transferConfig = transferConfig or TransferConfig()
+    selectConfig = selectConfig or SelectConfig()
 
-    client = _getS3Client(s3)
+    client = _getS3Client(s3, transferConfig.jobs * transferConfig.parts, throttled=True)
+    metadata = _getS3Client(s3)
 
-    for obj in client.list_objects(s3.bucket, recursive=True):
-        name = obj.object_name
-        logging.debug(f"obj: {obj}")
+    try:
+        prefix = _selectPrefix(metadata, s3, selectConfig)
+    except Exception as err:
+        logging.error(f"Failed to Download: {err}")
+        return err
 
-        if name is None:
-            continue
+    objects = (
+        (obj, dir / cast(str, obj.object_name))
+        for obj in _listObjects(metadata, s3, prefix)
+        if _selected(cast(str, obj.object_name), prefix, selectConfig)
+    )
+    _, errors = _downloadObjects(client, s3, objects, transferConfig)
 
-        path = (dir / name).as_posix()
+    if errors:
+        return errors[0]
 
-        logging.debug(f"Downloading {name} from bucket {s3.bucket} to {path}")
-        obj = client.fget_object(
-            bucket_name=s3.bucket,
-            object_name=name,
-            file_path=path,
-        )
+
+def _readObject(client: Minio, s3: S3Config, key: str) -> dict:
+    """
+    Reads a (small) JSON object.
+    """
+    response = client.get_object(s3.bucket, key)
+    try:
+        return orjson.loads(response.read())
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def _writeObject(client: Minio, s3: S3Config, key: str, value: dict):
+    data = orjson.dumps(value)
+    _ = client.put_object(s3.bucket, key, io.BytesIO(data), len(data))
+
+
+def _component(parts: list[str]) -> str:
+    """
+    Returns the component a backup file belongs to, from its suffix or that
+    of the directory artifact holding it (e.g. DB.copy/, GRAPH.shards/).
+    """
+    for part in parts:
+        for component, suffixes in COMPONENTS.items():
+            if part.endswith(suffixes):
+                return component
+
+    return "other"
+
+
+def _backup(key: str) -> tuple[str, str]:
+    """
+    Splits a key into its backup prefix (up to its timestamp, e.g.
+    DIR/TIMESTAMP/) and component (e.g. postgres or grip).
+
+    Keys outside of a timestamped backup (e.g. dedup chunks) are grouped by
+    their top-level prefix.
+    """
+    parts = key.split("/")
+    for i, part in enumerate(parts[:-1]):
+        if _isTimestamp(part):
+            return "/".join(parts[: i + 1]) + "/", _component(parts[i + 1 :])
+
+    return (f"{parts[0]}/" if len(parts) > 1 else ""), "other"
+
+
+def _summarize(client: Minio, s3: S3Config, objects: Iterable[Object]) -> dict[str, dict]:
+    """
+    Aggregates the object count and bytes of every backup, per component.
+    Deduplicated backups count the files of their index rather than the index
+    itself.
+    """
+    backups: dict[str, dict] = {}
+    for obj in objects:
+        key = cast(str, obj.object_name)
+        files = [(key, obj.size or 0)]
+        if PurePosixPath(key).name == DEDUP_INDEX:
+            parent = PurePosixPath(key).parent
+            index = _readObject(client, s3, key)
+            files = [((parent / name).as_posix(), entry["size"]) for name, entry in index["files"].items()]
+
+        for name, size in files:
+            prefix, component = _backup(name)
+            backup = backups.setdefault(prefix, {"objects": 0, "bytes": 0, "components": {}})
+            backup["objects"] += 1
+            backup["bytes"] += size
+
+            counts = backup["components"].setdefault(component, {"objects": 0, "bytes": 0})
+            counts["objects"] += 1
+            counts["bytes"] += size
+
+    return backups
+
+
+def _readCatalog(client: Minio, s3: S3Config) -> dict | None:
+    """
+    Reads the catalog of the bucket, if there is one.
+    """
+    try:
+        return _readObject(client, s3, CATALOG)
+    except S3Error as err:
+        if err.code == "NoSuchKey":
+            return None
+        raise
+
+
+def _refreshCatalog(client: Minio, s3: S3Config, prefixes: list[str] | None = None) -> dict:
+    """
+    Rebuilds the entries of the given backup prefixes in the catalog by
+    listing them, or the whole catalog by listing the whole bucket.
+    """
+    catalog = {"backups": {}}
+    listing: Iterable[Object] = _listObjects(client, s3)
+    if prefixes is not None:
+        catalog = _readCatalog(client, s3) or catalog
+        for prefix in prefixes:
+            catalog["backups"].pop(prefix, None)
+        listing = itertools.chain.from_iterable(_listObjects(client, s3, prefix) for prefix in prefixes)
+
+    catalog["backups"].update(_summarize(client, s3, listing))
+    catalog["updated"] = datetime.now(timezone.utc).strftime(TIMESTAMP)
+    _writeObject(client, s3, CATALOG, catalog)
+
+    return catalog
+
+
+def _updateCatalog(client: Minio, s3: S3Config, keys: list[str]):
+    """
+    Refreshes the catalog entries of the timestamped backups the uploaded
+    keys belong to. Concurrent uploads may overwrite each other's entries,
+    which `bak s3 ls --refresh` repairs, so failures only warn.
+    """
+    prefixes = {
+        prefix
+        for prefix, _ in map(_backup, keys)
+        if _isTimestamp(prefix.rstrip("/").rsplit("/", 1)[-1])
+    }
+    if not prefixes:
+        return
+
+    try:
+        _ = _refreshCatalog(client, s3, sorted(prefixes))
+    except Exception as err:
+        logging.warning(f"Failed to update the catalog of bucket {s3.bucket}: {err}")
+
+
+def _listBackups(s3: S3Config, refresh: bool = False) -> dict[str, dict]:
+    """
+    Returns the summary of every backup of the bucket from its catalog (a
+    single GET), rebuilding it from a full listing when missing or when
+    `refresh` is set.
+    """
+    client = _getS3Client(s3)
+
+    catalog = None if refresh else _readCatalog(client, s3)
+    if catalog is None:
+        logging.info(f"Rebuilding the catalog of bucket {s3.bucket}")
+        catalog = _refreshCatalog(client, s3)
+
+    return catalog["backups"]
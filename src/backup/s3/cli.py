@@ -1,12 +1,24 @@
 from backup.s3 import (
     S3Config,
+    SelectConfig,
+    TransferConfig,
     _download,
+    _listBackups,
     _upload,
 )
+from backup.s3.sync import (
+    _sync,
+)
+from backup.s3.dedup import (
+    _download as _downloadDedup,
+    _upload as _uploadDedup,
+)
 from backup.options import (
+    _humanSize,
     dir_flags,
 )
 import click
+import logging
 from pathlib import Path
 
 
@@ -26,6 +38,100 @@ def s3_flags(fn):
     return fn
 
 
+# Transfer flags
+def s3_transfer_flags(fn):
+    options = [
+        click.option(
+            "--jobs",
+            "-j",
+            envvar="S3_JOBS",
+            default=4,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Files transferred at once ($S3_JOBS)",
+        ),
+        click.option(
+            "--part-size",
+            default=64,
+            show_default=True,
+            type=click.IntRange(min=5),
+            help="Multipart upload part or ranged download size in MiB",
+        ),
+        click.option(
+            "--parts",
+            default=4,
+            show_default=True,
+            type=click.IntRange(min=1),
+            help="Parts of a file transferred at once",
+        ),
+        click.option(
+            "--max-bandwidth",
+            envvar="S3_MAX_BANDWIDTH",
+            default=0,
+            show_default=True,
+            type=click.FloatRange(min=0),
+            help="Bandwidth limit in MiB/s, 0 for none ($S3_MAX_BANDWIDTH)",
+        ),
+        click.option(
+            "--adaptive/--no-adaptive",
+            default=True,
+            show_default=True,
+            help="Adjust concurrency to S3 throttling and latency, up to --jobs × --parts requests",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+# Selection flags (downloads)
+def s3_select_flags(fn):
+    options = [
+        click.option(
+            "--prefix",
+            "-p",
+            default=None,
+            help="Only download objects under this key prefix (e.g. DIR/TIMESTAMP/)",
+        ),
+        click.option(
+            "--include",
+            "-i",
+            multiple=True,
+            help="Only download keys (relative to the prefix) matching this glob, repeatable",
+        ),
+        click.option(
+            "--exclude",
+            "-x",
+            multiple=True,
+            help="Skip keys (relative to the prefix) matching this glob, repeatable",
+        ),
+        click.option(
+            "--latest",
+            is_flag=True,
+            default=False,
+            help="Only download the most recent timestamped backup under the prefix",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
+# Dedup flags
+def s3_dedup_flags(fn):
+    options = [
+        click.option(
+            "--dedup",
+            is_flag=True,
+            default=False,
+            help="Store files as content-defined chunks shared across backups",
+        ),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+
 @click.group()
 def s3():
     """Commands for S3."""
@@ -34,28 +140,131 @@ def s3():
 
 @s3.command()
 @s3_flags
-def ls(endpoint: str, bucket: str):
-    # TODO: Implement
-    pass
+@click.option(
+    "--refresh",
+    is_flag=True,
+    default=False,
+    help="Rebuild the catalog from a full listing of the bucket",
+)
+def ls(endpoint: str, bucket: str, refresh: bool):
+    """list backups"""
+    conf = S3Config(endpoint=endpoint, bucket=bucket)
+
+    try:
+        backups = _listBackups(conf, refresh)
+    except Exception as err:
+        raise click.ClickException(f"Failed to list {bucket}: {err}")
+
+    if not backups:
+        logging.warning(f"No backups found in {bucket}.")
+        return
+
+    # Oldest first, as timestamps sort chronologically
+    for prefix, backup in sorted(backups.items()):
+        components = ", ".join(
+            f"{name} {_humanSize(counts['bytes'])}" for name, counts in sorted(backup["components"].items())
+        )
+        click.echo(f"{prefix}\t{backup['objects']} objects\t{_humanSize(backup['bytes'])}\t{components}")
 
 
 @s3.command()
 @s3_flags
 @dir_flags
-def download(endpoint: str, bucket: str, dir: Path):
+@s3_transfer_flags
+@s3_select_flags
+@s3_dedup_flags
+def download(
+    endpoint: str,
+    bucket: str,
+    dir: Path,
+    jobs: int,
+    part_size: int,
+    parts: int,
+    max_bandwidth: float,
+    adaptive: bool,
+    prefix: str | None,
+    include: tuple[str, ...],
+    exclude: tuple[str, ...],
+    latest: bool,
+    dedup: bool,
+):
     """s3 ➜ local"""
     conf = S3Config(endpoint=endpoint, bucket=bucket)
+    transferConf = TransferConfig(
+        jobs=jobs,
+        partSize=part_size * 1024**2,
+        parts=parts,
+        maxBandwidth=int(max_bandwidth * 1024**2),
+        adaptive=adaptive,
+    )
+    selectConf = SelectConfig(prefix=prefix, include=list(include), exclude=list(exclude), latest=latest)
 
     # Download from S3
-    _ = _download(conf, dir)
+    download = _downloadDedup if dedup else _download
+    err = download(conf, dir, transferConf, selectConf)
+    if err:
+        raise click.ClickException(f"Failed to download to {dir}: {err}")
 
 
 @s3.command()
 @s3_flags
 @dir_flags
-def upload(endpoint: str, bucket: str, dir: Path):
+@s3_transfer_flags
+@s3_dedup_flags
+def upload(
+    endpoint: str,
+    bucket: str,
+    dir: Path,
+    jobs: int,
+    part_size: int,
+    parts: int,
+    max_bandwidth: float,
+    adaptive: bool,
+    dedup: bool,
+):
     """local ➜ s3"""
     s3 = S3Config(endpoint=endpoint, bucket=bucket)
+    transferConf = TransferConfig(
+        jobs=jobs,
+        partSize=part_size * 1024**2,
+        parts=parts,
+        maxBandwidth=int(max_bandwidth * 1024**2),
+        adaptive=adaptive,
+    )
 
     # Upload to S3
-    _ = _upload(s3, dir)
+    upload = _uploadDedup if dedup else _upload
+    err = upload(s3, dir, transferConf)
+    if err:
+        raise click.ClickException(f"Failed to upload {dir}: {err}")
+
+
+@s3.command()
+@s3_flags
+@dir_flags
+@s3_transfer_flags
+@click.argument("direction", type=click.Choice(["up", "down"]))
+def sync(
+    endpoint: str,
+    bucket: str,
+    dir: Path,
+    jobs: int,
+    part_size: int,
+    parts: int,
+    max_bandwidth: float,
+    adaptive: bool,
+    direction: str,
+):
+    """local ➜ s3 (up) or s3 ➜ local (down), skipping unchanged files"""
+    conf = S3Config(endpoint=endpoint, bucket=bucket)
+    transferConf = TransferConfig(
+        jobs=jobs,
+        partSize=part_size * 1024**2,
+        parts=parts,
+        maxBandwidth=int(max_bandwidth * 1024**2),
+        adaptive=adaptive,
+    )
+
+    err = _sync(conf, dir, direction, transferConf)
+    if err:
+        raise click.ClickException(f"Failed to sync {dir} {direction}: {err}")
@@ -0,0 +1,366 @@
+### Content-defined chunk deduplication of backups in S3:
+#
+# BUCKET
+# ├─ chunks/ab/abcdef...               <-- chunk, keyed by the SHA-256 of its content
+# ├─ DIR/TIMESTAMP/.bak-dedup.json     <-- index: file -> size and ordered chunks
+# └─ .bak-catalog.json                 <-- summary of every backup (see `bak s3 ls`)
+#
+# Files are split with FastCDC: chunk boundaries depend on the content around
+# them rather than on fixed offsets, so an insertion or deletion only changes
+# the chunks it touches. Chunks already in the bucket are skipped, so the
+# storage and upload volume of a nightly backup follow the churn since the
+# previous ones instead of the total size of the dumps. The chunks of the
+# previous backup of the same directory (its latest timestamped sibling) are
+# read from its index; any other chunk is checked with a HEAD request before
+# being uploaded, so the cost of an upload never grows with the bucket.
+#
+# Downloads reassemble the selected files of every index (see `SelectConfig`),
+# fetching their chunks in parallel and writing them in place at their offset.
+# Indexes are found with delimiter listings that never descend into chunks/.
+#
+# Chunks are shared by every backup referencing them: deleting a backup's
+# prefix only removes its index.
+#
+# Ref: https://www.usenix.org/conference/atc16/technical-sessions/presentation/xia
+
+from backup.s3 import (
+    DEDUP_INDEX,
+    S3Config,
+    SelectConfig,
+    TransferConfig,
+    _downloadRange,
+    _files,
+    _getS3Client,
+    _latestPrefix,
+    _mib,
+    _readObject,
+    _selectPrefix,
+    _selected,
+    _updateCatalog,
+    _writeObject,
+)
+from backup.s3.throttle import Throttle, _consume, _scheduled, _throttle
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from fastcdc import fastcdc
+from hashlib import sha256
+from minio import Minio
+from minio.error import S3Error
+from pathlib import Path, PurePosixPath
+from typing import Iterator, cast
+import io
+import logging
+import os
+import threading
+import time
+
+# Minimum, average and maximum chunk sizes
+CHUNK_MIN = 256 * 1024
+CHUNK_AVG = 1024 * 1024
+CHUNK_MAX = 4 * 1024 * 1024
+
+# Prefix of the content-addressed chunks
+CHUNKS_PREFIX = "chunks/"
+
+
+def _chunkKey(digest: str) -> str:
+    return f"{CHUNKS_PREFIX}{digest[:2]}/{digest}"
+
+
+def _indexKey(dir: Path) -> str:
+    return (dir / DEDUP_INDEX).as_posix()
+
+
+def _storedChunks(client: Minio, s3: S3Config, dir: Path) -> set[str]:
+    """
+    Returns the digests of the chunks of the previous backup of `dir` (the
+    latest timestamped backup next to it), which are known to be in the
+    bucket.
+    """
+    parent = dir.parent.as_posix()
+    try:
+        previous = _latestPrefix(client, s3, None if parent == "." else parent)
+        index = _readObject(client, s3, _indexKey(Path(previous)))
+    except FileNotFoundError:
+        return set()
+    except S3Error as err:
+        if err.code == "NoSuchKey":
+            return set()
+        raise
+
+    logging.info(f"Deduplicating against the previous backup {previous}")
+    return {digest for entry in index["files"].values() for digest, _ in entry["chunks"]}
+
+
+def _putChunk(client: Minio, s3: S3Config, digest: str, data: bytes, throttle: Throttle | None = None) -> int:
+    """
+    Uploads a chunk unless the bucket already has it (from an older backup).
+    Returns the bytes uploaded.
+    """
+    try:
+        _ = client.stat_object(s3.bucket, _chunkKey(digest))
+        return 0
+    except S3Error as err:
+        if err.code != "NoSuchKey":
+            raise
+
+    _consume(throttle, len(data))
+    _ = client.put_object(s3.bucket, _chunkKey(digest), io.BytesIO(data), len(data))
+    return len(data)
+
+
+def _uploadChunks(
+    client: Minio,
+    s3: S3Config,
+    dump: Path,
+    transferConfig: TransferConfig,
+    chunks: ThreadPoolExecutor,
+    stored: set[str],
+    lock: threading.Lock,
+    throttle: Throttle | None = None,
+) -> tuple[dict, int]:
+    """
+    Splits a file into chunks and uploads the ones the bucket doesn't have
+    yet (on the `chunks` pool), `transferConfig.parts` at a time. Returns the
+    file's index entry and the bytes uploaded.
+
+    `stored` holds the chunks known to be in the bucket, and is updated with
+    the ones this upload handles.
+    """
+    size = dump.stat().st_size
+    entry: dict = {"size": size, "chunks": []}
+
+    sent = 0
+    pending: list[Future] = []
+    try:
+        # FastCDC memory-maps the file, which fails for empty files
+        for chunk in fastcdc(dump.as_posix(), CHUNK_MIN, CHUNK_AVG, CHUNK_MAX, fat=True, hf=sha256) if size else []:
+            entry["chunks"].append([chunk.hash, chunk.length])
+
+            # Chunks repeated within this backup are only uploaded once
+            with lock:
+                if chunk.hash in stored:
+                    continue
+                stored.add(chunk.hash)
+
+            pending.append(
+                chunks.submit(
+                    _scheduled, throttle, chunk.length, _putChunk, client, s3, chunk.hash, chunk.data, throttle
+                )
+            )
+
+            # Bounds the chunks held in memory
+            if len(pending) >= max(1, transferConfig.parts):
+                sent += pending.pop(0).result()
+
+        for future in pending:
+            sent += future.result()
+    except Exception:
+        for future in pending:
+            future.cancel()
+        raise
+
+    logging.debug(f"Chunked {dump} into {len(entry['chunks'])} chunks, {_mib(sent)} new")
+    return entry, sent
+
+
+def _upload(s3: S3Config, dir: Path, transferConfig: TransferConfig | None = None):
+    """
+    Uploads the files of a dump directory as deduplicated chunks, then its
+    index. The index is only written when every file was uploaded, so it
+    never references missing chunks. Returns the first error, after
+    attempting every file.
+    """
+    transferConfig = transferConfig or TransferConfig()
+    jobs = max(1, transferConfig.jobs)
+    requests = jobs * max(1, transferConfig.parts)
+    throttle = _throttle(transferConfig.maxBandwidth, jobs, requests, transferConfig.adaptive)
+
+    client = _getS3Client(s3, requests, throttled=True)
+    metadata = _getS3Client(s3)
+
+    try:
+        stored = _storedChunks(metadata, s3, dir)
+        logging.info(f"Found {len(stored)} chunks of the previous backup in bucket {s3.bucket}")
+
+        dumps = _files(dir)
+        sizes = {dump: dump.stat().st_size for dump in dumps}
+        total = sum(sizes.values())
+
+        files, errors = {}, []
+        read, sent = 0, 0
+        lock = threading.Lock()
+        start = time.monotonic()
+        with (
+            ThreadPoolExecutor(max_workers=jobs) as pool,
+            ThreadPoolExecutor(max_workers=requests) as chunks,
+        ):
+            futures = {
+                pool.submit(_uploadChunks, client, s3, dump, transferConfig, chunks, stored, lock, throttle): dump
+                for dump in sorted(dumps, key=sizes.__getitem__, reverse=True)
+            }
+
+            for future in as_completed(futures):
+                dump = futures[future]
+                try:
+                    files[dump.relative_to(dir).as_posix()], new = future.result()
+                except Exception as err:
+                    logging.error(f"Failed to Upload {dump}: {err}")
+                    errors.append(err)
+                    continue
+
+                read += sizes[dump]
+                sent += new
+                elapsed = max(time.monotonic() - start, 1e-6)
+                logging.info(
+                    f"Uploaded {len(files)}/{len(dumps)} files, {_mib(read)} of {_mib(total)} "
+                    f"({_mib(sent)} new, {_mib(read / elapsed)}/s)"
+                )
+
+        if errors:
+            return errors[0]
+
+        index = {
+            "chunker": {"algorithm": "fastcdc", "min": CHUNK_MIN, "avg": CHUNK_AVG, "max": CHUNK_MAX},
+            "files": files,
+        }
+        _writeObject(metadata, s3, _indexKey(dir), index)
+        _updateCatalog(metadata, s3, [_indexKey(dir)])
+
+        logging.info(f"Uploaded {_mib(sent)} of new chunks for {_mib(total)} of files")
+
+    except Exception as err:
+        logging.error(f"Failed to Upload: {err}")
+        return err
+
+
+def _assembleFile(
+    client: Minio,
+    s3: S3Config,
+    entry: dict,
+    path: Path,
+    chunks: ThreadPoolExecutor,
+    throttle: Throttle | None = None,
+) -> int:
+    """
+    Reassembles a file from its chunks, fetched concurrently (on the `chunks`
+    pool) into a temporary file, renamed once complete.
+    """
+    logging.debug(f"Assembling {path} from {len(entry['chunks'])} chunks")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f".{path.name}.part")
+
+    with open(partial, "wb") as f:
+        f.truncate(entry["size"])
+
+    futures = []
+    position = 0
+    for digest, length in entry["chunks"]:
+        futures.append(
+            chunks.submit(
+                _scheduled,
+                throttle,
+                length,
+                _downloadRange,
+                client,
+                s3,
+                _chunkKey(digest),
+                partial,
+                0,
+                length,
+                position,
+                throttle,
+            )
+        )
+        position += length
+
+    try:
+        for future in futures:
+            future.result()
+    except Exception:
+        for future in futures:
+            future.cancel()
+        partial.unlink(missing_ok=True)
+        raise
+
+    os.replace(partial, path)
+    return entry["size"]
+
+
+def _indexKeys(client: Minio, s3: S3Config, prefix: str | None = None) -> Iterator[str]:
+    """
+    Lists the dedup indexes under `prefix`, one "directory" at a time
+    (delimiter listing), skipping the chunks.
+    """
+    for obj in client.list_objects(s3.bucket, prefix=prefix, recursive=False):
+        key = cast(str, obj.object_name)
+        if obj.is_dir:
+            if key != CHUNKS_PREFIX:
+                yield from _indexKeys(client, s3, key)
+        elif PurePosixPath(key).name == DEDUP_INDEX:
+            yield key
+
+
+def _download(
+    s3: S3Config,
+    dir: Path,
+    transferConfig: TransferConfig | None = None,
+    selectConfig: SelectConfig | None = None,
+):
+    """
+    Reassembles the selected files of the deduplicated backups of the bucket
+    into `dir`, `transferConfig.jobs` files at a time, each fetching
+    `transferConfig.parts` chunks at a time. Returns the first error, after
+    attempting every file.
+    """
+    transferConfig = transferConfig or TransferConfig()
+    selectConfig = selectConfig or SelectConfig()
+    jobs = max(1, transferConfig.jobs)
+    requests = jobs * max(1, transferConfig.parts)
+    throttle = _throttle(transferConfig.maxBandwidth, jobs, requests, transferConfig.adaptive)
+
+    client = _getS3Client(s3, requests, throttled=True)
+    metadata = _getS3Client(s3)
+
+    try:
+        prefix = _selectPrefix(metadata, s3, selectConfig)
+        indexes = {key: _readObject(metadata, s3, key) for key in _indexKeys(metadata, s3, prefix)}
+    except Exception as err:
+        logging.error(f"Failed to Download: {err}")
+        return err
+
+    done, errors = 0, []
+    received = 0
+    start = time.monotonic()
+    with (
+        ThreadPoolExecutor(max_workers=jobs) as files,
+        ThreadPoolExecutor(max_workers=requests) as chunks,
+    ):
+        futures = {}
+        for key, index in indexes.items():
+            for name, entry in index["files"].items():
+                # Key the file would have without dedup
+                fileKey = (PurePosixPath(key).parent / name).as_posix()
+                if not _selected(fileKey, prefix, selectConfig):
+                    continue
+
+                path = dir / fileKey
+                futures[files.submit(_assembleFile, client, s3, entry, path, chunks, throttle)] = path
+
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                received += future.result()
+                done += 1
+            except Exception as err:
+                logging.error(f"Failed to Download {path}: {err}")
+                errors.append(err)
+                continue
+
+            elapsed = max(time.monotonic() - start, 1e-6)
+            logging.info(
+                f"Downloaded {done}/{len(futures)} files, {_mib(received)} ({_mib(received / elapsed)}/s)"
+            )
+
+    if errors:
+        return errors[0]
@@ -0,0 +1,172 @@
+### rsync-style synchronization between a dump directory and S3:
+#
+# Files are only transferred when they differ from their counterpart, compared
+# by size and then by ETag:
+#
+# - A local manifest (DIR/.bak-sync.json) caches, per file, the size, mtime
+#   and ETag of the object it was last synced with, so unchanged files aren't
+#   hashed again.
+# - Otherwise the file's ETag is computed locally: the MD5 of the file, or for
+#   multipart uploads the MD5 of the parts' MD5s followed by "-N" (with the
+#   configured part size).
+#
+# Objects keep the keys of `bak s3 upload`: files are keyed by their path
+# (DIR/...), and syncing down writes the objects under DIR/ back to that path.
+# Deduplicated chunks and the catalog are never synced.
+
+from backup.s3 import (
+    SYNC_MANIFEST,
+    S3Config,
+    TransferConfig,
+    _downloadObjects,
+    _files,
+    _getS3Client,
+    _listObjects,
+    _updateCatalog,
+    _uploadFiles,
+)
+from backup.s3.dedup import CHUNKS_PREFIX
+from hashlib import md5
+from minio.datatypes import Object
+from pathlib import Path
+from typing import cast
+import logging
+import math
+import orjson
+import os
+
+# Read size when hashing files
+HASH_BUFFER = 1024 * 1024
+
+
+def _readManifest(dir: Path) -> dict[str, dict]:
+    """
+    Reads the sync manifest of a directory, if there is one.
+    """
+    manifest = dir / SYNC_MANIFEST
+    if not manifest.is_file():
+        return {}
+
+    return orjson.loads(manifest.read_bytes())
+
+
+def _writeManifest(dir: Path, entries: dict[str, dict]):
+    manifest = dir / SYNC_MANIFEST
+    partial = manifest.with_name(f".{manifest.name}.tmp")
+    partial.write_bytes(orjson.dumps(entries, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    os.replace(partial, manifest)
+
+
+def _etag(path: Path, partSize: int) -> str:
+    """
+    Computes the ETag S3 assigns to a file uploaded with `partSize` parts.
+    """
+    size = path.stat().st_size
+
+    digests = []
+    with open(path, "rb") as f:
+        for _ in range(max(1, math.ceil(size / partSize))):
+            part = md5()
+            remaining = partSize
+            while remaining and (data := f.read(min(HASH_BUFFER, remaining))):
+                part.update(data)
+                remaining -= len(data)
+            digests.append(part.digest())
+
+    if size <= partSize:
+        return digests[0].hex()
+
+    return f"{md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+def _entry(path: Path, etag: str) -> dict:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "etag": etag}
+
+
+def _unchanged(path: Path, obj: Object, entry: dict | None, partSize: int) -> bool:
+    """
+    Returns whether a local file has the same content as an object.
+    """
+    if not path.is_file():
+        return False
+
+    etag = (obj.etag or "").strip('"')
+    stat = path.stat()
+    if stat.st_size != obj.size:
+        return False
+
+    # Synced before and untouched since
+    if entry and (entry["size"], entry["mtime"], entry["etag"]) == (stat.st_size, stat.st_mtime_ns, etag):
+        return True
+
+    return _etag(path, partSize) == etag
+
+
+def _prefix(dir: Path) -> str:
+    return "" if dir.as_posix() == "." else f"{dir.as_posix()}/"
+
+
+def _sync(s3: S3Config, dir: Path, direction: str, transferConfig: TransferConfig | None = None):
+    """
+    Uploads (`up`) or downloads (`down`) the files of a dump directory that
+    differ from their counterpart. Returns the first error, after attempting
+    every file.
+    """
+    transferConfig = transferConfig or TransferConfig()
+
+    client = _getS3Client(s3, transferConfig.jobs * transferConfig.parts, throttled=True)
+    metadata = _getS3Client(s3)
+    dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = _readManifest(dir)
+    entries: dict[str, dict] = {}
+
+    prefix = _prefix(dir)
+    try:
+        remote = {
+            cast(str, obj.object_name): obj
+            for obj in _listObjects(metadata, s3, prefix)
+            if not cast(str, obj.object_name).startswith(CHUNKS_PREFIX)
+        }
+    except Exception as err:
+        logging.error(f"Failed to Sync: {err}")
+        return err
+
+    if direction == "up":
+        pending = []
+        for dump in _files(dir):
+            name = dump.relative_to(dir).as_posix()
+            obj = remote.get(dump.as_posix())
+            if obj and _unchanged(dump, obj, manifest.get(name), transferConfig.partSize):
+                entries[name] = _entry(dump, (obj.etag or "").strip('"'))
+            else:
+                pending.append(dump)
+
+        logging.info(f"Uploading {len(pending)} changed files, {len(entries)} unchanged")
+        etags, errors = _uploadFiles(client, s3, pending, transferConfig)
+        for dump, etag in etags.items():
+            entries[dump.relative_to(dir).as_posix()] = _entry(dump, etag)
+        _updateCatalog(metadata, s3, [dump.as_posix() for dump in etags])
+
+    else:
+        objects = {}
+        for key, obj in remote.items():
+            name = key.removeprefix(prefix)
+            path = dir / name
+            if _unchanged(path, obj, manifest.get(name), transferConfig.partSize):
+                entries[name] = _entry(path, (obj.etag or "").strip('"'))
+            else:
+                objects[path] = obj
+
+        logging.info(f"Downloading {len(objects)} changed objects, {len(entries)} unchanged")
+        done, errors = _downloadObjects(
+            client, s3, ((obj, path) for path, obj in objects.items()), transferConfig
+        )
+        for path in done:
+            entries[path.relative_to(dir).as_posix()] = _entry(path, (objects[path].etag or "").strip('"'))
+
+    _writeManifest(dir, entries)
+
+    if errors:
+        return errors[0]
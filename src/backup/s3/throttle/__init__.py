@@ -0,0 +1,187 @@
+### Bandwidth limiting and adaptive concurrency of S3 transfers:
+#
+# Every request of a transfer (file upload, ranged GET, chunk) goes through a
+# shared `Throttle`:
+#
+# - Bandwidth: a token bucket refilled at `--max-bandwidth` bytes per second
+#   (with a one second burst). Transfers take tokens as they read or write
+#   data and sleep off any debt, so the aggregate rate stays under the limit.
+# - Concurrency (AIMD): requests wait for one of `limit` slots. Each healthy
+#   completion raises the limit by 1/limit (about one more slot per round of
+#   requests), up to `jobs × parts`. S3 throttling (503 SlowDown) or a request
+#   taking LATENCY_FACTOR times longer per byte than the best seen for its
+#   size class halves it, at most once per round. Throttled requests are
+#   retried after a backoff. Size classes (powers of two) keep the small files
+#   at the end of a largest-first upload from being compared with the large
+#   ones, which amortize their round trip over more bytes.
+#
+# Ref: https://docs.aws.amazon.com/AmazonS3/latest/userguide/optimizing-performance-design-patterns.html
+
+from dataclasses import dataclass, field
+from minio.error import S3Error, ServerError
+from typing import Callable, TypeVar
+import logging
+import random
+import threading
+import time
+
+T = TypeVar("T")
+
+# S3 error codes of throttled requests
+SLOWDOWN_CODES = {"SlowDown", "ServiceUnavailable", "RequestLimitExceeded", "Throttling", "TooManyRequests"}
+
+# Retries of a throttled request, and the base of their exponential backoff (seconds)
+SLOWDOWN_RETRIES = 5
+SLOWDOWN_BACKOFF = 0.5
+
+# Slowdown (per byte) over the best request seen that counts as congestion
+LATENCY_FACTOR = 3.0
+
+# Growth of the best time per byte on every request, so it follows a link
+# whose capacity changed instead of sticking to its best moment
+BASELINE_DRIFT = 1.01
+
+# Bytes a request's round trip is worth, so that small requests aren't
+# mistaken for slow ones
+REQUEST_OVERHEAD = 256 * 1024
+
+
+@dataclass
+class Throttle:
+    """Shared bandwidth and concurrency limits of a transfer"""
+
+    # Bytes per second, 0 for unlimited
+    bandwidth: float = 0
+
+    # Concurrent requests allowed (AIMD), and its upper bound
+    limit: float = 1
+    maxLimit: int = 1
+    adaptive: bool = True
+
+    # Token bucket
+    tokens: float = 0
+    refilled: float = field(default_factory=time.monotonic)
+
+    # Requests in flight, best time per byte seen per size class and time of
+    # the last decrease
+    active: int = 0
+    baselines: dict[int, float] = field(default_factory=dict)
+    decreased: float = 0
+
+    condition: threading.Condition = field(default_factory=threading.Condition)
+
+
+def _throttle(bandwidth: float, jobs: int, maxLimit: int, adaptive: bool = True) -> Throttle:
+    """
+    Returns the throttle of a transfer, starting at `jobs` concurrent requests
+    (or always `maxLimit` when not adaptive).
+    """
+    maxLimit = max(1, maxLimit)
+    limit = min(max(1, jobs), maxLimit) if adaptive else maxLimit
+
+    return Throttle(bandwidth=bandwidth, limit=limit, maxLimit=maxLimit, adaptive=adaptive, tokens=bandwidth)
+
+
+def _consume(throttle: Throttle | None, size: int):
+    """
+    Takes `size` bytes worth of tokens, sleeping until the bucket is out of
+    debt.
+    """
+    if throttle is None or throttle.bandwidth <= 0:
+        return
+
+    with throttle.condition:
+        now = time.monotonic()
+        throttle.tokens = min(
+            throttle.bandwidth, throttle.tokens + (now - throttle.refilled) * throttle.bandwidth
+        )
+        throttle.refilled = now
+
+        throttle.tokens -= size
+        wait = -throttle.tokens / throttle.bandwidth
+
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _isSlowdown(err: Exception) -> bool:
+    # Responses without a body (e.g. to HEAD requests) only have their status
+    if isinstance(err, ServerError):
+        return err.status_code == 503
+
+    return isinstance(err, S3Error) and err.code in SLOWDOWN_CODES
+
+
+def _acquire(throttle: Throttle):
+    with throttle.condition:
+        while throttle.active >= int(throttle.limit):
+            _ = throttle.condition.wait()
+        throttle.active += 1
+
+
+def _release(throttle: Throttle, start: float | None = None, size: int = 0, slowdown: bool = False):
+    """
+    Frees a request's slot and adjusts the limit to how it went (unless it
+    failed for another reason, without `start`).
+    """
+    now = time.monotonic()
+    latency = (now - start) / (size + REQUEST_OVERHEAD) if start is not None else 0
+    sizeClass = (size + REQUEST_OVERHEAD).bit_length()
+
+    with throttle.condition:
+        throttle.active -= 1
+
+        if throttle.adaptive and start is not None:
+            baseline = throttle.baselines.get(sizeClass)
+            congested = slowdown or (baseline is not None and latency > LATENCY_FACTOR * baseline)
+
+            if congested:
+                # Requests started before the last decrease already saw its cause
+                if start > throttle.decreased:
+                    throttle.limit = max(1.0, throttle.limit / 2)
+                    throttle.decreased = now
+                    logging.debug(
+                        f"Transfer {'throttled' if slowdown else 'congested'}, "
+                        f"{int(throttle.limit)} concurrent requests"
+                    )
+            else:
+                throttle.limit = min(float(throttle.maxLimit), throttle.limit + 1 / throttle.limit)
+
+            if not slowdown:
+                drifted = baseline * BASELINE_DRIFT if baseline else latency
+                throttle.baselines[sizeClass] = min(latency, drifted)
+
+        throttle.condition.notify_all()
+
+
+def _scheduled(throttle: Throttle | None, size: int, fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a request of about `size` bytes in one of the throttle's slots,
+    retrying it with a backoff when S3 throttles it.
+    """
+    if throttle is None:
+        return fn(*args, **kwargs)
+
+    attempt = 0
+    while True:
+        _acquire(throttle)
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as err:
+            if not _isSlowdown(err):
+                _release(throttle)
+                raise
+
+            _release(throttle, start, size, slowdown=True)
+            if attempt == SLOWDOWN_RETRIES:
+                raise
+
+            backoff = SLOWDOWN_BACKOFF * 2**attempt * random.uniform(0.5, 1.5)
+            logging.warning(f"S3 is throttling requests, retrying in {backoff:.1f}s: {err}")
+            time.sleep(backoff)
+            attempt += 1
+            continue
+
+        _release(throttle, start, size)
+        return result
@@ -1,2 +1,548 @@
+from backup.grip import (
+    GripConfig,
+    LoadConfig,
+    _checkpointPath,
+    _dump,
+    _dumpQuery,
+    _dumpSharded,
+    _findGraphs,
+    _getStats,
+    _iterVertices,
+    _load,
+    _parseBatches,
+    _readBatches,
+    _readCheckpoint,
+    _restore,
+    _splitRanges,
+    _write,
+)
+from backup.grip.incremental import _dumpIncremental, _restoreIncremental
+from backup.grip.rpc import _record
+import backup.grip
+import backup.grip.incremental
+import backup.grip.rpc
+import orjson
+import pytest
+import sys
+
+
 def testExample():
     assert True is not False
+
+
+def testWrite(tmp_path):
+    """
+    Tests writing a record stream through the writer thread.
+    """
+    records = ({"_id": str(i), "_label": "Patient"} for i in range(25001))
+
+    path = tmp_path / "TEST.vertices"
+    count = _write(records, path)
+
+    lines = path.read_bytes().splitlines()
+    assert count == len(lines) == 25001
+    assert orjson.loads(lines[-1]) == {"_id": "25000", "_label": "Patient"}
+
+
+def testWriteFailure(monkeypatch, tmp_path):
+    """
+    Tests that a writer failing to open its file fails the dump instead of
+    blocking the reader.
+    """
+    monkeypatch.setattr(backup.grip, "WRITE_BATCH", 10)
+    records = ({"_id": str(i), "_label": "Patient"} for i in range(1000))
+
+    with pytest.raises(FileNotFoundError):
+        _write(records, tmp_path / "missing" / "TEST.vertices")
+
+    # Same with a small dump, which would otherwise report success
+    with pytest.raises(FileNotFoundError):
+        _write([{"_id": "0"}], tmp_path / "missing" / "TEST.vertices")
+
+
+class FakeQuery(list):
+    """List standing in for a GRIP traversal"""
+
+    def outE(self, label=[]):
+        edges = ({"_id": f"e{v['_id']}", "_label": "link", "_from": v["_id"], "_to": "0"} for v in self)
+        return FakeQuery(e for e in edges if not label or e["_label"] == label)
+
+    def hasLabel(self, label):
+        return FakeQuery(v for v in self if v["_label"] == label)
+
+    def skip(self, n):
+        return FakeQuery(self[n:])
+
+    def count(self):
+        return FakeQuery([{"count": len(self)}])
+
+
+class FakeConnection:
+    """Stand-in for a gripql.Connection"""
+
+    def __init__(self, vertices: int = 3):
+        self.vertices = vertices
+
+    def graph(self, name):
+        return self
+
+    def V(self):
+        return FakeQuery(
+            {"_id": str(i), "_label": "Patient" if i % 2 else "Specimen"} for i in range(self.vertices)
+        )
+
+    def listLabels(self):
+        return {"vertex_labels": ["Patient", "Specimen"], "edge_labels": ["link"]}
+
+    def bulkAdd(self):
+        return FakeBulk()
+
+    def delete(self, vertices=[], edges=[]):
+        FakeBulk.deleted += [*vertices, *edges]
+
+
+class FakeResponse:
+    """Bulk response counting the records of a request"""
+
+    def __init__(self, data: bytes):
+        self.status_code = 200
+        self.reason = "OK"
+        self.text = ""
+        self.records = [orjson.loads(line) for line in data.split(b"\n")]
+
+    def json(self):
+        return {"insertCount": len(self.records), "errorCount": 0}
+
+
+class FakeBulk:
+    """Stand-in for gripql's BulkAdd, failing requests with a 'bad' record"""
+
+    url = "http://localhost:8201/v1/graph"
+    requests: list[list[dict]] = []
+    deleted: list[str] = []
+    opened = 0
+    closed = 0
+
+    def __init__(self):
+        self.session = self
+        FakeBulk.opened += 1
+
+    def close(self):
+        FakeBulk.closed += 1
+
+    def post(self, url, data):
+        response = FakeResponse(data)
+        FakeBulk.requests.append(response.records)
+        if any(r.get("vertex", {}).get("id") == "bad" for r in response.records):
+            raise RuntimeError("500 Server Error")
+        return response
+
+
+def testDump(monkeypatch, tmp_path):
+    """
+    Tests dumping vertices and edges concurrently.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection())
+
+    counts = _dump(GripConfig(host="localhost", port=8201), "TEST", True, True, tmp_path)
+
+    assert counts == {"vertices": 3, "edges": 3}
+    assert len((tmp_path / "TEST.edges").read_bytes().splitlines()) == 3
+
+
+def testDumpSharded(monkeypatch, tmp_path):
+    """
+    Tests exporting one shard per label with a manifest of counts.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection(5))
+
+    manifest = _dumpSharded(GripConfig(host="localhost", port=8201), "TEST", True, True, tmp_path, jobs=3)
+
+    counts = {(s["kind"], s["label"]): s["count"] for s in manifest["shards"]}
+    assert counts == {("vertices", "Patient"): 2, ("vertices", "Specimen"): 3, ("edges", "link"): 5}
+    assert (tmp_path / "TEST.shards" / "manifest.json").is_file()
+    assert (tmp_path / "TEST.shards" / "Patient.vertices").is_file()
+
+
+def testLoadBatches(monkeypatch, tmp_path):
+    """
+    Tests loading in bounded batches and reporting failed batches by line.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection())
+    FakeBulk.requests = []
+    FakeBulk.opened = FakeBulk.closed = 0
+
+    path = tmp_path / "TEST.vertices"
+    ids = [str(i) for i in range(10)]
+    ids[7] = "bad"
+    path.write_bytes(b"".join(orjson.dumps({"_id": i, "_label": "Patient", "age": 1}) + b"\n" for i in ids))
+
+    conf = LoadConfig(batchCount=3, inflight=2)
+    result = _load(GripConfig(host="localhost", port=8201), "TEST", path, "vertices", conf)
+
+    assert [len(r) for r in FakeBulk.requests] == [3, 3, 3, 1]
+    assert FakeBulk.requests[0][0] == {
+        "graph": "TEST",
+        "vertex": {"id": "0", "label": "Patient", "data": {"age": 1}},
+    }
+
+    assert result.count == 10
+    assert result.inserted == 7
+    assert [(batch.line, batch.count) for batch, _ in result.errors] == [(6, 3)]
+
+    # Every sender thread's bulk session is closed once the load is over
+    assert FakeBulk.closed == FakeBulk.opened >= 1
+
+
+def testLoadEdgeDirection(monkeypatch, tmp_path):
+    """
+    Tests that edges keep their direction when loaded.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection())
+    FakeBulk.requests = []
+
+    path = tmp_path / "TEST.edges"
+    path.write_bytes(orjson.dumps({"_id": "e", "_label": "link", "_from": "a", "_to": "b"}) + b"\n")
+
+    _load(GripConfig(host="localhost", port=8201), "TEST", path, "edges")
+
+    edge = FakeBulk.requests[0][0]["edge"]
+    assert (edge["from"], edge["to"]) == ("a", "b")
+
+
+def testParseBatches(tmp_path):
+    """
+    Tests parsing newline-aligned ranges in parser processes.
+    """
+    path = tmp_path / "TEST.vertices"
+    path.write_bytes(
+        b"".join(orjson.dumps({"_id": str(i), "_label": "Patient", "n": "x" * i}) + b"\n" for i in range(50))
+    )
+
+    ranges = _splitRanges(path, 200)
+    assert ranges[0][0] == 0 and ranges[-1][1] == path.stat().st_size
+    assert all(path.read_bytes()[end - 1 : end] == b"\n" for _, end in ranges)
+
+    conf = LoadConfig(batchCount=7, batchBytes=200, parsers=2)
+    batches = list(_parseBatches(path, "TEST", "vertices", conf))
+
+    assert sum(batch.count for batch in batches) == 50
+    assert [b.start for b in batches[1:]] == [b.end for b in batches[:-1]]
+    assert [b.line for b in batches[1:]] == [b.line + b.count for b in batches[:-1]]
+
+    payload = [record for batch in batches for record in batch.payload]
+    expected = [record for batch in _readBatches(path, "TEST", "vertices", conf) for record in batch.payload]
+    assert payload == expected
+
+
+def testResumeLoad(monkeypatch, tmp_path):
+    """
+    Tests resuming a load from the first failed batch.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection())
+    FakeBulk.requests = []
+    FakeBulk.opened = FakeBulk.closed = 0
+
+    path = tmp_path / "TEST.vertices"
+    ids = [str(i) for i in range(10)]
+    ids[7] = "bad"
+    path.write_bytes(b"".join(orjson.dumps({"_id": i, "_label": "Patient"}) + b"\n" for i in ids))
+
+    grip = GripConfig(host="localhost", port=8201)
+    result = _load(grip, "TEST", path, "vertices", LoadConfig(batchCount=3))
+    assert len(result.errors) == 1
+
+    checkpoint = _readCheckpoint(path, "restore", "localhost:8201/TEST")
+    assert (checkpoint.count, checkpoint.done) == (6, False)
+
+    # Fix the failed record and resume
+    ids[7] = "7"
+    path.write_bytes(b"".join(orjson.dumps({"_id": i, "_label": "Patient"}) + b"\n" for i in ids))
+    FakeBulk.requests = []
+
+    result = _load(grip, "TEST", path, "vertices", LoadConfig(batchCount=3, resume=True))
+    assert [[r["vertex"]["id"] for r in request] for request in FakeBulk.requests] == [["6", "7", "8"], ["9"]]
+    assert (result.count, result.errors) == (10, [])
+
+    # Nothing left to load, and another instance starts over
+    FakeBulk.requests = []
+    _load(grip, "TEST", path, "vertices", LoadConfig(resume=True))
+    assert FakeBulk.requests == []
+
+    _load(GripConfig(host="other", port=8201), "TEST", path, "vertices", LoadConfig(resume=True))
+    assert len(FakeBulk.requests[0]) == 10
+
+
+def testResumeDump(monkeypatch, tmp_path):
+    """
+    Tests resuming a dump after the last checkpointed record.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection(5))
+    grip = GripConfig(host="localhost", port=8201)
+
+    assert _dumpQuery(grip, "TEST", "vertices", tmp_path) == 5
+    path = tmp_path / "TEST.vertices"
+    lines = path.read_bytes().splitlines(keepends=True)
+
+    # Interrupted after two records, with a partial third one
+    path.write_bytes(b"".join(lines[:2]) + lines[2][:5])
+    checkpoint = {"offset": len(b"".join(lines[:2])), "count": 2, "done": False, "target": "localhost:8201/TEST"}
+    _checkpointPath(path, "backup").write_bytes(orjson.dumps(checkpoint))
+
+    assert _dumpQuery(grip, "TEST", "vertices", tmp_path, resume=True) == 5
+    assert path.read_bytes().splitlines(keepends=True) == lines
+    assert _readCheckpoint(path, "backup", "localhost:8201/TEST").done
+
+
+def testMsgpackFormat(monkeypatch, tmp_path):
+    """
+    Tests dumping to msgpack frames and loading them back.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection(25))
+    monkeypatch.setattr(backup.grip, "WRITE_BATCH", 10)
+    FakeBulk.requests = []
+    grip = GripConfig(host="localhost", port=8201)
+
+    assert _dump(grip, "TEST", True, True, tmp_path, format="msgpack") == {"vertices": 25, "edges": 25}
+    assert (tmp_path / "TEST.edges.msgpack").is_file()
+
+    _dump(grip, "JSON", True, True, tmp_path)
+    assert (tmp_path / "TEST.edges.msgpack").stat().st_size < (tmp_path / "JSON.edges").stat().st_size
+
+    results = _restore(grip, "TEST", tmp_path, LoadConfig(batchCount=10))
+    assert [r.count for r in results] == [25, 25]
+
+    # Batches are made of whole frames (of 10 records)
+    assert [len(r) for r in FakeBulk.requests] == [10, 10, 5, 10, 10, 5]
+    assert FakeBulk.requests[3][0] == {
+        "graph": "TEST",
+        "edge": {"id": "e0", "label": "link", "from": "0", "to": "0", "data": {}},
+    }
+
+    # A dump cut off mid-header or mid-frame is reported as truncated
+    data = (tmp_path / "TEST.edges.msgpack").read_bytes()
+    for cut in (2, backup.grip.FRAME_HEADER.size + 2):
+        (tmp_path / "CUT.edges.msgpack").write_bytes(data + data[:cut])
+        with pytest.raises(EOFError):
+            list(backup.grip._readFrames(tmp_path / "CUT.edges.msgpack", "CUT", "edges", LoadConfig()))
+
+
+def testStats(monkeypatch):
+    """
+    Tests streaming vertices and counting them per label on the server.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection(5))
+    grip = GripConfig(host="localhost", port=8201)
+
+    assert [v["_id"] for v in _iterVertices(grip, "TEST")] == ["0", "1", "2", "3", "4"]
+
+    assert _getStats(grip, "TEST") == {
+        "graph": "TEST",
+        "vertices": 5,
+        "edges": 5,
+        "labels": {"vertices": {"Patient": 2, "Specimen": 3}, "edges": {"link": 5}},
+    }
+
+
+def testIncremental(monkeypatch, tmp_path):
+    """
+    Tests dumping deltas against the previous run and restoring the chain.
+    """
+    grip = GripConfig(host="localhost", port=8201)
+    runs = {"2026-01-01T00:00:00": 5, "2026-01-02T00:00:00": 6, "2026-01-03T00:00:00": 4}
+
+    for run, vertices in runs.items():
+        monkeypatch.setattr(backup.grip.incremental, "_connect", lambda grip: FakeConnection(vertices))
+        (tmp_path / run).mkdir()
+        manifest = _dumpIncremental(grip, "TEST", True, True, tmp_path / run)
+
+    # Only the vertices (and edges) deleted since the previous run
+    assert manifest["base"] == "../2026-01-02T00:00:00"
+    assert manifest["kinds"]["vertices"] == {"records": 4, "upserted": 0, "deleted": 2}
+    assert (tmp_path / run / "TEST.delta.vertices").read_bytes() == b""
+
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection())
+    FakeBulk.requests, FakeBulk.deleted = [], []
+
+    results = _restoreIncremental(grip, "TEST", tmp_path / run)
+
+    assert [r.count for r in results] == [5, 5, 1, 1, 0, 0]
+    assert FakeBulk.requests[2] == [{"graph": "TEST", "vertex": {"id": "5", "label": "Patient", "data": {}}}]
+    assert sorted(FakeBulk.deleted) == ["4", "5", "e4", "e5"]
+
+
+def testFindGraphs(monkeypatch, tmp_path):
+    """
+    Tests discovering the graphs dumped in a directory.
+    """
+    monkeypatch.setattr(backup.grip, "_connect", lambda grip: FakeConnection())
+    monkeypatch.setattr(backup.grip.incremental, "_connect", lambda grip: FakeConnection())
+    grip = GripConfig(host="localhost", port=8201)
+
+    _dump(grip, "A", True, True, tmp_path)
+    _dump(grip, "A__schema__", True, True, tmp_path, format="msgpack")
+    _dumpSharded(grip, "B", True, True, tmp_path)
+    _dumpIncremental(grip, "C", True, True, tmp_path)
+    (tmp_path / "C.delta.vertices").touch()
+
+    assert _findGraphs(tmp_path) == ["A", "A__schema__", "B", "C"]
+
+
+def testGrpcRecords(tmp_path):
+    """
+    Tests converting gRPC traversal results into dump records.
+    """
+    vertex = {"vertex": {"id": "1", "label": "Patient", "data": {"age": 1}}}
+    edge = {"edge": {"id": "e", "label": "link", "from": "1", "to": "2"}}
+
+    assert _record(vertex) == {"_id": "1", "_label": "Patient", "age": 1}
+    assert _record(edge) == {"_id": "e", "_label": "link", "_from": "1", "_to": "2"}
+
+    # Without grpcio or the generated gripql modules, the error says what's missing
+    try:
+        import gripql_pb2_grpc  # noqa: F401
+    except ImportError:
+        grip = GripConfig(host="localhost", port=8201, transport="grpc")
+        with pytest.raises(RuntimeError, match="gripql_pb2"):
+            _dumpQuery(grip, "TEST", "vertices", tmp_path)
+
+
+# Subset of GRIP's gripql.proto used by the gRPC transport
+GRIPQL_PROTO = """
+syntax = "proto3";
+
+package gripql;
+
+import "google/protobuf/struct.proto";
+
+message GraphStatement {
+  oneof statement {
+    google.protobuf.ListValue v = 1;
+    google.protobuf.ListValue out_e = 2;
+  }
+}
+
+message GraphQuery {
+  string graph = 1;
+  repeated GraphStatement query = 2;
+}
+
+message Vertex {
+  string id = 1;
+  string label = 2;
+  google.protobuf.Struct data = 3;
+}
+
+message Edge {
+  string id = 1;
+  string label = 2;
+  string from = 3;
+  string to = 4;
+  google.protobuf.Struct data = 5;
+}
+
+message QueryResult {
+  oneof result {
+    Vertex vertex = 1;
+    Edge edge = 2;
+  }
+}
+
+message GraphElement {
+  string graph = 1;
+  Vertex vertex = 2;
+  Edge edge = 3;
+}
+
+message BulkEditResult {
+  int32 insert_count = 1;
+  int32 error_count = 2;
+}
+
+service Query {
+  rpc Traversal(GraphQuery) returns (stream QueryResult) {}
+}
+
+service Edit {
+  rpc BulkAdd(stream GraphElement) returns (BulkEditResult) {}
+}
+"""
+
+
+def testGrpcTransport(monkeypatch, tmp_path):
+    """
+    Tests dumping and loading a graph against an in-process gRPC server.
+    """
+    grpc = pytest.importorskip("grpc")
+    pytest.importorskip("grpc_tools")
+    from backup.grip.rpc import _generate
+    from concurrent.futures import ThreadPoolExecutor
+    from google.protobuf import json_format
+
+    proto = tmp_path / "proto" / "gripql.proto"
+    proto.parent.mkdir()
+    proto.write_text(GRIPQL_PROTO)
+    _generate(proto, tmp_path / "stubs")
+    monkeypatch.syspath_prepend(tmp_path / "stubs")
+    import gripql_pb2
+    import gripql_pb2_grpc
+
+    queries, loaded = [], []
+
+    class Query(gripql_pb2_grpc.QueryServicer):
+        def Traversal(self, request, context):
+            query = json_format.MessageToDict(request)
+            queries.append(query)
+            for i in range(25):
+                if any("outE" in s for s in query["query"]):
+                    yield gripql_pb2.QueryResult(edge={"id": f"e{i}", "label": "link", "from": str(i), "to": "0"})
+                else:
+                    yield gripql_pb2.QueryResult(vertex={"id": str(i), "label": "Patient", "data": {"age": i}})
+
+    class Edit(gripql_pb2_grpc.EditServicer):
+        def BulkAdd(self, request_iterator, context):
+            elements = list(request_iterator)
+            loaded.extend(elements)
+            return gripql_pb2.BulkEditResult(insert_count=len(elements))
+
+    server = grpc.server(ThreadPoolExecutor(max_workers=4))
+    gripql_pb2_grpc.add_QueryServicer_to_server(Query(), server)
+    gripql_pb2_grpc.add_EditServicer_to_server(Edit(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+
+    try:
+        grip = GripConfig(host="localhost", port=8201, transport="grpc", grpcPort=port)
+        assert _dump(grip, "TEST", True, True, tmp_path) == {"vertices": 25, "edges": 25}
+        assert sorted(queries, key=lambda q: len(q["query"])) == [
+            {"graph": "TEST", "query": [{"v": []}]},
+            {"graph": "TEST", "query": [{"v": []}, {"outE": []}]},
+        ]
+
+        vertices = [orjson.loads(line) for line in (tmp_path / "TEST.vertices").read_bytes().splitlines()]
+        assert vertices[3] == {"_id": "3", "_label": "Patient", "age": 3}
+
+        channels = []
+        channel = backup.grip.rpc._channel
+        monkeypatch.setattr(backup.grip.rpc, "_channel", lambda grip: channels.append(channel(grip)) or channels[-1])
+
+        results = _restore(grip, "TEST", tmp_path, LoadConfig(batchCount=10))
+        assert [(r.count, r.inserted) for r in results] == [(25, 25), (25, 25)]
+
+        # Each load closes its channel
+        assert len(channels) == 2
+        for closed in channels:
+            with pytest.raises(ValueError, match="closed channel"):
+                gripql_pb2_grpc.EditStub(closed).BulkAdd(iter([]))
+        elements = [json_format.MessageToDict(e) for e in loaded]
+        assert len(elements) == 50
+        assert {
+            "graph": "TEST",
+            "edge": {"id": "e24", "label": "link", "from": "24", "to": "0", "data": {}},
+        } in elements
+    finally:
+        server.stop(None)
+
+        # The generated modules only exist for this test
+        for name in ("gripql_pb2", "gripql_pb2_grpc"):
+            sys.modules.pop(name, None)
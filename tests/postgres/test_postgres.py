@@ -1,2 +1,558 @@
+from backup.postgres import (
+    DumpConfig,
+    PGConfig,
+    RestoreConfig,
+    _dump,
+    _dumpAll,
+    _dumpPath,
+    _dumpTable,
+    _filterArgs,
+    _getDumps,
+    _matchTable,
+    _restoreEnv,
+    _schedule,
+)
+from backup.postgres.copy import _export, _load, _ranges
+from backup.postgres.incremental import _reuse, _unchanged, _writeManifest
+from backup.postgres.wal import _archiveWal, _basebackup, _pickBasebackup, _recover
+from datetime import datetime
+from psycopg2 import sql
+import backup.postgres
+import backup.postgres.copy
+import orjson
+import os
+import pytest
+import shutil
+import socket
+import subprocess
+import tarfile
+import time
+
+
 def testExample():
     assert True is not False
+
+
+def testDumpAllCollectsFailures(monkeypatch, tmp_path):
+    """
+    Tests that a failing database does not abort the remaining dumps.
+    """
+
+    def fakeDump(pgConfig, db, dir, *args):
+        if db == "broken":
+            raise RuntimeError("pg_dump failed")
+        return dir / f"{db}.sql"
+
+    monkeypatch.setattr(backup.postgres, "_dump", fakeDump)
+
+    conf = PGConfig(host="localhost", port=5432, user="postgres")
+    dumps, errors = _dumpAll(conf, ["arborist", "broken", "fence"], tmp_path, jobs=2)
+
+    assert sorted(dumps) == ["arborist", "fence"]
+    assert list(errors) == ["broken"]
+
+
+def testScheduleLargestFirst():
+    """
+    Tests longest-processing-time ordering and the predicted makespan.
+    """
+    sizes = {"arborist": 10, "indexd": 70, "fence": 20, "metadata": 40}
+
+    order, makespan = _schedule(sizes, jobs=2)
+
+    assert order == ["indexd", "metadata", "fence", "arborist"]
+    assert makespan == 70
+
+    _, serial = _schedule(sizes, jobs=1)
+    assert serial == sum(sizes.values())
+
+
+def testDumpPathPrefersDirectoryFormat(tmp_path):
+    """
+    Tests locating a database's dump artifact by format.
+    """
+    assert _dumpPath(tmp_path, "indexd") == tmp_path / "indexd.sql"
+
+    (tmp_path / "indexd.dir").mkdir()
+    assert _dumpPath(tmp_path, "indexd") == tmp_path / "indexd.dir"
+
+
+def testCopyRanges():
+    """
+    Tests splitting a table into page ranges with an open-ended last range.
+    """
+    assert _ranges(0, 128) == [(0, None)]
+    assert _ranges(100, 128) == [(0, None)]
+    assert _ranges(300, 128) == [(0, 128), (128, 256), (256, None)]
+
+
+class FakeCursor:
+    """Stand-in for a psycopg2 cursor, answering the copy engine's queries"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        self.conn.events.append(("execute", query.split("(")[0].strip(), params))
+        if "pg_export_snapshot" in query:
+            self.result = [("00000003-1", 8192)]
+        elif "FROM pg_class" in query:
+            self.result = self.conn.tables
+        elif "FROM pg_sequences" in query:
+            self.result = [("public", "users_id_seq", 42)]
+        elif "pg_largeobject_metadata" in query:
+            self.result = [(True,)]
+        elif "lo_from_bytea" in query:
+            self.result = [(2,)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def copy_expert(self, query, f, size=8192):
+        self.conn.events.append(("copy", query))
+        if "TO STDOUT" in query:
+            f.write(query.encode())
+            self.rowcount = 3
+        elif "bad" in query:
+            raise RuntimeError("invalid input syntax")
+        else:
+            assert f.read()
+
+
+class FakePgConnection:
+    """Stand-in for a psycopg2 connection, logging to a shared event list"""
+
+    def __init__(self, events, tables=[]):
+        self.events = events
+        self.tables = tables
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def set_session(self, **kwargs):
+        pass
+
+    def commit(self):
+        self.events.append(("commit",))
+
+    def rollback(self):
+        self.events.append(("rollback",))
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fakeCopy(monkeypatch):
+    """
+    Fakes the connections and client tools of the copy engine, returning the
+    events they log.
+    """
+    events = []
+    tables = [
+        ("public", "users", 300, ["id", "name"], True),
+        ("public", "audit", 10, ["id"], True),
+        ("public", "empty", 0, ["id"], True),
+    ]
+    monkeypatch.setattr(backup.postgres.copy, "_connect", lambda pgConfig, db: FakePgConnection(events, tables))
+    monkeypatch.setattr(backup.postgres.copy, "_run", lambda command, env=None: events.append(("run", command[1:])))
+    monkeypatch.setattr(backup.postgres.shutil, "which", lambda tool: tool)
+
+    # Quoting without a server connection
+    monkeypatch.setattr(sql.Identifier, "as_string", lambda self, c: ".".join(f'"{s}"' for s in self.strings))
+    monkeypatch.setattr(sql.Literal, "as_string", lambda self, c: f"'{self.wrapped}'")
+    return events
+
+
+def testCopyExport(fakeCopy, tmp_path):
+    """
+    Tests exporting tables as page-range chunks from one snapshot.
+    """
+    conf = PGConfig(host="localhost", port=5432, user="postgres")
+    dumpConfig = DumpConfig(format="copy", jobs=2, chunkSize=128 * 8192, excludeTableData=["audit"])
+    out = _export(conf, "fence", tmp_path, dumpConfig)
+
+    # Only each table's own rows (ONLY), split by ctid
+    copies = sorted(event[1] for event in fakeCopy if event[0] == "copy")
+    assert copies == sorted(
+        [
+            'COPY (SELECT "id", "name" FROM ONLY "public"."users" '
+            "WHERE ctid >= '(0,0)'::tid AND ctid < '(128,0)'::tid) TO STDOUT (FORMAT binary)",
+            'COPY (SELECT "id", "name" FROM ONLY "public"."users" '
+            "WHERE ctid >= '(128,0)'::tid AND ctid < '(256,0)'::tid) TO STDOUT (FORMAT binary)",
+            'COPY (SELECT "id", "name" FROM ONLY "public"."users" '
+            "WHERE ctid >= '(256,0)'::tid) TO STDOUT (FORMAT binary)",
+            'COPY (SELECT "id" FROM ONLY "public"."empty") TO STDOUT (FORMAT binary)',
+            backup.postgres.copy.LARGE_OBJECTS_QUERY,
+        ]
+    )
+
+    # The schema comes from the same snapshot, with the same filters
+    schema = next(event[1] for event in fakeCopy if event[0] == "run")
+    assert "--snapshot=00000003-1" in schema and "--exclude-table-data=audit" in schema
+
+    manifest = orjson.loads((out / "manifest.json").read_bytes())
+    assert manifest["snapshot"] == "00000003-1"
+    assert manifest["sequences"] == [["public", "users_id_seq", 42]]
+    assert manifest["largeObjects"] == {"file": "data/large_objects.bin", "count": 3}
+    assert [(c["table"], c["start"], c["end"], c["rows"]) for c in manifest["chunks"]] == [
+        ("users", 0, 128, 3),
+        ("users", 128, 256, 3),
+        ("users", 256, None, 3),
+        ("empty", 0, None, 3),
+    ]
+    assert all((out / c["file"]).is_file() for c in manifest["chunks"])
+
+    # Large objects are left out of dumps restricted to some tables
+    fakeCopy.clear()
+    out = _export(conf, "fence", tmp_path, DumpConfig(format="copy", includeTables=["users"]))
+    manifest = orjson.loads((out / "manifest.json").read_bytes())
+    assert manifest["largeObjects"] is None
+    assert [c["table"] for c in manifest["chunks"]] == ["users"]
+
+
+def testCopyLoad(fakeCopy, tmp_path):
+    """
+    Tests loading pre-data, then the chunks, large objects and sequences, and
+    post-data last.
+    """
+    conf = PGConfig(host="localhost", port=5432, user="postgres")
+    out = _export(conf, "fence", tmp_path, DumpConfig(format="copy", chunkSize=128 * 8192))
+
+    fakeCopy.clear()
+    assert _load(conf, "fence", out, RestoreConfig(jobs=2)) == out
+
+    def step(event):
+        if event[0] == "run":
+            return "pre-data" if "--section=pre-data" in event[1] else "post-data"
+        if event[0] == "copy":
+            return "large objects" if "bak_large_objects" in event[1] else "chunk"
+        if event[0] == "execute" and "setval" in event[1]:
+            return "sequence"
+
+    steps = [step(event) for event in fakeCopy]
+    assert [step for step in steps if step] == ["pre-data", *["chunk"] * 5, "large objects", "sequence", "post-data"]
+    assert ("copy", 'COPY "public"."users" ("id", "name") FROM STDIN (FORMAT binary)') in fakeCopy
+
+    # A failed COPY is rolled back before its connection loads anything else
+    manifest = orjson.loads((out / "manifest.json").read_bytes())
+    manifest["chunks"][0]["table"] = "bad"
+    (out / "manifest.json").write_bytes(orjson.dumps(manifest))
+
+    fakeCopy.clear()
+    with pytest.raises(RuntimeError, match="invalid input syntax"):
+        _load(conf, "fence", out, RestoreConfig(jobs=1))
+    failed = next(i for i, e in enumerate(fakeCopy) if e[0] == "copy" and '"bad"' in e[1])
+    assert fakeCopy[failed + 1] == ("rollback",)
+
+
+def testGetDumps(tmp_path):
+    """
+    Tests discovering databases to restore from the dump directory.
+    """
+    (tmp_path / "arborist_local.sql").write_bytes(b"")
+    (tmp_path / "indexd_local.dir").mkdir()
+    (tmp_path / "metadata_local.copy").mkdir()
+    (tmp_path / "CALYPR.vertices").write_bytes(b"")
+
+    dumps = _getDumps(tmp_path)
+
+    assert dumps == {
+        "arborist_local": tmp_path / "arborist_local.sql",
+        "indexd_local": tmp_path / "indexd_local.dir",
+        "metadata_local": tmp_path / "metadata_local.copy",
+    }
+
+
+def testRestoreEnv(monkeypatch):
+    """
+    Tests passing the fast-restore profile through PGOPTIONS.
+    """
+    monkeypatch.delenv("PGOPTIONS", raising=False)
+
+    assert "PGOPTIONS" not in _restoreEnv(RestoreConfig())
+
+    env = _restoreEnv(RestoreConfig(fast=True, maintenanceWorkMem="2GB"))
+    assert env["PGOPTIONS"] == "-c synchronous_commit=off -c maintenance_work_mem=2GB"
+
+
+def testIncrementalUnchanged():
+    """
+    Tests detecting unchanged databases from pg_stat_database counters.
+    """
+    counters = {"xact_commit": 10, "tup_inserted": 5, "tup_updated": 1, "tup_deleted": 0}
+    previous = {"lsn": "0/100", "started": "t0", "dbs": {"wts": counters}}
+
+    # Only read-only transactions since the previous dump
+    stats = {"lsn": "0/200", "started": "t0", "dbs": {"wts": {**counters, "xact_commit": 42}}}
+    assert _unchanged(stats, previous, "wts")
+
+    # New rows
+    stats = {"lsn": "0/200", "started": "t0", "dbs": {"wts": {**counters, "tup_inserted": 6}}}
+    assert not _unchanged(stats, previous, "wts")
+
+    # Server restarted (counters reset)
+    stats = {"lsn": "0/200", "started": "t1", "dbs": {"wts": counters}}
+    assert not _unchanged(stats, previous, "wts")
+
+    # No previous dump
+    assert not _unchanged(stats, None, "wts")
+    assert not _unchanged(stats, previous, "fence")
+
+
+def testIncrementalReuse(monkeypatch, tmp_path):
+    """
+    Tests that dumping over a reused (hard linked) artifact leaves the base
+    run intact, and that runs with other table filters aren't reused.
+    """
+    stats = {"lsn": "0/100", "started": "t0", "dbs": {"wts": {"tup_inserted": 1}}}
+    base, dir = tmp_path / "2025-01-01T00:00:00", tmp_path / "2025-01-02T00:00:00"
+    base.mkdir()
+    dir.mkdir()
+    (base / "wts.sql").write_bytes(b"base")
+    _writeManifest(base, stats, {"wts": base / "wts.sql"}, {}, ["--table=public.*"])
+
+    assert _reuse(stats, base, ["wts"], dir, "custom") == {}
+    assert _reuse(stats, base, ["wts"], dir, "custom", ["--table=public.*"]) == {"wts": base / "wts.sql"}
+    assert (dir / "wts.sql").stat().st_ino == (base / "wts.sql").stat().st_ino
+
+    def fakeRun(command, **kwargs):
+        with open(command[command.index("--file") + 1], "wb") as f:
+            f.write(b"changed")
+
+    monkeypatch.setattr(backup.postgres.subprocess, "run", fakeRun)
+    monkeypatch.setattr(backup.postgres.shutil, "which", lambda tool: f"/usr/bin/{tool}")
+    conf = PGConfig(host="localhost", port=5432, user="postgres")
+    assert _dump(conf, "wts", dir) == dir / "wts.sql"
+
+    assert (dir / "wts.sql").read_bytes() == b"changed"
+    assert (base / "wts.sql").read_bytes() == b"base"
+    assert sorted(p.name for p in dir.iterdir()) == ["wts.sql"]
+
+
+def testArchiveWal(tmp_path):
+    """
+    Tests the archive_command shim, including retries of archived segments.
+    """
+    segment = tmp_path / "000000010000000000000001"
+    segment.write_bytes(b"wal")
+
+    archived = _archiveWal(segment, tmp_path / "backup")
+    assert archived.read_bytes() == b"wal"
+
+    # Postgres may retry a segment that was already archived
+    assert _archiveWal(segment, tmp_path / "backup") == archived
+
+    segment.write_bytes(b"other")
+    with pytest.raises(FileExistsError):
+        _archiveWal(segment, tmp_path / "backup")
+
+
+def testPickBasebackup(tmp_path):
+    """
+    Tests picking the latest base backup before the recovery target.
+    """
+    for name in ["2025-09-10T02:00:00", "2025-09-11T02:00:00"]:
+        (tmp_path / "base" / name).mkdir(parents=True)
+        (tmp_path / "base" / name / "base.tar.gz").write_bytes(b"")
+
+    assert _pickBasebackup(tmp_path).name == "2025-09-11T02:00:00"
+    assert _pickBasebackup(tmp_path, datetime(2025, 9, 10, 12)).name == "2025-09-10T02:00:00"
+
+    with pytest.raises(FileNotFoundError):
+        _pickBasebackup(tmp_path, datetime(2025, 9, 1))
+
+
+def testRecoverPartialWal(tmp_path):
+    """
+    Tests that the restore_command falls back to the segment pg_receivewal was
+    still writing (`%f.partial`) when the complete one is missing.
+    """
+    base = tmp_path / "backup" / "base" / "2025-09-12T00:00:00"
+    base.mkdir(parents=True)
+    (tmp_path / "PG_VERSION").write_text("17")
+    with tarfile.open(base / "base.tar.gz", "w:gz") as tar:
+        tar.add(tmp_path / "PG_VERSION", arcname="PG_VERSION")
+
+    wal = tmp_path / "backup" / "wal"
+    wal.mkdir()
+    (wal / "000000010000000000000001").write_bytes(b"complete")
+    (wal / "000000010000000000000002.partial").write_bytes(b"partial")
+
+    pgdata = _recover(tmp_path / "backup", tmp_path / "pgdata")
+    assert (pgdata / "recovery.signal").is_file()
+
+    conf = (pgdata / "postgresql.auto.conf").read_text()
+    restore = next(line for line in conf.splitlines() if line.startswith("restore_command"))
+    restore = restore.split(" = ", 1)[1][1:-1].replace("''", "'")
+
+    def restoreSegment(name: str) -> subprocess.CompletedProcess:
+        command = restore.replace("%f", name).replace("%p", (tmp_path / "RECOVERYXLOG").as_posix())
+        return subprocess.run(command, shell=True, capture_output=True)
+
+    assert restoreSegment("000000010000000000000001").returncode == 0
+    assert (tmp_path / "RECOVERYXLOG").read_bytes() == b"complete"
+
+    assert restoreSegment("000000010000000000000002").returncode == 0
+    assert (tmp_path / "RECOVERYXLOG").read_bytes() == b"partial"
+
+    # Recovery ends at the first segment missing from the archive
+    assert restoreSegment("000000010000000000000003").returncode != 0
+
+
+def _freePort() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def _startPostgres(pgdata, port: int, sockets) -> PGConfig:
+    subprocess.run(
+        [
+            "pg_ctl",
+            "--pgdata",
+            pgdata.as_posix(),
+            "--log",
+            (pgdata.parent / f"{pgdata.name}.log").as_posix(),
+            "--options",
+            f"-p {port} -k {sockets} -c listen_addresses=localhost",
+            "--wait",
+            "start",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return PGConfig(host="localhost", port=port, user="postgres")
+
+
+def _stopPostgres(pgdata):
+    subprocess.run(["pg_ctl", "--pgdata", pgdata.as_posix(), "--mode=fast", "stop"], capture_output=True)
+
+
+def _query(pgConfig: PGConfig, query: str):
+    c = backup.postgres._connect(pgConfig)
+    c.autocommit = True
+    try:
+        with c.cursor() as cur:
+            cur.execute(query)
+            return cur.fetchone()[0] if cur.description else None
+    finally:
+        c.close()
+
+
+@pytest.mark.skipif(
+    not all(shutil.which(tool) for tool in ["initdb", "pg_ctl", "pg_basebackup", "pg_receivewal"])
+    or os.geteuid() == 0,
+    reason="Postgres server binaries not found in PATH (or running as root)",
+)
+def testRecoverLocalPostgres(tmp_path):
+    """
+    Tests a point-in-time recovery against a local Postgres server, with the
+    last committed rows only in the `.partial` segment of pg_receivewal.
+    """
+    sockets = tmp_path / "sockets"
+    sockets.mkdir()
+    source = tmp_path / "source"
+    subprocess.run(
+        ["initdb", "--pgdata", source.as_posix(), "--username=postgres", "--auth=trust"],
+        check=True,
+        capture_output=True,
+    )
+
+    pgConfig = _startPostgres(source, _freePort(), sockets)
+    receiver = None
+    try:
+        _query(pgConfig, "CREATE TABLE items (id int)")
+        _query(pgConfig, "INSERT INTO items SELECT generate_series(1, 100)")
+
+        # Stream WAL synchronously so the partial segment is flushed on commit
+        (tmp_path / "backup" / "wal").mkdir(parents=True)
+        receiver = subprocess.Popen(
+            backup.postgres._command("pg_receivewal", pgConfig)
+            + ["--directory", (tmp_path / "backup" / "wal").as_posix(), "--synchronous"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        _basebackup(pgConfig, tmp_path / "backup")
+
+        _query(pgConfig, "INSERT INTO items SELECT generate_series(101, 150)")
+        lsn = _query(pgConfig, "SELECT pg_current_wal_lsn()")
+        for _ in range(100):
+            flushed = _query(
+                pgConfig,
+                "SELECT count(*) FROM pg_stat_replication "
+                f"WHERE application_name = 'pg_receivewal' AND flush_lsn >= '{lsn}'",
+            )
+            if flushed:
+                break
+            time.sleep(0.1)
+        else:
+            pytest.fail(f"pg_receivewal did not flush up to {lsn}")
+    finally:
+        if receiver:
+            receiver.terminate()
+            receiver.wait()
+        _stopPostgres(source)
+
+    assert list((tmp_path / "backup" / "wal").glob("*.partial"))
+
+    pgdata = _recover(tmp_path / "backup", tmp_path / "pgdata")
+    pgConfig = _startPostgres(pgdata, _freePort(), sockets)
+    try:
+        for _ in range(100):
+            if not _query(pgConfig, "SELECT pg_is_in_recovery()"):
+                break
+            time.sleep(0.1)
+        else:
+            pytest.fail("Recovered server was not promoted")
+
+        assert _query(pgConfig, "SELECT count(*) FROM items") == 150
+    finally:
+        _stopPostgres(pgdata)
+
+
+def testTableFilters():
+    """
+    Tests pg_dump style table patterns for dump engines not using pg_dump.
+    """
+    dumpConfig = DumpConfig(
+        excludeTables=["public.tmp_*"],
+        excludeTableData=["audit_log*"],
+    )
+
+    assert _dumpTable(dumpConfig, "public", "records") == (True, True)
+    assert _dumpTable(dumpConfig, "public", "tmp_import") == (False, False)
+    assert _dumpTable(dumpConfig, "public", "audit_log_2025") == (True, False)
+
+    # Like pg_dump, unqualified patterns only match tables in the search_path
+    dumpConfig = DumpConfig(includeTables=["records"])
+    assert _dumpTable(dumpConfig, "public", "records") == (True, True)
+    assert _dumpTable(dumpConfig, "other", "records", visible=False) == (False, False)
+    assert _dumpTable(dumpConfig, "public", "documents") == (False, False)
+
+    # Unquoted names are folded to lower case, quoted ones are literal
+    assert _matchTable("Records", "public", "records")
+    assert not _matchTable("Records", "public", "Records")
+    assert _matchTable('public."Records"', "public", "Records")
+    assert _matchTable('"Audit.Log*"', "public", "Audit.Log*")
+    assert not _matchTable('"Audit.Log*"', "public", "Audit.Log_2025")
+    assert _matchTable("PUBLIC.t?p_*", "public", "tmp_import")
+    assert _matchTable("mydb.public.records", "public", "records")
+    assert _matchTable("public.log$", "public", "log$")
+    with pytest.raises(ValueError):
+        _matchTable("a.b.c.d", "public", "records")
+
+    assert _filterArgs(DumpConfig(excludeTableData=["audit_log*"])) == [
+        "--exclude-table-data=audit_log*"
+    ]
@@ -1,2 +1,553 @@
+from backup.s3 import (
+    CATALOG,
+    S3Config,
+    SelectConfig,
+    TransferConfig,
+    _backup,
+    _download,
+    _listBackups,
+    _ranges,
+    _upload,
+    _uploadFiles,
+)
+from backup.s3.sync import _etag, _sync
+from backup.s3.dedup import CHUNKS_PREFIX
+from backup.s3.throttle import _consume, _isSlowdown, _release, _scheduled, _throttle
+from hashlib import md5
+from minio.error import S3Error, ServerError
+from pathlib import Path
+from types import SimpleNamespace
+import backup.s3
+import backup.s3.dedup
+import backup.s3.sync
+import backup.s3.throttle
+import pytest
+import random
+import shutil
+import threading
+import time
+
+
 def testExample():
     assert True is not False
+
+
+class FakeResponse:
+    """Streaming GET response"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def stream(self, amt):
+        for i in range(0, len(self.data), 3):
+            yield self.data[i : i + 3]
+
+    def read(self):
+        return self.data
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    """Stand-in for a Minio client, recording uploads"""
+
+    def __init__(self, fail: str | None = None, objects: dict[str, bytes] | None = None):
+        self.fail = fail
+        self.uploads: dict[str, dict] = {}
+        self.objects = objects or {}
+        self.gets: list[tuple[str, int, int]] = []
+        self.stats: list[str] = []
+        self.multipart: dict[str, dict[int, bytes]] = {}
+        self.parts: list[int] = []
+        self.slowdowns: dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False):
+        dirs = set()
+        for name, data in list(self.objects.items()):
+            if prefix and not name.startswith(prefix):
+                continue
+
+            # Delimiter listing: keys below the next "/" are grouped into a directory
+            rest = name.removeprefix(prefix or "")
+            if not recursive and "/" in rest:
+                dir = f"{prefix or ''}{rest.split('/')[0]}/"
+                if dir not in dirs:
+                    dirs.add(dir)
+                    yield SimpleNamespace(object_name=dir, size=0, is_dir=True, etag=None)
+                continue
+
+            yield SimpleNamespace(object_name=name, size=len(data), is_dir=False, etag=md5(data).hexdigest())
+
+    def stat_object(self, bucket_name, object_name):
+        with self.lock:
+            self.stats.append(object_name)
+        if object_name not in self.objects:
+            raise S3Error(None, "NoSuchKey", "Object does not exist", object_name, None, None)
+        return SimpleNamespace(object_name=object_name, size=len(self.objects[object_name]))
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0):
+        with self.lock:
+            self.gets.append((object_name, offset, length))
+        if self.fail and object_name.endswith(self.fail):
+            raise RuntimeError("503 SlowDown")
+        if object_name not in self.objects:
+            raise S3Error(None, "NoSuchKey", "Object does not exist", object_name, None, None)
+        data = self.objects[object_name]
+        return FakeResponse(data[offset : offset + length] if length else data[offset:])
+
+    def put_object(self, bucket_name, object_name, data, length, **kwargs):
+        with self.lock:
+            self.uploads[object_name] = kwargs
+            self.objects[object_name] = data.read(length)
+        return SimpleNamespace(etag=md5(self.objects[object_name]).hexdigest())
+
+    def _create_multipart_upload(self, bucket_name, object_name, headers):
+        with self.lock:
+            self.multipart[object_name] = {}
+        return f"upload-{object_name}"
+
+    def _upload_part(self, bucket_name, object_name, data, headers, upload_id, part_number):
+        with self.lock:
+            self.parts.append(part_number)
+            if self.slowdowns.get(part_number):
+                self.slowdowns[part_number] -= 1
+                raise S3Error(None, "SlowDown", "Please reduce your request rate.", object_name, None, None)
+        if self.fail and object_name.endswith(self.fail):
+            raise RuntimeError("503 SlowDown")
+        with self.lock:
+            self.multipart[object_name][part_number] = data
+        return md5(data).hexdigest()
+
+    def _complete_multipart_upload(self, bucket_name, object_name, upload_id, parts):
+        with self.lock:
+            uploaded = self.multipart.pop(object_name)
+            self.objects[object_name] = b"".join(uploaded[part.part_number] for part in parts)
+            self.uploads[object_name] = {"parts": len(parts)}
+        digests = b"".join(bytes.fromhex(part.etag) for part in parts)
+        return SimpleNamespace(etag=f'"{md5(digests).hexdigest()}-{len(parts)}"')
+
+    def _abort_multipart_upload(self, bucket_name, object_name, upload_id):
+        with self.lock:
+            self.multipart.pop(object_name, None)
+
+    def fput_object(self, bucket_name, object_name, file_path, progress=None, **kwargs):
+        if self.fail and object_name.endswith(self.fail):
+            raise RuntimeError("503 SlowDown")
+        if progress:
+            progress.update(Path(file_path).stat().st_size)
+        with self.lock:
+            self.uploads[object_name] = kwargs
+            self.objects[object_name] = Path(file_path).read_bytes()
+        return SimpleNamespace(etag=md5(self.objects[object_name]).hexdigest())
+
+
+def testUploadConcurrent(monkeypatch, tmp_path):
+    """
+    Tests uploading every file concurrently and reporting failures.
+    """
+    for i in range(8):
+        (tmp_path / "grip").mkdir(exist_ok=True)
+        (tmp_path / "grip" / f"{i}.vertices").write_bytes(b"x" * i)
+
+    # Checkpoints and incremental indexes stay local
+    (tmp_path / "grip" / "0.vertices.backup.checkpoint").write_bytes(b"{}")
+    (tmp_path / "grip" / "0.vertices.index").write_bytes(b"SQLite")
+
+    client = FakeMinio()
+    monkeypatch.setattr(backup.s3, "_getS3Client", lambda s3, connections=10, throttled=False: client)
+
+    conf = TransferConfig(jobs=3, partSize=16 * 1024**2, parts=2)
+    assert _upload(S3Config(endpoint="localhost", bucket="test"), tmp_path, conf) is None
+
+    assert len(client.uploads) == 8
+    assert client.objects[(tmp_path / "grip" / "7.vertices").as_posix()] == b"x" * 7
+
+    # Other files are still uploaded when one fails
+    client = FakeMinio(fail="3.vertices")
+    err = _upload(S3Config(endpoint="localhost", bucket="test"), tmp_path, conf)
+    assert isinstance(err, RuntimeError)
+    assert len(client.uploads) == 7
+
+
+def testUploadParts(monkeypatch, tmp_path):
+    """
+    Tests uploading large files as concurrent parts, retrying only the part
+    S3 throttles.
+    """
+    monkeypatch.setattr(backup.s3.throttle.time, "sleep", lambda _: None)
+    data = random.Random(0).randbytes(10 * 1024)
+    (tmp_path / "big.sql").write_bytes(data)
+
+    client = FakeMinio()
+    client.slowdowns = {3: 1}
+    monkeypatch.setattr(backup.s3, "_getS3Client", lambda s3, connections=10, throttled=False: client)
+
+    conf = TransferConfig(jobs=2, partSize=1024, parts=3)
+    assert _upload(S3Config(endpoint="localhost", bucket="test"), tmp_path, conf) is None
+
+    key = (tmp_path / "big.sql").as_posix()
+    assert client.objects[key] == data
+    assert client.uploads[key] == {"parts": 10}
+    assert sorted(client.parts) == [1, 2, 3, 3, 4, 5, 6, 7, 8, 9, 10]
+
+    # Its ETag is the one `bak s3 sync` computes locally
+    etags, errors = _uploadFiles(client, S3Config(endpoint="localhost", bucket="test"), [tmp_path / "big.sql"], conf)
+    assert errors == [] and etags[tmp_path / "big.sql"] == _etag(tmp_path / "big.sql", 1024)
+
+    # A failed part aborts the upload
+    client = FakeMinio(fail="big.sql")
+    assert isinstance(_upload(S3Config(endpoint="localhost", bucket="test"), tmp_path, conf), RuntimeError)
+    assert client.multipart == {} and key not in client.objects
+
+
+def testDownloadRanges(monkeypatch, tmp_path):
+    """
+    Tests downloading objects as concurrent ranged GETs.
+    """
+    assert _ranges(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert _ranges(0, 4) == []
+
+    objects = {"backup/big.sql": bytes(range(256)) * 40, "backup/empty": b"", "backup/grip/small": b"abc"}
+    client = FakeMinio(objects=objects)
+    monkeypatch.setattr(backup.s3, "_getS3Client", lambda s3, connections=10, throttled=False: client)
+
+    conf = TransferConfig(jobs=2, partSize=1000, parts=3)
+    assert _download(S3Config(endpoint="localhost", bucket="test"), tmp_path, conf) is None
+
+    for name, data in objects.items():
+        assert (tmp_path / name).read_bytes() == data
+    assert len([get for get in client.gets if get[0] == "backup/big.sql"]) == 11
+
+    # Failed objects leave no partial file behind
+    client = FakeMinio(fail="big.sql", objects=objects)
+    err = _download(S3Config(endpoint="localhost", bucket="test"), tmp_path / "failed", conf)
+    assert isinstance(err, RuntimeError)
+    assert sorted(p.name for p in (tmp_path / "failed" / "backup").iterdir()) == ["empty", "grip"]
+
+
+def testDownloadSelect(monkeypatch, tmp_path):
+    """
+    Tests downloading only the latest backup, or the keys matching globs.
+    """
+    objects = {
+        "backups/2025-01-01T00:00:00/postgres/fence.sql": b"old",
+        "backups/2025-01-02T00:00:00/postgres/fence.sql": b"new",
+        "backups/2025-01-02T00:00:00/grip/CALYPR.vertices": b"grip",
+        "backups/wal/000000010000000000000001": b"wal",
+    }
+    client = FakeMinio(objects=objects)
+    monkeypatch.setattr(backup.s3, "_getS3Client", lambda s3, connections=10, throttled=False: client)
+    s3 = S3Config(endpoint="localhost", bucket="test")
+
+    select = SelectConfig(prefix="backups", latest=True, exclude=["grip/*"])
+    assert _download(s3, tmp_path / "latest", selectConfig=select) is None
+    assert [p.relative_to(tmp_path / "latest").as_posix() for p in (tmp_path / "latest").rglob("*.*")] == [
+        "backups/2025-01-02T00:00:00/postgres/fence.sql"
+    ]
+    assert (tmp_path / "latest" / "backups/2025-01-02T00:00:00/postgres/fence.sql").read_bytes() == b"new"
+
+    select = SelectConfig(prefix="backups/", include=["*/postgres/*"])
+    assert _download(s3, tmp_path / "postgres", selectConfig=select) is None
+    assert len(list((tmp_path / "postgres").rglob("*.sql"))) == 2
+    assert not (tmp_path / "postgres" / "backups" / "wal").exists()
+
+    # No timestamped backup under the prefix
+    err = _download(s3, tmp_path / "none", selectConfig=SelectConfig(prefix="backups/wal", latest=True))
+    assert isinstance(err, FileNotFoundError)
+
+
+def testCatalog(monkeypatch, tmp_path):
+    """
+    Tests listing backups from the catalog maintained by uploads.
+    """
+    assert _backup("backups/2025-01-02T00:00:00/postgres/fence.sql") == ("backups/2025-01-02T00:00:00/", "postgres")
+    assert _backup("chunks/ab/abcdef") == ("chunks/", "other")
+
+    # entrypoint.sh writes every artifact side by side under the timestamp
+    for name, component in [
+        ("fence.sql", "postgres"),
+        ("fence.copy/public.users.csv", "postgres"),
+        ("postgres.manifest.json", "postgres"),
+        ("CALYPR.vertices", "grip"),
+        ("CALYPR.edges.msgpack", "grip"),
+        ("CALYPR.shards/Patient.vertices", "grip"),
+        ("README", "other"),
+    ]:
+        assert _backup(f"backups/2025-01-02T00:00:00/{name}") == ("backups/2025-01-02T00:00:00/", component)
+
+    monkeypatch.chdir(tmp_path)
+    for name, data in [("fence.sql", b"pg" * 100), ("CALYPR.vertices", b"grip")]:
+        path = Path("backups/2025-01-01T00:00:00") / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    client = FakeMinio(objects={"backups/2024-12-31T00:00:00/old.sql": b"old"})
+    monkeypatch.setattr(backup.s3, "_getS3Client", lambda s3, connections=10, throttled=False: client)
+    s3 = S3Config(endpoint="localhost", bucket="test")
+
+    # Uploads only add the backups they touch
+    assert _upload(s3, Path("backups/2025-01-01T00:00:00")) is None
+    assert _listBackups(s3) == {
+        "backups/2025-01-01T00:00:00/": {
+            "objects": 2,
+            "bytes": 204,
+            "components": {"grip": {"objects": 1, "bytes": 4}, "postgres": {"objects": 1, "bytes": 200}},
+        }
+    }
+
+    # Listing is a single GET of the catalog
+    client.gets = []
+    _ = _listBackups(s3)
+    assert client.gets == [(CATALOG, 0, 0)]
+
+    backups = _listBackups(s3, refresh=True)
+    assert sorted(backups) == ["backups/2024-12-31T00:00:00/", "backups/2025-01-01T00:00:00/"]
+    assert backups["backups/2024-12-31T00:00:00/"]["bytes"] == 3
+
+    # The catalog itself is never downloaded
+    assert _download(s3, Path("restore")) is None
+    assert not Path("restore", CATALOG).exists()
+
+
+def testSync(monkeypatch, tmp_path):
+    """
+    Tests syncing only files that differ, in both directions.
+    """
+    monkeypatch.chdir(tmp_path)
+    dir = Path("backup")
+    (dir / "grip").mkdir(parents=True)
+    (dir / "pg.sql").write_bytes(b"pg" * 100)
+    (dir / "grip" / "TEST.vertices").write_bytes(b"grip")
+
+    client = FakeMinio()
+    monkeypatch.setattr(backup.s3.sync, "_getS3Client", lambda s3, connections=10, throttled=False: client)
+    s3 = S3Config(endpoint="localhost", bucket="test")
+
+    assert _sync(s3, dir, "up") is None
+    assert sorted(client.uploads) == ["backup/grip/TEST.vertices", "backup/pg.sql"]
+
+    # Only the changed file is uploaded again, and the manifest never is
+    client.uploads = {}
+    (dir / "pg.sql").write_bytes(b"PG" * 100)
+    assert _sync(s3, dir, "up") is None
+    assert list(client.uploads) == ["backup/pg.sql"]
+
+    # Downloads only cover the directory's prefix, and skip files that are already there
+    client.objects["other/pg.sql"] = b"other"
+    client.objects["chunks/ab/abcdef"] = b"chunk"
+    shutil.rmtree(dir)
+    assert _sync(s3, dir, "down") is None
+    assert (dir / "pg.sql").read_bytes() == b"PG" * 100
+    assert sorted(p.as_posix() for p in dir.rglob("*") if p.is_file()) == [
+        "backup/.bak-sync.json",
+        "backup/grip/TEST.vertices",
+        "backup/pg.sql",
+    ]
+
+    client.gets = []
+    assert _sync(s3, dir, "down") is None
+    assert client.gets == []
+
+    # Syncing the current directory never pulls deduplicated chunks
+    (tmp_path / "restore").mkdir()
+    monkeypatch.chdir(tmp_path / "restore")
+    assert _sync(s3, Path("."), "down") is None
+    assert not Path("chunks").exists()
+    assert Path("other/pg.sql").read_bytes() == b"other"
+
+
+def testMultipartEtag(tmp_path):
+    """
+    Tests computing the ETag of a multipart upload.
+    """
+    path = tmp_path / "dump"
+    path.write_bytes(b"a" * 10 + b"b" * 5)
+
+    parts = md5(b"a" * 10).digest() + md5(b"b" * 5).digest()
+    assert _etag(path, 10) == f"{md5(parts).hexdigest()}-2"
+    assert _etag(path, 15) == md5(path.read_bytes()).hexdigest()
+
+
+def testDedup(monkeypatch, tmp_path):
+    """
+    Tests uploading only the chunks a previous backup doesn't share, and
+    reassembling the files from them.
+    """
+    monkeypatch.setattr(backup.s3.dedup, "CHUNK_MIN", 4 * 1024)
+    monkeypatch.setattr(backup.s3.dedup, "CHUNK_AVG", 16 * 1024)
+    monkeypatch.setattr(backup.s3.dedup, "CHUNK_MAX", 64 * 1024)
+
+    data = random.Random(0).randbytes(512 * 1024)
+    first, second = Path("backups/2025-01-01T00:00:00"), Path("backups/2025-01-02T00:00:00")
+    (tmp_path / first / "grip").mkdir(parents=True)
+    (tmp_path / first / "pg.sql").write_bytes(data)
+    (tmp_path / first / "grip" / "TEST.vertices").write_bytes(b"grip")
+    (tmp_path / first / "empty").write_bytes(b"")
+
+    client = FakeMinio()
+    monkeypatch.setattr(backup.s3.dedup, "_getS3Client", lambda s3, connections=10, throttled=False: client)
+    monkeypatch.chdir(tmp_path)
+    s3 = S3Config(endpoint="localhost", bucket="test")
+
+    assert backup.s3.dedup._upload(s3, first) is None
+    assert f"{first}/.bak-dedup.json" in client.objects
+    assert f"{first}/pg.sql" not in client.objects
+    chunks = [name for name in client.objects if name.startswith(CHUNKS_PREFIX)]
+    assert len(chunks) > 10
+
+    # An insertion in the middle of a file only changes the chunks around it,
+    # and only those are checked (the others are in the previous backup's index)
+    (tmp_path / second).mkdir()
+    (tmp_path / second / "pg.sql").write_bytes(data[: 256 * 1024] + b"changed" + data[256 * 1024 :])
+    client.uploads, client.stats = {}, []
+    assert backup.s3.dedup._upload(s3, second) is None
+    new = [name for name in client.uploads if name.startswith(CHUNKS_PREFIX)]
+    assert 1 <= len(new) <= 3
+    assert sorted(client.stats) == sorted(new)
+
+    # Chunks of older backups are found with a HEAD request instead
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "pg.sql").write_bytes(data)
+    client.uploads = {}
+    assert backup.s3.dedup._upload(s3, Path("other")) is None
+    assert [name for name in client.uploads if name.startswith(CHUNKS_PREFIX)] == []
+
+    restore = tmp_path / "restore"
+    assert backup.s3.dedup._download(s3, restore, selectConfig=SelectConfig(prefix="backups")) is None
+    assert (restore / first / "pg.sql").read_bytes() == data
+    assert (restore / first / "grip" / "TEST.vertices").read_bytes() == b"grip"
+    assert (restore / first / "empty").read_bytes() == b""
+    assert (restore / second / "pg.sql").read_bytes() == (tmp_path / second / "pg.sql").read_bytes()
+    assert not (restore / "other").exists()
+
+    # Indexes are listed without going through the chunks
+    listed = []
+    listObjects = client.list_objects
+
+    def listing(bucket_name, prefix=None, recursive=False):
+        listed.append(prefix)
+        return listObjects(bucket_name, prefix, recursive)
+
+    monkeypatch.setattr(client, "list_objects", listing)
+    assert backup.s3.dedup._download(s3, tmp_path / "all") is None
+    assert (tmp_path / "all" / "other" / "pg.sql").read_bytes() == data
+    assert not any(prefix and prefix.startswith(CHUNKS_PREFIX) for prefix in listed)
+
+    # Files with a missing chunk are reported and leave no partial file behind
+    del client.objects[new[0]]
+    err = backup.s3.dedup._download(s3, tmp_path / "failed")
+    assert isinstance(err, S3Error)
+    assert not (tmp_path / "failed" / second / "pg.sql").exists()
+    assert (tmp_path / "failed" / first / "pg.sql").read_bytes() == data
+
+
+def testMetadataClient(monkeypatch, tmp_path):
+    """
+    Tests that listings, indexes and the catalog go through a client that
+    retries throttled requests, and that listing failures are reported.
+    """
+    monkeypatch.setattr(backup.s3.dedup, "CHUNK_MIN", 4 * 1024)
+    monkeypatch.setattr(backup.s3.dedup, "CHUNK_AVG", 16 * 1024)
+    monkeypatch.setattr(backup.s3.dedup, "CHUNK_MAX", 64 * 1024)
+
+    data, metadata = FakeMinio(), FakeMinio()
+    metadata.objects = data.objects
+    for module in (backup.s3, backup.s3.dedup):
+        monkeypatch.setattr(
+            module, "_getS3Client", lambda s3, connections=10, throttled=False: data if throttled else metadata
+        )
+
+    monkeypatch.chdir(tmp_path)
+    dir = Path("backups/2025-01-01T00:00:00")
+    dir.mkdir(parents=True)
+    (dir / "pg.sql").write_bytes(random.Random(0).randbytes(64 * 1024))
+    s3 = S3Config(endpoint="localhost", bucket="test")
+
+    assert backup.s3.dedup._upload(s3, dir) is None
+    assert sorted(metadata.uploads) == [CATALOG, f"{dir}/.bak-dedup.json"]
+    assert data.uploads and all(name.startswith(CHUNKS_PREFIX) for name in data.uploads)
+
+    # A listing failing midway still returns (after the submitted downloads)
+    def listing(bucket_name, prefix=None, recursive=False):
+        yield SimpleNamespace(object_name=f"{dir}/.bak-dedup.json", size=1, is_dir=False, etag="")
+        raise S3Error(None, "SlowDown", "Please reduce your request rate", "", None, None)
+
+    monkeypatch.setattr(metadata, "list_objects", listing)
+    assert isinstance(_download(s3, Path("restore")), S3Error)
+    assert isinstance(backup.s3.dedup._download(s3, Path("restore")), S3Error)
+
+
+def testThrottle(monkeypatch):
+    """
+    Tests the bandwidth limit and the AIMD adjustment of concurrent requests.
+    """
+    sleeps = []
+    monkeypatch.setattr(backup.s3.throttle.time, "sleep", sleeps.append)
+    monkeypatch.setattr(backup.s3.throttle, "REQUEST_OVERHEAD", 0)
+
+    # The first second is a burst, then requests wait for their bytes
+    throttle = _throttle(100, jobs=2, maxLimit=8)
+    _consume(throttle, 100)
+    _consume(throttle, 300)
+    assert sleeps == [pytest.approx(3, abs=0.1)]
+
+    # Healthy requests ramp up by about one slot per round, up to the maximum
+    assert throttle.limit == 2
+    for _ in range(4):
+        throttle.active += 1
+        _release(throttle, time.monotonic() - 1, 1000)
+    assert int(throttle.limit) == 3
+    for _ in range(100):
+        throttle.active += 1
+        _release(throttle, time.monotonic() - 1, 1000)
+    assert throttle.limit == 8
+
+    # Latency spikes halve it, once per round
+    start = time.monotonic()
+    for _ in range(2):
+        throttle.active += 1
+        _release(throttle, start - 10, 1000)
+    assert throttle.limit == 4
+
+    # Smaller requests (slower per byte) are only compared with their own size
+    # class, so the tail of a largest-first upload doesn't read as congestion
+    for _ in range(20):
+        throttle.active += 1
+        _release(throttle, time.monotonic() - 1, 10)
+    assert throttle.limit > 4
+    throttle.limit = 4
+
+    # Throttled requests back off and are retried
+    calls = []
+
+    def request():
+        calls.append(1)
+        if len(calls) < 3:
+            raise S3Error(None, "SlowDown", "Please reduce your request rate.", "/test", None, None)
+        return "etag"
+
+    sleeps.clear()
+    assert _scheduled(throttle, 1000, request) == "etag"
+    assert len(calls) == 3 and len(sleeps) == 2
+
+    # HEAD requests have no error body, only their status
+    assert _isSlowdown(ServerError("server failed with HTTP status code 503", 503))
+    assert not _isSlowdown(ServerError("server failed with HTTP status code 500", 500))
+    assert int(throttle.limit) == 2
+    assert throttle.active == 0
+
+    # Other errors aren't retried
+    def failing():
+        calls.append(1)
+        raise RuntimeError("boom")
+
+    calls.clear()
+    with pytest.raises(RuntimeError):
+        _scheduled(throttle, 1000, failing)
+    assert len(calls) == 1
+    assert throttle.active == 0